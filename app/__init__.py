@@ -1,14 +1,17 @@
 import logging
-from flask import Flask
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from datetime import timedelta
+from quart import Quart
+from quart_rate_limiter import RateLimiter, RateLimit
+from quart_cors import cors
 from dotenv import load_dotenv
-from flask_cors import CORS
+from app.lib.async_clients import close_clients
 from app.annotation_graph.schema_handler import SchemaHandler
 from app.llm_handle.llm_models import get_llm_model
 from app.storage.qdrant import Qdrant
 from app.main import AiAssistance
 from app.rag.rag import RAG
+from app.socket_manager import init_socketio
+from app.lib.metrics import init_metrics
 from .routes import main_bp
 import os
 import yaml
@@ -55,21 +58,18 @@ def initialize_database():
         traceback.print_exc()
 
 def create_app():
-    """Creates and configures the Flask application."""
-    logger.info('Creating Flask app')
-    app = Flask(__name__)
-    CORS(app)
+    """Creates and configures the Quart (ASGI) application."""
+    logger.info('Creating Quart app')
+    app = Quart(__name__)
+    app = cors(app, allow_origin="*")
     
     config = load_config()
     app.config.update(config)
     logger.info('App config updated with loaded configuration')
 
-    # Apply rate limiting to the entire app (200 requests per minute)
-    limiter = Limiter(get_remote_address, 
-                      app=app,
-                      default_limits=["200 per minute"],
-                      )
-    logger.info('FlaskLimiter initialized')
+    # Apply rate limiting to the entire app (200 requests per minute per remote address)
+    limiter = RateLimiter(app, default_limits=[RateLimit(200, timedelta(minutes=1))])
+    logger.info('RateLimiter initialized')
 
     # Initialize SchemaHandler
     schema_handler = SchemaHandler(
@@ -94,7 +94,7 @@ def create_app():
     logger.info('ADVANCED LLM model initialized successfully')
 
     # Initialize AiAssistance
-    ai_assistant = AiAssistance(advanced_llm, basic_llm, schema_handler)
+    ai_assistant = AiAssistance(advanced_llm, basic_llm, schema_handler, model_routing=config.get('MODEL_ROUTING'))
     logger.info('AiAssistance initialized')
 
     # Store objects in app config
@@ -116,7 +116,7 @@ def create_app():
             logger.info('uploading sample web data to qdrant db')
             with open('sample_data.json') as data:
                 data = json.load(data)
-            rag = RAG(client,advanced_llm)
+            rag = RAG(llm=ai_assistant.llm_router, client=client)
             rag.save_doc_to_rag(data=data)
     except:
         import traceback
@@ -133,7 +133,15 @@ def create_app():
     app.register_blueprint(main_bp)
     logger.info('Blueprint "main_bp" registered')
 
-    logger.info('Flask app created successfully')
+    # progress events of long operations are pushed to the user's sockets
+    init_socketio(app)
+    # request and dependency metrics for Prometheus
+    init_metrics(app)
+
+    # async Redis, Qdrant and HTTP connections are opened per worker event loop
+    app.after_serving(close_clients)
+
+    logger.info('Quart app created successfully')
     return app
 
 from app import routes
\ No newline at end of file
@@ -1,8 +1,8 @@
 import copy
 import json
 import logging
-from flask import current_app
-import requests
+import asyncio
+import httpx
 import os
 from dotenv import load_dotenv
 from app.annotation_graph.neo4j_handler import Neo4jConnection
@@ -11,6 +11,8 @@ from app.llm_handle.llm_models import LLMInterface
 from app.prompts.annotation_prompts import EXTRACT_RELEVANT_INFORMATION_PROMPT, JSON_CONVERSION_PROMPT, SELECT_PROPERTY_VALUE_PROMPT
 from .dfs_handler import *
 from app.storage.sql_redis_storage import RedisGraphManager
+from app.lib.async_clients import get_http_client
+from app.lib.tracing import traced, span
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,7 +30,7 @@ class Graph:
         self.kg_service_url = os.getenv('ANNOTATION_SERVICE_URL')
         self.redis_graph_manager = RedisGraphManager()
 
-    def query_knowledge_graph(self, json_query, token):
+    async def query_knowledge_graph(self, json_query, token):
         """
         Query the knowledge graph service.
 
@@ -55,7 +57,7 @@ class Graph:
         
         try:
             logger.debug(f"Sending request to {self.kg_service_url} with payload: {payload}")
-            response = requests.post(
+            response = await get_http_client().post(
                 self.kg_service_url+'/query',
                 json=payload,
                 params=params,
@@ -64,24 +66,25 @@ class Graph:
             response.raise_for_status()
             json_response = response.json()
             # logger.info(f"Successfully queried the knowledge graph. 'nodes count': {len(json_response.get('nodes'))} 'edges count': {len(json_response.get('edges', []))}")
-            return response.json()
-        except requests.RequestException as e:
+            return json_response
+        except httpx.HTTPError as e:
             logger.error(f"Error querying knowledge graph: {e}")
-            if e.response is not None:
+            if isinstance(e, httpx.HTTPStatusError):
                 logger.error(f"Response content: {e.response.text}")
             return {"error": f"Failed to query knowledge graph: {str(e)}"}
 
-    def validated_json(self,query):
+    @traced("annotation.validate_json")
+    async def validated_json(self,query):
             logger.info(f"Starting annotation query processing for question: '{query}'")
 
             # Extract relevant information
-            relevant_information = self._extract_relevant_information(query)
+            relevant_information = await self._extract_relevant_information(query)
             
             # Convert to initial JSON
-            initial_json = self._convert_to_annotation_json(relevant_information, query)
+            initial_json = await self._convert_to_annotation_json(relevant_information, query)
             
             # Validate and update
-            validation = self._validate_and_update(initial_json)
+            validation = await self._validate_and_update(initial_json)
             
             # If validation failed, return the intermediate steps
             if validation["validation_report"]["validation_status"] == "failed":
@@ -105,9 +108,10 @@ class Graph:
                              "type": "annotation"},
                 }
 
-    def generate_graph(self, query, validated_json, token):
+    @traced("annotation.generate_graph")
+    async def generate_graph(self, query, validated_json, token):
         try:        
-            graph = self.query_knowledge_graph(validated_json, token) 
+            graph = await self.query_knowledge_graph(validated_json, token) 
 
             # Generate final answer using validated JSON
             # final_answer = self._provide_text_response(query, validated_json, graph)
@@ -117,7 +121,7 @@ class Graph:
                              "type": "annotation"},
             }
             # Store summary in Redis cache for 24 hours
-            self.redis_graph_manager.create_graph(graph_id=graph_id, graph_summary=summary_text)
+            await self.redis_graph_manager.create_graph(graph_id=graph_id, graph_summary=summary_text)
 
             logger.info("Completed query processing.")
             return response
@@ -126,29 +130,29 @@ class Graph:
             logger.error(f"An error occurred during graph generation: {e}")
             return {"text": f"I apologize, but I wasn't able to generate the graph you requested. Could you please rephrase your question or provide additional details so I can better understand what you're looking for?"}
 
-    def _extract_relevant_information(self, query):
+    async def _extract_relevant_information(self, query):
         try:
             logger.info("Extracting relevant information from the query.")
             prompt = EXTRACT_RELEVANT_INFORMATION_PROMPT.format(schema=self.enhanced_schema, query=query)
-            extracted_info =  self.llm.generate(prompt)
+            extracted_info =  await self.llm.agenerate(prompt, task="extract_relevant_information")
             logger.info(f"Extracted data: \n{extracted_info}")
             return extracted_info
         except Exception as e:
             logger.error(f"Failed to extract relevant information: {e}")
             raise
 
-    def _convert_to_annotation_json(self, relevant_information, query):
+    async def _convert_to_annotation_json(self, relevant_information, query):
         try:
             logger.info("Converting relevant information to annotation JSON format.")
             prompt = JSON_CONVERSION_PROMPT.format(query=query, extracted_information=relevant_information, schema=self.enhanced_schema)
-            json_data = self.llm.generate(prompt)
+            json_data = await self.llm.agenerate(prompt, task="json_conversion")
             logger.info(f"Converted JSON:\n{json.dumps(json_data, indent=2)}")
             return json_data
         except Exception as e:
             logger.error(f"Failed to convert information to annotation JSON: {e}")
             raise
 
-    def _validate_and_update(self, initial_json):
+    async def _validate_and_update(self, initial_json):
         try:
             logger.info("Validating and updating the JSON structure.")
             node_types = {}
@@ -185,12 +189,14 @@ class Graph:
                             "original_value": property_value
                         })
                     elif isinstance(property_value, str):
-                        similar_values = self.neo4j.get_similar_property_values(
-                            node_type, property_key, property_value
-                        )
+                        # the neo4j driver is blocking
+                        with span("neo4j.similar_property_values", node_type=node_type, property=property_key):
+                            similar_values = await asyncio.to_thread(
+                                self.neo4j.get_similar_property_values, node_type, property_key, property_value
+                            )
                         
                         if similar_values:
-                            selected_property = self._select_best_matching_property_value(
+                            selected_property = await self._select_best_matching_property_value(
                                 property_value, similar_values
                             )
                             
@@ -257,10 +263,10 @@ class Graph:
                 "validation_report": validation_report
             }
 
-    def _select_best_matching_property_value(self, user_input_value, possible_values):
+    async def _select_best_matching_property_value(self, user_input_value, possible_values):
         try:
             prompt = SELECT_PROPERTY_VALUE_PROMPT.format(search_query = user_input_value, possible_values=possible_values)
-            selected_value = self.llm.generate(prompt)
+            selected_value = await self.llm.agenerate(prompt, task="select_property_value")
             logger.info(f"Selected value: {selected_value}")
             return selected_value
         except Exception as e:
@@ -1,6 +1,7 @@
 import logging
 from typing import List
 from neo4j import GraphDatabase
+from app.lib.metrics import tracked
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,6 +29,7 @@ class Neo4jConnection:
             self._driver.close()
             self._driver = None
 
+    @tracked("neo4j", "similar_property_values")
     def get_similar_property_values(self, label: str, 
                                     property_key: str, 
                                     search_value: str, 
@@ -5,7 +5,9 @@ from app.storage.sql_redis_storage import RedisGraphManager
 import logging
 import os
 import difflib
-import requests
+import httpx
+from app.lib.async_clients import get_http_client
+from app.lib.tracing import traced
 
 
 # Configure logging with more detailed format
@@ -38,7 +40,7 @@ class HypothesisGeneration:
         self.redis_graph_manager = RedisGraphManager()
         logger.info("HypothesisGeneration initialized with LLM")
 
-    def _make_api_request(self, 
+    async def _make_api_request(self, 
                          method: str, 
                          url: str, 
                          token: str, 
@@ -64,23 +66,24 @@ class HypothesisGeneration:
         }
         try:
             logger.debug(f"Making {method} request to {url} with data {data} and params {params}")
+            client = get_http_client()
             if data and method.upper() == "POST":
-                response = requests.post(url, data=data, headers=headers)    
+                response = await client.post(url, data=data, headers=headers)    
             elif method.upper() == "GET":
-                response = requests.get(url, params=params, headers=headers)
+                response = await client.get(url, params=params, headers=headers)
             elif method.upper() == "POST":
-                response = requests.post(url, params=params, headers=headers)
+                response = await client.post(url, params=params, headers=headers)
             else:
                 return {"error": f"Unsupported HTTP method: {method}"}
                 
             response.raise_for_status()
             data = response.json()
             return data 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"API request failed: {e}")
             return {"error": f"Request failed Please Try Again"}
 
-    def get_enrich_id_genes_GO_terms(self, token: str, hypothesis_id: str, retrieved_keys: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any], str]:
+    async def get_enrich_id_genes_GO_terms(self, token: str, hypothesis_id: str, retrieved_keys: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any], str]:
         """
         Process the hypothesis_id to extract enrichment details using the retrieved_keys.
         Then query the appropriate endpoint to get graph/summary.
@@ -96,7 +99,7 @@ class HypothesisGeneration:
         logger.info(f"Processing hypothesis ID {hypothesis_id} with retrieved keys: {retrieved_keys}")
         
         # Step 1: Get hypothesis data
-        hypothesis_data = self._make_api_request(
+        hypothesis_data = await self._make_api_request(
             "GET", 
             HYPOTHESIS_DATA_API, 
             token, 
@@ -158,7 +161,7 @@ class HypothesisGeneration:
 
         # Get summary for the selected GO term
         logger.info(f"Fetching summary for enrich id {enrich_id} with GO ID {go_id}")
-        summary_response = self._make_api_request(
+        summary_response = await self._make_api_request(
             "POST", 
             HYPOTHESIS_DATA_API, 
             token, 
@@ -172,7 +175,7 @@ class HypothesisGeneration:
             logger.error("Failed to fetch graph and summary")
             return {"error": "Failed to fetch graph and summary"}, {}, ""
 
-    def get_by_hypothesis_id(self, token: str, hypothesis_id: str, query=None) -> Dict[str, Any]:
+    async def get_by_hypothesis_id(self, token: str, hypothesis_id: str, query=None) -> Dict[str, Any]:
         """
         Retrieve hypothesis information by ID.
         
@@ -195,12 +198,12 @@ class HypothesisGeneration:
                     "Authorization": f"Bearer {token}",
                     "Content-Type": "application/x-www-form-urlencoded"
                     }
-                response = requests.post(HYPOTHESIS_CHAT_ENDPOINT, data=data, headers=headers)
+                response = await get_http_client().post(HYPOTHESIS_CHAT_ENDPOINT, data=data, headers=headers)
                 response.raise_for_status()
                 data = response.json()
                 return data
             else:
-                cached_graph = self.redis_graph_manager.get_graph_by_id(hypothesis_id)
+                cached_graph = await self.redis_graph_manager.get_graph_by_id(hypothesis_id)
                 if cached_graph and cached_graph.get("summary"):
                     logger.info(f"Cache hit for graph_id={graph_id} {cached_graph}")
                     return {"text": cached_graph["summary"]}
@@ -214,10 +217,10 @@ class HypothesisGeneration:
                     "Content-Type": "application/x-www-form-urlencoded"
                 }
                 try:
-                    response = requests.post(HYPOTHESIS_CHAT_ENDPOINT, data=data, headers=headers)
+                    response = await get_http_client().post(HYPOTHESIS_CHAT_ENDPOINT, data=data, headers=headers)
                     response.raise_for_status()
                     data = response.json()
-                    self.redis_graph_manager.create_graph(graph_id=data['hypothesis_id'], graph_summary=data['summary'])
+                    await self.redis_graph_manager.create_graph(graph_id=data['hypothesis_id'], graph_summary=data['summary'])
                     return data
                 except Exception as e:
                     logger.error(f"Failed to retrieve hypothesis by ID: {response}")
@@ -225,7 +228,7 @@ class HypothesisGeneration:
         except:
             return None
 
-    def format_user_query(self, query: str) -> Dict[str, Any]:
+    async def format_user_query(self, query: str) -> Dict[str, Any]:
         """
         Format user query using the LLM to extract relevant parameters.
         
@@ -239,7 +242,7 @@ class HypothesisGeneration:
         
         try:
             prompt = hypothesis_format_prompt.format(question=query)
-            response = self.llm.generate(prompt)
+            response = await self.llm.agenerate(prompt, task="hypothesis_format")
             
             if not response:
                 logger.warning("LLM returned empty response for query formatting")
@@ -251,7 +254,7 @@ class HypothesisGeneration:
             logger.error(f"Error formatting user query: {str(e)}")
             return {}
 
-    def get_hypothesis(self, token: str, user_query: str) -> Union[Tuple[str, Dict[str, Any]], Dict[str, str]]:
+    async def get_hypothesis(self, token: str, user_query: str) -> Union[Tuple[str, Dict[str, Any]], Dict[str, str]]:
         """
         Generate a hypothesis based on the user query.
         
@@ -265,7 +268,7 @@ class HypothesisGeneration:
         logger.info(f"Generating hypothesis for query: {user_query}")
         
         # Format the user query
-        refactored_query = self.format_user_query(user_query)
+        refactored_query = await self.format_user_query(user_query)
         
         if not refactored_query:
             logger.warning("Failed to format user query")
@@ -285,7 +288,7 @@ class HypothesisGeneration:
             logger.info(f"Sending request to endpoint {HYPOTHESIS_MAIN_ENDPOINT} Hypothesis request parameters: {payload}")
             
             # Make request to generate hypothesis
-            response = self._make_api_request(
+            response = await self._make_api_request(
                 "POST",
                 HYPOTHESIS_MAIN_ENDPOINT,
                 token,
@@ -312,21 +315,26 @@ class HypothesisGeneration:
             logger.error(traceback.format_exc())
             return {"text": f"Sorry couldn't generate hypothesis for the given question {user_query}"}
 
-    def generate_hypothesis(self, token: str, user_query: str) -> Dict[str, Any]:
+    @traced("hypothesis.generate")
+    async def generate_hypothesis(self, token: str, user_query: str, progress=None) -> Dict[str, Any]:
         """
         Main method to generate a hypothesis response based on user query.
         
         Args:
             token: Authorization token
             user_query: User's query
+            progress: Optional callback progress(stage, step, total) called before each step
             
         Returns:
             Formatted hypothesis response with resource information
         """
         logger.info(f"Processing complete hypothesis generation for: {user_query}")
         
+        progress = progress or (lambda stage, step, total: None)
+
         # Get hypothesis ID and retrieved keys
-        result = self.get_hypothesis(token, user_query)
+        progress("generating_hypothesis", 1, 3)
+        result = await self.get_hypothesis(token, user_query)
         
         # Check if we got an error instead of a tuple
         if isinstance(result, dict) and "text" in result:
@@ -336,13 +344,15 @@ class HypothesisGeneration:
         hypothesis_id, retrieved_keys = result
         
         # Get enriched data
-        enriched_data, graph, go_term_used = self.get_enrich_id_genes_GO_terms(token, hypothesis_id, retrieved_keys)
+        progress("enriching", 2, 3)
+        enriched_data, graph, go_term_used = await self.get_enrich_id_genes_GO_terms(token, hypothesis_id, retrieved_keys)
         
         if "error" in enriched_data:
             logger.error(f"Failed to enrich hypothesis data: {enriched_data['error']}")
             return {"text": f"No hypothesis is found: {enriched_data['error']}"}
         
         # Generate final response
+        progress("writing_response", 3, 3)
         logger.info("Generating final hypothesis response")
         logger.info(f"Using GO term: {go_term_used}")
         
@@ -353,9 +363,9 @@ class HypothesisGeneration:
             graph=graph,
             go_term_used=go_term_used
         )
-        response_text = self.llm.generate(prompt)
+        response_text = await self.llm.agenerate(prompt, task="hypothesis_response")
         # Store summary in Redis cache for 24 hours
-        self.redis_graph_manager.create_graph(graph_id=hypothesis_id, graph_summary=response_text)
+        await self.redis_graph_manager.create_graph(graph_id=hypothesis_id, graph_summary=response_text)
 
         # Return in the new format with resource information
         return {
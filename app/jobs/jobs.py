@@ -0,0 +1,229 @@
+import threading
+import logging
+import json
+import time
+import uuid
+import os
+import redis
+from dotenv import load_dotenv
+from app.lib.async_clients import get_async_redis
+from app.jobs.queue import get_queue
+from app.socket_manager import publish
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+REDIS_URL = os.getenv('REDIS_URL')
+JOB_QUEUE = os.getenv('JOB_QUEUE', 'jobs')
+# finished jobs and their results are kept this many seconds
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', 86400))
+# jobs a user can have queued or running, more submissions are rejected
+JOB_MAX_PENDING_PER_USER = int(os.getenv('JOB_MAX_PENDING_PER_USER', 10))
+# jobs of a user running at the same time, the others wait in the queue
+JOB_MAX_RUNNING_PER_USER = int(os.getenv('JOB_MAX_RUNNING_PER_USER', 2))
+# seconds a running job holds its slot without a progress update, the slot of a job whose worker died is then freed
+JOB_SLOT_LEASE = int(os.getenv('JOB_SLOT_LEASE', 900))
+JOB_UPLOAD_DIR = os.getenv('JOB_UPLOAD_DIR', './data/uploads')
+
+PDF_INGESTION_JOB = "pdf_ingestion"
+HYPOTHESIS_JOB = "hypothesis"
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+# KEYS[1] running jobs of the user (zset of job id -> lease deadline), ARGV: now, deadline, job id, max running, ttl
+# the expired leases are dropped, a job that already holds a slot (recovered after a restart) keeps it
+_ACQUIRE_SLOT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZSCORE', KEYS[1], ARGV[3]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[4]) then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return 1
+end
+return 0
+"""
+
+
+# KEYS[1] pending jobs of the user (set), ARGV: job id, max pending, ttl
+# the count is checked and the job added in one step, concurrent submissions can't exceed the limit
+_ADD_PENDING = """
+if redis.call('SCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+class JobLimitExceeded(Exception):
+    pass
+
+
+class JobStore:
+    """
+    Status of the long running jobs (PDF ingestion, hypothesis generation) in Redis hashes `job:<id>`.
+
+    The web workers create jobs and read their status with the async methods, the job workers
+    update them with the blocking ones and every update is pushed to the user's sockets as a "job" event.
+    The job parameters are only read by the job worker, they are never returned with the status.
+    """
+    def __init__(self, url=REDIS_URL, queue_name=JOB_QUEUE, ttl=JOB_RESULT_TTL,
+                 max_pending=JOB_MAX_PENDING_PER_USER, max_running=JOB_MAX_RUNNING_PER_USER, lease=JOB_SLOT_LEASE):
+        self.url = url
+        self.queue = get_queue(queue_name)
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.max_running = max_running
+        self.lease = lease
+        self._redis = None
+        self._acquire_slot = None
+        self._lock = threading.Lock()
+
+    @property
+    def redis(self):
+        with self._lock:
+            if self._redis is None:
+                self._redis = redis.Redis.from_url(self.url, decode_responses=True)
+            return self._redis
+
+    @staticmethod
+    def _key(job_id):
+        return f"job:{job_id}"
+
+    @staticmethod
+    def _pending_key(user_id):
+        return f"jobs:pending:{user_id}"
+
+    @staticmethod
+    def _running_key(user_id):
+        return f"jobs:running:{user_id}"
+
+    async def create(self, job_type, user_id, params):
+        """
+        Records a queued job and pushes it to the job queue.
+
+        :raises JobLimitExceeded: when the user already has max_pending jobs queued or running.
+        :return: the job id.
+        """
+        client = get_async_redis(self.url)
+        pending = self._pending_key(user_id)
+        job_id = str(uuid.uuid4())
+        # the script object is cheap, the async client (and so the script) is bound to the running loop
+        add_pending = client.register_script(_ADD_PENDING)
+        if not await add_pending(keys=[pending], args=[job_id, self.max_pending, self.ttl]):
+            raise JobLimitExceeded(f"You already have {self.max_pending} jobs in progress, please wait for them to finish.")
+
+        now = time.time()
+        job = {"id": job_id, "type": job_type, "user_id": user_id, "status": QUEUED,
+               "progress": json.dumps({}), "created_at": now, "updated_at": now}
+        try:
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.hset(self._key(job_id), mapping=job)
+                pipe.expire(self._key(job_id), self.ttl)
+                await pipe.execute()
+            await self.queue.aenqueue({"type": job_type, "job_id": job_id, "user_id": user_id, "params": params},
+                                      job_id=job_id)
+        except BaseException as e:
+            # the job will never run, it neither counts as pending nor stays queued
+            try:
+                async with client.pipeline(transaction=True) as pipe:
+                    pipe.srem(pending, job_id)
+                    pipe.hset(self._key(job_id), mapping={
+                        **job, "status": FAILED, "error": f"Failed to queue the job: {type(e).__name__}: {e}",
+                        "updated_at": time.time()})
+                    pipe.expire(self._key(job_id), self.ttl)
+                    await pipe.execute()
+            except Exception:
+                logger.error(f"Failed to clean up job {job_id} that could not be queued", exc_info=True)
+            raise
+        logger.info(f"Queued {job_type} job {job_id} of user {user_id}")
+        return job_id
+
+    async def get(self, job_id, user_id=None):
+        """
+        :param user_id: only the jobs of this user are returned when it is passed.
+        :return: status, progress and result of the job, None when it does not exist (or expired).
+        """
+        job = await get_async_redis(self.url).hgetall(self._key(job_id))
+        if not job or (user_id is not None and job["user_id"] != str(user_id)):
+            return None
+        return self._status(job)
+
+    @staticmethod
+    def _status(job):
+        status = {
+            "id": job["id"],
+            "type": job["type"],
+            "status": job["status"],
+            "progress": json.loads(job.get("progress") or "{}"),
+            "created_at": float(job["created_at"]),
+            "updated_at": float(job["updated_at"]),
+        }
+        if "result" in job:
+            status["result"] = json.loads(job["result"])
+        if "error" in job:
+            status["error"] = job["error"]
+        return status
+
+    def acquire_slot(self, user_id, job_id):
+        """
+        Takes one of the running slots of the user for the job, returns False when they are all taken.
+        The slot is leased for `lease` seconds and renewed by every update of the job, the slot of a job whose
+        worker died is freed when its lease expires. A recovered job that still holds its slot takes it again.
+        """
+        if self._acquire_slot is None:
+            self._acquire_slot = self.redis.register_script(_ACQUIRE_SLOT)
+        now = time.time()
+        return bool(self._acquire_slot(keys=[self._running_key(user_id)],
+                                       args=[now, now + self.lease, job_id, self.max_running, self.lease]))
+
+    def release_slot(self, user_id, job_id):
+        self.redis.zrem(self._running_key(user_id), job_id)
+
+    def _update(self, job_id, user_id, **fields):
+        fields["updated_at"] = time.time()
+        self.redis.hset(self._key(job_id), mapping=fields)
+        # renews the lease of the slot, a job that released it (finished) is not added again
+        with self.redis.pipeline() as pipe:
+            pipe.zadd(self._running_key(user_id), {job_id: fields["updated_at"] + self.lease}, xx=True)
+            pipe.expire(self._running_key(user_id), self.lease)
+            pipe.execute()
+        publish(user_id, "job", self._status(self.redis.hgetall(self._key(job_id))))
+
+    def start(self, job_id, user_id):
+        self._update(job_id, user_id, status=RUNNING)
+
+    def progress(self, job_id, user_id, stage, step=None, total=None):
+        """Records the current stage of the job, with step out of total when the stage has several steps."""
+        progress = {"stage": stage}
+        if total:
+            progress.update(step=step, total=total, percent=round(100 * step / total))
+        self._update(job_id, user_id, progress=json.dumps(progress))
+
+    def finish(self, job_id, user_id, result):
+        self._update(job_id, user_id, status=SUCCEEDED, result=json.dumps(result, default=str))
+        self._close(job_id, user_id)
+
+    def fail(self, job_id, user_id, error):
+        self._update(job_id, user_id, status=FAILED, error=str(error))
+        self._close(job_id, user_id)
+
+    def _close(self, job_id, user_id):
+        self.redis.expire(self._key(job_id), self.ttl)
+        self.redis.srem(self._pending_key(user_id), job_id)
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """Returns the process wide JobStore."""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+        return _job_store
@@ -0,0 +1,148 @@
+import threading
+import logging
+import socket
+import json
+import time
+import uuid
+import os
+import redis
+from dotenv import load_dotenv
+from app.lib.async_clients import get_async_redis
+from app.lib.metrics import tracked
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+REDIS_URL = os.getenv('REDIS_URL')
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+# seconds before the first retry, doubled on every further attempt
+JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', 5))
+
+
+class Deferred(Exception):
+    """Raised by a handler to put the job back in the queue after `delay` seconds without counting an attempt."""
+    def __init__(self, delay):
+        super().__init__(f"deferred for {delay}s")
+        self.delay = delay
+
+
+class RedisQueue:
+    """
+    Durable job queue on Redis lists.
+
+    Jobs are JSON objects pushed to the `<name>` list. A worker atomically moves a job to its own
+    processing list (`<name>:processing:<worker>`) while handling it, so the jobs of a worker that
+    crashed are put back in the queue when it restarts. Failed jobs are retried with exponential
+    backoff through the `<name>:delayed` sorted set and moved to the `<name>:dead` dead letter list
+    after max_attempts.
+    """
+    def __init__(self, name, url=REDIS_URL, max_attempts=JOB_MAX_ATTEMPTS, backoff=JOB_RETRY_BACKOFF):
+        self.name = name
+        self.url = url
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.delayed = f"{name}:delayed"
+        self.dead = f"{name}:dead"
+        self._redis = None
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._redis
+
+    def _job(self, payload, job_id=None):
+        return json.dumps({"id": job_id or str(uuid.uuid4()), "payload": payload, "attempts": 0, "enqueued_at": time.time()})
+
+    @tracked("redis", "enqueue")
+    def enqueue(self, payload, job_id=None):
+        """Pushes a job from blocking code, returns the job id."""
+        job = self._job(payload, job_id)
+        self.redis.lpush(self.name, job)
+        return json.loads(job)["id"]
+
+    @tracked("redis", "enqueue")
+    async def aenqueue(self, payload, job_id=None):
+        """Pushes a job from a coroutine, returns the job id."""
+        job = self._job(payload, job_id)
+        await get_async_redis(self.url).lpush(self.name, job)
+        return json.loads(job)["id"]
+
+    def consume(self, handler, worker=None, stop=None):
+        """
+        Handles jobs until `stop` is set, handler(payload, job) is called for every job.
+
+        :param worker: name of the processing list, must be stable across restarts of the same worker.
+        :param stop: threading.Event ending the loop.
+        """
+        worker = worker or socket.gethostname()
+        stop = stop or threading.Event()
+        processing = f"{self.name}:processing:{worker}"
+
+        recovered = 0
+        while self.redis.lmove(processing, self.name, "RIGHT", "LEFT"):
+            recovered += 1
+        if recovered:
+            logger.warning(f"Put {recovered} unfinished jobs of worker {worker} back in {self.name}")
+
+        logger.info(f"Worker {worker} consuming {self.name}")
+        while not stop.is_set():
+            try:
+                self._promote_delayed()
+                raw = self.redis.blmove(self.name, processing, 1, "RIGHT", "LEFT")
+            except redis.RedisError as e:
+                logger.error(f"Queue {self.name} unavailable: {e}")
+                stop.wait(self.backoff)
+                continue
+            if raw is None:
+                continue
+
+            job = json.loads(raw)
+            start = time.perf_counter()
+            try:
+                handler(job["payload"], job)
+                logger.info(f"Job {job['id']} of {self.name} done in {time.perf_counter() - start:.2f}s")
+            except Deferred as e:
+                self.redis.zadd(self.delayed, {json.dumps(job): time.time() + e.delay})
+            except Exception as e:
+                self._fail(job, e)
+            finally:
+                self.redis.lrem(processing, 1, raw)
+
+    def _fail(self, job, error):
+        job["attempts"] += 1
+        job["error"] = f"{type(error).__name__}: {error}"
+        if job["attempts"] >= self.max_attempts:
+            logger.error(f"Job {job['id']} of {self.name} failed {job['attempts']} times, moved to {self.dead}: {job['error']}")
+            self.redis.lpush(self.dead, json.dumps(job))
+            return
+        delay = self.backoff * 2 ** (job["attempts"] - 1)
+        logger.warning(f"Job {job['id']} of {self.name} failed (attempt {job['attempts']}), retrying in {delay:.0f}s: {job['error']}")
+        self.redis.zadd(self.delayed, {json.dumps(job): time.time() + delay})
+
+    def _promote_delayed(self):
+        for raw in self.redis.zrangebyscore(self.delayed, 0, time.time(), start=0, num=100):
+            # only the worker that removes the job from the sorted set requeues it
+            if self.redis.zrem(self.delayed, raw):
+                self.redis.lpush(self.name, raw)
+
+    def stats(self):
+        return {
+            "queued": self.redis.llen(self.name),
+            "delayed": self.redis.zcard(self.delayed),
+            "dead": self.redis.llen(self.dead),
+        }
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue(name):
+    """Returns the process wide RedisQueue of the given name."""
+    with _queues_lock:
+        if name not in _queues:
+            _queues[name] = RedisQueue(name)
+        return _queues[name]
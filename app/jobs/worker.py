@@ -0,0 +1,161 @@
+"""
+Background workers of the assistant.
+
+The memory worker extracts the memories of the conversations and stores the user information
+queued by the assistant workers (MEMORY_QUEUE), the job worker runs the PDF ingestion and
+hypothesis generation jobs submitted to the /jobs endpoints (JOB_QUEUE).
+
+    python -m app.jobs.worker memory
+    python -m app.jobs.worker jobs
+"""
+import threading
+import argparse
+import asyncio
+import logging
+import signal
+import socket
+import os
+from dotenv import load_dotenv
+from app import load_config
+from app.llm_handle.llm_models import get_llm_model
+from app.llm_handle.model_router import ModelRouter
+from app.storage.memory_layer import MemoryManager
+from app.storage.qdrant import Qdrant
+from app.storage.sql_redis_storage import DatabaseManager, MEMORY_QUEUE, USER_INFORMATION_JOB, MEMORY_JOB
+from app.jobs.queue import get_queue, Deferred
+from app.jobs.jobs import get_job_store, JOB_QUEUE, PDF_INGESTION_JOB, HYPOTHESIS_JOB
+from app.lib.async_clients import close_clients
+from app.rag.rag import RAG
+from app.hypothesis_generation.hypothesis import HypothesisGeneration
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# memory extraction is mostly waiting on the LLM and Qdrant, so a worker process handles jobs in threads
+MEMORY_WORKER_CONCURRENCY = int(os.getenv('MEMORY_WORKER_CONCURRENCY', 4))
+JOB_WORKER_CONCURRENCY = int(os.getenv('JOB_WORKER_CONCURRENCY', 4))
+# seconds before a job of a user who has all of the running slots is tried again
+JOB_SLOT_RETRY_DELAY = float(os.getenv('JOB_SLOT_RETRY_DELAY', 2))
+
+
+class Worker:
+    """Handles the jobs of a queue in `concurrency` threads until stop is set."""
+    name = "worker"
+
+    def __init__(self, queue_name, concurrency):
+        self.queue = get_queue(queue_name)
+        self.concurrency = concurrency
+        self.stop = threading.Event()
+
+    def handle(self, payload, job):
+        raise NotImplementedError
+
+    def run(self):
+        hostname = socket.gethostname()
+        threads = [
+            threading.Thread(target=self.queue.consume, args=(self.handle, f"{hostname}:{i}", self.stop), daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        logger.info(f"{self.name} started with {self.concurrency} threads")
+        for thread in threads:
+            thread.join()
+        logger.info(f"{self.name} stopped")
+
+
+class MemoryWorker(Worker):
+    name = "Memory worker"
+
+    def __init__(self, llm, queue_name=MEMORY_QUEUE, concurrency=MEMORY_WORKER_CONCURRENCY):
+        super().__init__(queue_name, concurrency)
+        self.llm = llm
+        self.store = DatabaseManager()
+        self.client = Qdrant()
+
+    def handle(self, payload, job):
+        if payload["type"] == USER_INFORMATION_JOB:
+            self.store.persist_user_information(self.llm, payload["query"], payload["user_id"], payload.get("context"),
+                                                job, self.client)
+        elif payload["type"] == MEMORY_JOB:
+            MemoryManager(self.llm, self.client).add_memory(payload["message"], payload["user_id"], job)
+        else:
+            raise ValueError(f"Unknown memory job type {payload['type']}")
+
+
+class JobWorker(Worker):
+    """
+    Runs the PDF ingestion and hypothesis generation jobs and records their progress and result in the JobStore.
+    A job of a user who already runs JOB_MAX_RUNNING_PER_USER jobs goes back to the queue for a while,
+    so one user's uploads don't hold all of the threads. Failed jobs are not retried, the error is reported.
+    """
+    name = "Job worker"
+
+    def __init__(self, llm, queue_name=JOB_QUEUE, concurrency=JOB_WORKER_CONCURRENCY):
+        super().__init__(queue_name, concurrency)
+        self.jobs = get_job_store()
+        self.rag = RAG(llm=llm)
+        self.hypothesis_generation = HypothesisGeneration(llm)
+        self.handlers = {
+            PDF_INGESTION_JOB: self.ingest_pdf,
+            HYPOTHESIS_JOB: self.generate_hypothesis,
+        }
+
+    def handle(self, payload, job):
+        job_id, user_id = payload["job_id"], payload["user_id"]
+        if not self.jobs.acquire_slot(user_id, job_id):
+            raise Deferred(JOB_SLOT_RETRY_DELAY)
+        try:
+            self.jobs.start(job_id, user_id)
+            result = self.handlers[payload["type"]](job_id, user_id, payload["params"])
+            self.jobs.finish(job_id, user_id, result)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed", exc_info=True)
+            self.jobs.fail(job_id, user_id, f"{type(e).__name__}: {e}")
+        finally:
+            self.jobs.release_slot(user_id, job_id)
+
+    def ingest_pdf(self, job_id, user_id, params):
+        path = params["path"]
+        try:
+            # the saved upload is read by the extraction processes directly
+            response = self.rag.save_retrievable_docs(
+                path, user_id, file_name=params["file_name"],
+                progress=lambda stage, step=None, total=None: self.jobs.progress(job_id, user_id, stage, step, total))
+            if response is None:
+                raise RuntimeError("Error uploading your document.")
+            return response
+        finally:
+            os.remove(path)
+
+    def generate_hypothesis(self, job_id, user_id, params):
+        async def run():
+            try:
+                return await self.hypothesis_generation.generate_hypothesis(
+                    token=params["token"], user_query=params["query"],
+                    progress=lambda stage, step, total: self.jobs.progress(job_id, user_id, stage, step, total))
+            finally:
+                # every job runs on its own event loop
+                await close_clients()
+        return asyncio.run(run())
+
+
+def main(kind):
+    config = load_config()
+    basic_llm = get_llm_model(model_provider=os.getenv('BASIC_LLM_PROVIDER'), model_version=os.getenv('BASIC_LLM_VERSION'))
+    advanced_llm = get_llm_model(model_provider=os.getenv('ADVANCED_LLM_PROVIDER'), model_version=os.getenv('ADVANCED_LLM_VERSION'))
+    llm_router = ModelRouter({"advanced": advanced_llm, "basic": basic_llm}, config.get('MODEL_ROUTING'))
+
+    worker = MemoryWorker(llm_router) if kind == "memory" else JobWorker(llm_router)
+    # the job being handled is finished before the worker exits, unfinished jobs are recovered on restart
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop.set())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop.set())
+    worker.run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a background worker of the assistant")
+    parser.add_argument("kind", nargs="?", default="memory", choices=["memory", "jobs"])
+    main(parser.parse_args().kind)
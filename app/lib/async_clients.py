@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import weakref
+import time
+import logging
+import os
+import httpx
+import redis.asyncio as aioredis
+from qdrant_client import AsyncQdrantClient
+from dotenv import load_dotenv
+from app.lib.tracing import record_span
+from app.lib.metrics import track, count_dependency_error
+from app.llm_handle.clients import close_async_clients
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+REDIS_URL = os.getenv('REDIS_URL')
+QDRANT_URL = os.environ.get('QDRANT_CLIENT', 'http://localhost:6333')
+# connection pool of the outgoing requests to the annotation and hypothesis services
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', 20))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 120))
+# outgoing requests are named after the service they call in traces and metrics
+HTTP_SERVICES = {
+    "annotation_service": os.getenv('ANNOTATION_SERVICE_URL'),
+    "hypothesis_chat": os.getenv('HYPOTHESIS_CHAT_ENDPOINT'),
+    "hypothesis_main": os.getenv('HYPOTHESIS_MAIN_ENDPOINT'),
+    "hypothesis_data": os.getenv('HYPOTHESIS_DATA_API'),
+}
+
+_lock = threading.Lock()
+# async clients hold connections bound to the event loop that opened them,
+# so they are kept per loop like the async LLM clients
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+def _get_loop_clients():
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _loop_clients.get(loop)
+        if clients is None:
+            clients = {}
+            _loop_clients[loop] = clients
+        return clients
+
+
+def http_service(url):
+    """Name of the service the url belongs to, "http" for unknown urls."""
+    url = str(url)
+    for name, base in HTTP_SERVICES.items():
+        if base and url.startswith(base):
+            return name
+    return "http"
+
+
+class _TrackedTransport(httpx.AsyncHTTPTransport):
+    """Records a span and the dependency metrics of every request, timed until the response headers are received."""
+    async def handle_async_request(self, request):
+        service = http_service(request.url)
+        start = time.perf_counter()
+        with track(service, request.method):
+            response = await super().handle_async_request(request)
+        if response.status_code >= 400:
+            count_dependency_error(service, request.method)
+        record_span(service, time.perf_counter() - start,
+                    method=request.method, path=request.url.path, status=response.status_code)
+        return response
+
+
+def get_http_client():
+    """
+    Returns the pooled httpx.AsyncClient of the running event loop.
+    Must be called from inside a coroutine.
+    """
+    clients = _get_loop_clients()
+    if "http" not in clients:
+        clients["http"] = httpx.AsyncClient(
+            transport=_TrackedTransport(limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                                            max_keepalive_connections=HTTP_MAX_KEEPALIVE)),
+            timeout=HTTP_TIMEOUT)
+    return clients["http"]
+
+
+def get_async_redis(url=REDIS_URL):
+    """Returns the redis.asyncio client of the running event loop, responses are decoded to str."""
+    clients = _get_loop_clients()
+    key = ("redis", url)
+    if key not in clients:
+        clients[key] = aioredis.Redis.from_url(url, decode_responses=True)
+    return clients[key]
+
+
+def get_async_qdrant(url=QDRANT_URL):
+    """Returns the AsyncQdrantClient of the running event loop."""
+    clients = _get_loop_clients()
+    key = ("qdrant", url)
+    if key not in clients:
+        clients[key] = AsyncQdrantClient(url)
+    return clients[key]
+
+
+async def close_clients():
+    """
+    Closes the clients of the running event loop, the LLM clients included,
+    called when the ASGI worker shuts down and when a job's event loop is done.
+    """
+    await close_async_clients()
+    clients = _loop_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        try:
+            # httpx and redis close with aclose, qdrant with close
+            close = getattr(client, "aclose", None) or client.close
+            await close()
+        except Exception as e:
+            logger.warning(f"Failed to close {type(client).__name__}: {e}")
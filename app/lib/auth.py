@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from quart import request, jsonify
 import jwt
 from functools import wraps
 from dotenv import load_dotenv
@@ -10,24 +10,31 @@ load_dotenv()
 # JWT Secret Key
 JWT_SECRET = os.getenv("JWT_SECRET")
 
+def decode_token(token):
+    """
+    Returns the user id and the token without its 'Bearer' prefix.
+    Raises when the token is invalid.
+    """
+    # Remove 'Bearer' prefix if present
+    if 'Bearer' in token:
+        token = token.split()[1]
+
+    data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], options={"verify_sub": False})
+    return data['user_id'], token
+
 def token_required(f):
     @wraps(f)
-    def decorated(*args, **kwargs):
+    async def decorated(*args, **kwargs):
         token = request.headers.get('Authorization')
         if not token:
             return jsonify({'text': 'Token is missing!'}), 403
         
         try:
-            # Remove 'Bearer' prefix if present
-            if 'Bearer' in token:
-                token = token.split()[1]
-            
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], options={"verify_sub": False})
-            current_user_id = data['user_id']
+            current_user_id, token = decode_token(token)
         except Exception as e:
             logging.error(f"Error docodcing token: {e}")
             return {'text': 'Token is invalid!'}, 403
         
         # Pass current_user_id, Bearer token and maintain other args
-        return f(current_user_id, token, *args, **kwargs)
+        return await f(current_user_id, token, *args, **kwargs)
     return decorated
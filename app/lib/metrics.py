@@ -0,0 +1,137 @@
+import contextlib
+import functools
+import inspect
+import logging
+import time
+import os
+from dotenv import load_dotenv
+from quart import request, g, Response
+
+# prometheus_client reads PROMETHEUS_MULTIPROC_DIR when it is imported
+load_dotenv()
+# shared by the gunicorn workers, the values of every worker are summed when /metrics is scraped
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import (Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest,
+                               CONTENT_TYPE_LATEST, multiprocess)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+
+# LLM calls take seconds, storage calls milliseconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+REQUEST_LATENCY = Histogram(
+    "assistant_request_duration_seconds", "Latency of the HTTP requests until the response headers are sent",
+    ["route", "method", "status", "resource"], buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge(
+    "assistant_requests_in_flight", "HTTP requests being processed", ["route"], multiprocess_mode="livesum")
+DEPENDENCY_LATENCY = Histogram(
+    "assistant_dependency_duration_seconds", "Latency of the calls to external dependencies",
+    ["dependency", "operation"], buckets=LATENCY_BUCKETS)
+DEPENDENCY_ERRORS = Counter(
+    "assistant_dependency_errors_total", "Failed calls to external dependencies", ["dependency", "operation"])
+DEPENDENCY_IN_FLIGHT = Gauge(
+    "assistant_dependency_in_flight", "Calls to external dependencies in progress", ["dependency"],
+    multiprocess_mode="livesum")
+CACHE_LOOKUPS = Counter(
+    "assistant_cache_lookups_total", "Cache lookups, the hit ratio is hits over all lookups", ["cache", "result"])
+
+
+@contextlib.contextmanager
+def track(dependency, operation):
+    """
+    Times a call to an external dependency (openai, gemini, qdrant, neo4j, redis, sqlite,
+    annotation_service, hypothesis_*), counting it as an error when the block raises.
+    Cancelled calls and closed streams are not errors.
+    """
+    DEPENDENCY_IN_FLIGHT.labels(dependency).inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DEPENDENCY_ERRORS.labels(dependency, operation).inc()
+        raise
+    finally:
+        DEPENDENCY_LATENCY.labels(dependency, operation).observe(time.perf_counter() - start)
+        DEPENDENCY_IN_FLIGHT.labels(dependency).dec()
+
+
+def tracked(dependency, operation):
+    """Decorator tracking every call of a function or coroutine function with `track`."""
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def wrapper(*args, **kwargs):
+                with track(dependency, operation):
+                    return await f(*args, **kwargs)
+        else:
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                with track(dependency, operation):
+                    return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_dependency_error(dependency, operation):
+    """Counts a call that returned an error without raising, e.g. an HTTP error status."""
+    DEPENDENCY_ERRORS.labels(dependency, operation).inc()
+
+
+def count_cache_lookup(cache, hit, count=1):
+    """:param count: number of lookups, e.g. the texts of an embedding batch."""
+    if count:
+        CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc(count)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+async def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_route = _route()
+    REQUESTS_IN_FLIGHT.labels(g.metrics_route).inc()
+
+
+async def _end_request(response):
+    start = g.get("metrics_start")
+    if start is not None:
+        REQUEST_LATENCY.labels(g.metrics_route, request.method, str(response.status_code),
+                               g.get("resource", "none")).observe(time.perf_counter() - start)
+    return response
+
+
+async def _teardown_request(exc=None):
+    # runs for failed requests too, after_request does not
+    if g.get("metrics_route") is not None:
+        REQUESTS_IN_FLIGHT.labels(g.metrics_route).dec()
+
+
+async def _metrics():
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    """
+    Registers the request metrics hooks and the Prometheus endpoint.
+    Under gunicorn PROMETHEUS_MULTIPROC_DIR must be set, otherwise every scrape only sees the worker that answers it.
+    """
+    if not METRICS_ENABLED:
+        return
+    app.before_request(_start_request)
+    app.after_request(_end_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule(METRICS_PATH, 'metrics', _metrics, methods=['GET'])
+    logger.info(f"Metrics exposed on {METRICS_PATH} (multiprocess: {bool(PROMETHEUS_MULTIPROC_DIR)})")
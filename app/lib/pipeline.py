@@ -0,0 +1,97 @@
+import threading
+import logging
+import queue
+import os
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# items waiting between two stages, a fast stage blocks instead of buffering the whole document
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 4))
+
+_DONE = object()
+
+
+class _Failed:
+    """Carries the exception of a stage to the next stages, which raise it in turn."""
+    def __init__(self, error):
+        self.error = error
+
+
+class Pipeline:
+    """
+    Runs a source iterator and stages, each in its own thread, connected by bounded queues.
+
+    A stage is a function taking the iterator of the items of the previous stage and returning (or yielding)
+    its own items, so a stage can batch items. Iterating the pipeline yields the items of the last stage.
+    The exception of a stage is raised by the iteration, closing the iteration stops every stage.
+
+        for batch in Pipeline(pages, chunk, embed):
+            upsert(batch)
+    """
+
+    def __init__(self, source, *stages, maxsize=PIPELINE_QUEUE_SIZE, name="pipeline"):
+        self.source = source
+        self.stages = stages
+        self.maxsize = maxsize
+        self.name = name
+        self.stop = threading.Event()
+
+    def _put(self, out, item):
+        # gives up when the consumer stopped, instead of blocking on a queue nobody reads
+        while not self.stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _items(self, inbox):
+        while True:
+            try:
+                item = inbox.get(timeout=0.1)
+            except queue.Empty:
+                if self.stop.is_set():
+                    return
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+
+    def _run(self, items, out):
+        try:
+            for item in items:
+                if not self._put(out, item):
+                    return
+        except BaseException as e:
+            self._put(out, _Failed(e))
+            return
+        self._put(out, _DONE)
+
+    def __iter__(self):
+        inbox = queue.Queue(self.maxsize)
+        threads = [threading.Thread(target=self._run, args=(iter(self.source), inbox), name=f"{self.name}-source", daemon=True)]
+        for i, stage in enumerate(self.stages):
+            out = queue.Queue(self.maxsize)
+            # _call is a generator, so the stage function runs in its thread
+            threads.append(threading.Thread(target=self._run, args=(_call(stage, self._items(inbox)), out),
+                                            name=f"{self.name}-{i}", daemon=True))
+            inbox = out
+        for thread in threads:
+            thread.start()
+        try:
+            yield from self._items(inbox)
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+
+def _call(stage, items):
+    yield from stage(items)
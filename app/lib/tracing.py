@@ -0,0 +1,176 @@
+import contextvars
+import contextlib
+import functools
+import inspect
+import logging
+import json
+import time
+import uuid
+import os
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# spans are written as one JSON object per line, without the text prefix of the other logs
+span_logger = logging.getLogger("app.tracing.spans")
+if not span_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    span_logger.addHandler(_handler)
+span_logger.setLevel(logging.INFO)
+span_logger.propagate = False
+
+load_dotenv()
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+# debug flag, the spans of a request are also returned in its Server-Timing header
+TRACE_SERVER_TIMING = os.getenv('TRACE_SERVER_TIMING', 'false').lower() == 'true'
+
+# the trace and the open span follow the request through awaits, tasks and asyncio.to_thread
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    def __init__(self, trace, name, parent=None, **attrs):
+        self.trace = trace
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Adds attributes to the span, e.g. token counts or cache hits."""
+        self.attrs.update(attrs)
+
+    def end(self, duration=None):
+        self.duration = time.perf_counter() - self.start if duration is None else duration
+        self.trace.spans.append(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace.id,
+            "span_id": self.id,
+            "parent_id": self.parent.id if self.parent else None,
+            "name": self.name,
+            "offset_ms": round((self.start - self.trace.start) * 1000, 1),
+            "duration_ms": round(self.duration * 1000, 1),
+            **self.attrs,
+        }
+
+
+class _NoSpan:
+    """Stands in for the span when the code runs outside of a trace."""
+    def set(self, **attrs):
+        pass
+
+
+class Trace:
+    """
+    Timing of one request as a list of named spans.
+    Spans are created with `span()` anywhere in the pipeline, the trace is found through the context.
+    """
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+    def end(self):
+        self.duration = time.perf_counter() - self.start
+
+    def log(self):
+        """Logs every span and the request total as one JSON object per line."""
+        for span in sorted(self.spans, key=lambda span: span.start):
+            span_logger.info(json.dumps({"type": "span", **span.to_dict()}, default=str))
+        span_logger.info(json.dumps({"type": "trace", "trace_id": self.id, "name": self.name, "timestamp": self.timestamp,
+                                     "duration_ms": round(self.duration * 1000, 1), "spans": len(self.spans),
+                                     **self.attrs}, default=str))
+
+    def server_timing(self):
+        """Value of the Server-Timing header, one entry per span and the request total."""
+        entries = [f'{span.name};dur={span.duration * 1000:.1f}' for span in sorted(self.spans, key=lambda span: span.start)]
+        entries.append(f'total;dur={self.duration * 1000:.1f}')
+        return ", ".join(entries)
+
+
+@contextlib.contextmanager
+def trace(name, **attrs):
+    """
+    Opens the trace of a request, its spans are logged when it is closed.
+    Yields None when tracing is disabled.
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    request_trace = Trace(name, **attrs)
+    token = _current_trace.set(request_trace)
+    try:
+        yield request_trace
+    finally:
+        _current_trace.reset(token)
+        request_trace.end()
+        request_trace.log()
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Times the block as a span of the current trace, a no-op outside of a trace."""
+    request_trace = _current_trace.get()
+    if request_trace is None:
+        yield _NoSpan()
+        return
+    current = Span(request_trace, name, parent=_current_span.get(), **attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def record_span(name, duration, **attrs):
+    """Adds a span that was timed by the caller (e.g. around a generator) to the current trace."""
+    request_trace = _current_trace.get()
+    if request_trace is None:
+        return
+    recorded = Span(request_trace, name, parent=_current_span.get(), **attrs)
+    recorded.start = time.perf_counter() - duration
+    recorded.end(duration)
+
+
+def annotate(**attrs):
+    """Adds attributes to the open span, used by code that does not own the span (caches)."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def traced(name):
+    """Decorator timing every call of a function or coroutine function as a span."""
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await f(*args, **kwargs)
+        else:
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return f(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import weakref
+import logging
+import os
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Shared HTTP pool sizing and the cap on concurrent in-flight async LLM calls
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 20))
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE', 10))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 10))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+
+_lock = threading.Lock()
+_sync_clients = {}
+# async clients and semaphores are bound to the event loop that created them,
+# so they are kept per loop and dropped together with the loop
+_loop_state = weakref.WeakKeyDictionary()
+
+
+def _limits():
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_MAX_KEEPALIVE)
+
+
+def get_openai_client(api_key):
+    """
+    Returns the process wide OpenAI client for the given api key.
+    All components share its HTTP connection pool.
+    """
+    with _lock:
+        client = _sync_clients.get(api_key)
+        if client is None:
+            logger.info("Creating pooled OpenAI client")
+            # retries are handled by app.llm_handle.rate_limit.RetryPolicy
+            client = OpenAI(api_key=api_key,
+                            timeout=LLM_TIMEOUT,
+                            max_retries=0,
+                            http_client=httpx.Client(limits=_limits(), timeout=LLM_TIMEOUT))
+            _sync_clients[api_key] = client
+        return client
+
+
+def _get_loop_state():
+    loop = asyncio.get_running_loop()
+    with _lock:
+        state = _loop_state.get(loop)
+        if state is None:
+            state = {"clients": {}, "semaphore": asyncio.Semaphore(LLM_MAX_CONCURRENCY)}
+            _loop_state[loop] = state
+        return state
+
+
+def get_async_openai_client(api_key):
+    """
+    Returns the AsyncOpenAI client of the running event loop for the given api key.
+    Must be called from inside a coroutine.
+    """
+    state = _get_loop_state()
+    client = state["clients"].get(api_key)
+    if client is None:
+        client = AsyncOpenAI(api_key=api_key,
+                             timeout=LLM_TIMEOUT,
+                             max_retries=0,
+                             http_client=httpx.AsyncClient(limits=_limits(), timeout=LLM_TIMEOUT))
+        state["clients"][api_key] = client
+    return client
+
+
+def get_concurrency_limiter():
+    """
+    Returns the semaphore capping concurrent LLM calls on the running event loop
+    to LLM_MAX_CONCURRENCY.
+    """
+    return _get_loop_state()["semaphore"]
+
+
+async def close_async_clients():
+    """
+    Closes the AsyncOpenAI clients (and their connection pools) of the running event loop,
+    called by app.lib.async_clients.close_clients when the loop is done.
+    """
+    with _lock:
+        state = _loop_state.pop(asyncio.get_running_loop(), None)
+    for client in (state or {}).get("clients", {}).values():
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"Failed to close {type(client).__name__}: {e}")
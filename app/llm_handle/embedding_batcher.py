@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import logging
+import time
+import os
+from dotenv import load_dotenv
+from app.llm_handle.tokenizer import count_tokens, truncate_tokens
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# number of embedding requests in flight at once per worker
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', 4))
+
+
+class ThroughputStats:
+    """Cumulative embedding throughput, used to tune the batch sizes and concurrency of ingestion."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.texts = 0
+        self.tokens = 0
+        self.requests = 0
+        self.seconds = 0.0
+
+    def record(self, texts, tokens, requests, seconds):
+        with self._lock:
+            self.texts += texts
+            self.tokens += tokens
+            self.requests += requests
+            self.seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "texts": self.texts,
+                "tokens": self.tokens,
+                "requests": self.requests,
+                "seconds": self.seconds,
+                "texts_per_second": self.texts / self.seconds if self.seconds else 0.0,
+                "tokens_per_second": self.tokens / self.seconds if self.seconds else 0.0,
+            }
+
+
+throughput = ThroughputStats()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY, thread_name_prefix="embedding")
+        return _executor
+
+
+def pack_batches(token_counts, max_batch_tokens, max_batch_items):
+    """
+    Groups consecutive texts into request batches under both the token and the item limit.
+
+    :param token_counts: number of tokens of every text.
+    :return: list of (start, end) index ranges.
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for i, count in enumerate(token_counts):
+        if i > start and (tokens + count > max_batch_tokens or i - start >= max_batch_items):
+            batches.append((start, i))
+            start = i
+            tokens = 0
+        tokens += count
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+def embed_in_batches(texts, embed_batch, model, max_input_tokens, max_batch_tokens, max_batch_items):
+    """
+    Embeds texts with token packed batches sent concurrently (EMBEDDING_CONCURRENCY),
+    the returned embeddings keep the order of the texts.
+
+    :param embed_batch: function embedding a list of texts, called with (texts, token_count).
+    :param max_input_tokens: model limit of a single input, longer texts are truncated.
+    :param max_batch_tokens: limit of the sum of the tokens of one request.
+    :param max_batch_items: limit of the number of inputs of one request.
+    """
+    start_time = time.perf_counter()
+    texts = list(texts)
+    token_counts = []
+    for i, text in enumerate(texts):
+        count = count_tokens(text, model)
+        if count > max_input_tokens:
+            logger.warning(f"Text {i} has {count} tokens, truncating it to the {max_input_tokens} tokens limit of {model}")
+            texts[i] = truncate_tokens(text, max_input_tokens, model)
+            count = max_input_tokens
+        token_counts.append(count)
+
+    batches = pack_batches(token_counts, max_batch_tokens, max_batch_items)
+    logger.info(f"Embedding {len(texts)} texts ({sum(token_counts)} tokens) in {len(batches)} batches")
+
+    if len(batches) == 1:
+        results = [embed_batch(texts, sum(token_counts))]
+    else:
+        futures = [_get_executor().submit(embed_batch, texts[start:end], sum(token_counts[start:end]))
+                   for start, end in batches]
+        # result() re-raises the error of a failed batch, the others are not lost silently either
+        results = [future.result() for future in futures]
+
+    embeddings = [embedding for batch_embeddings in results for embedding in batch_embeddings]
+    elapsed = time.perf_counter() - start_time
+    throughput.record(len(texts), sum(token_counts), len(batches), elapsed)
+    if elapsed > 0:
+        logger.info(f"Embedded {len(texts)} texts in {elapsed:.2f}s "
+                    f"({len(texts) / elapsed:.1f} texts/s, {sum(token_counts) / elapsed:.0f} tokens/s)")
+    return embeddings
@@ -0,0 +1,185 @@
+from collections import OrderedDict
+import threading
+import hashlib
+import sqlite3
+import logging
+import time
+import os
+import numpy as np
+import redis
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+REDIS_URL = os.getenv('REDIS_URL')
+# "redis", "sqlite" or "none" for the in-process tier only
+EMBEDDING_CACHE_BACKEND = os.getenv('EMBEDDING_CACHE_BACKEND', 'redis' if REDIS_URL else 'sqlite').lower()
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 10000))
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv('EMBEDDING_CACHE_MAX_ROWS', 500000))
+EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', 30 * 86400))
+EMBEDDING_CACHE_PATH = os.path.join(os.getenv('DATABASE_DIR', './data'), 'embedding_cache.db')
+
+
+def encode_vector(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def decode_vector(data):
+    return np.frombuffer(data, dtype=np.float32).tolist()
+
+
+class RedisEmbeddingStore:
+    """Persistent tier in Redis, entries expire after the TTL."""
+    def __init__(self, url=REDIS_URL, ttl=EMBEDDING_CACHE_TTL):
+        self.redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get_many(self, keys):
+        return self.redis.mget(keys)
+
+    def set_many(self, items):
+        pipe = self.redis.pipeline(transaction=False)
+        for key, data in items:
+            pipe.set(key, data, ex=self.ttl)
+        pipe.execute()
+
+
+class SQLiteEmbeddingStore:
+    """Persistent tier on disk, the least recently used rows are evicted above max_rows."""
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_rows=EMBEDDING_CACHE_MAX_ROWS):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, used REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)")
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            # stay below sqlite's limit of host parameters per statement
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+                found.update(rows)
+                if rows:
+                    self.conn.executemany("UPDATE embeddings SET used = ? WHERE key = ?", [(time.time(), key) for key, _ in rows])
+        return [found.get(key) for key in keys]
+
+    def set_many(self, items):
+        now = time.time()
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, used) VALUES (?, ?, ?)",
+                                  [(key, data, now) for key, data in items])
+            count = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_rows:
+                self.conn.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used LIMIT ?)",
+                                  (count - self.max_rows,))
+
+
+class EmbeddingCache:
+    """
+    Cache of embeddings keyed by (model, dimension, sha256(text)).
+    Vectors are stored as float32 bytes in an in-process LRU backed by a persistent store
+    (Redis or SQLite), so identical texts are only embedded once across requests, workers and deploys.
+    """
+    def __init__(self, model, dimension, store=None, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.model = model
+        self.dimension = dimension
+        self.store = store
+        self.max_entries = max_entries
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text):
+        return f"embedding:{self.model}:{self.dimension}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get_many(self, texts):
+        """
+        :return: the cached vector of each text, None for the texts that are not cached.
+        """
+        keys = [self.key(text) for text in texts]
+        results = [None] * len(texts)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._local:
+                    self._local.move_to_end(key)
+                    results[i] = decode_vector(self._local[key])
+                else:
+                    missing.append(i)
+
+        if missing and self.store is not None:
+            try:
+                stored = self.store.get_many([keys[i] for i in missing])
+            except Exception as e:
+                logger.warning(f"Embedding cache store lookup failed: {e}")
+                stored = [None] * len(missing)
+            with self._lock:
+                for i, data in zip(missing, stored):
+                    if data is not None:
+                        results[i] = decode_vector(data)
+                        self._store_local(keys[i], data)
+
+        with self._lock:
+            misses = sum(1 for result in results if result is None)
+            self.misses += misses
+            self.hits += len(texts) - misses
+        return results
+
+    def set_many(self, texts, vectors):
+        items = [(self.key(text), encode_vector(vector)) for text, vector in zip(texts, vectors)]
+        with self._lock:
+            for key, data in items:
+                self._store_local(key, data)
+        if self.store is not None and items:
+            try:
+                self.store.set_many(items)
+            except Exception as e:
+                logger.warning(f"Embedding cache store write failed: {e}")
+
+    def _store_local(self, key, data):
+        self._local[key] = data
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0, "entries": len(self._local)}
+
+
+_store = None
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _create_store():
+    try:
+        if EMBEDDING_CACHE_BACKEND == 'redis' and REDIS_URL:
+            return RedisEmbeddingStore()
+        if EMBEDDING_CACHE_BACKEND == 'sqlite':
+            return SQLiteEmbeddingStore()
+    except Exception as e:
+        logger.warning(f"Embedding cache {EMBEDDING_CACHE_BACKEND} store unavailable, using the in-process cache only: {e}")
+    return None
+
+
+def get_embedding_cache(model, dimension):
+    """Returns the process wide cache of the embedding model, the persistent store is shared between models."""
+    global _store
+    with _caches_lock:
+        if (model, dimension) not in _caches:
+            if _store is None:
+                _store = _create_store()
+            _caches[(model, dimension)] = EmbeddingCache(model, dimension, _store)
+        return _caches[(model, dimension)]
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import logging
+import json
+import os
+import redis
+from dotenv import load_dotenv
+from app.lib.tracing import annotate
+from app.lib.metrics import track, count_cache_lookup
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+REDIS_URL = os.getenv('REDIS_URL')
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 1024))
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 86400))
+
+
+def request_key(*parts):
+    """Content address of a model request, the sha256 of its JSON encoded parts."""
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    Exact match cache for LLM completions.
+    Entries are addressed by `request_key` of (model, system prompt, prompt, params) and kept in an
+    in-process LRU, backed by Redis with a TTL so that they are shared between workers.
+    Only the raw completion text is stored, callers parse it again on every hit.
+    """
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL, redis_url=REDIS_URL, namespace="llm_cache"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.namespace = namespace
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.redis = redis.Redis.from_url(redis_url, decode_responses=True) if redis_url else None
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._local:
+                self._local.move_to_end(key)
+                self.local_hits += 1
+                annotate(llm_cache="local_hit")
+                count_cache_lookup("llm", True)
+                return self._local[key]
+
+        value = None
+        if self.redis is not None:
+            try:
+                with track("redis", "llm_cache_get"):
+                    value = self.redis.get(f"{self.namespace}:{key}")
+            except redis.RedisError as e:
+                logger.warning(f"LLM cache redis lookup failed: {e}")
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                annotate(llm_cache="miss")
+                count_cache_lookup("llm", False)
+                return None
+            self.redis_hits += 1
+            annotate(llm_cache="redis_hit")
+            count_cache_lookup("llm", True)
+            self._store_local(key, value)
+        return value
+
+    def set(self, key, value):
+        if value is None:
+            return
+        with self._lock:
+            self._store_local(key, value)
+        if self.redis is not None:
+            try:
+                self.redis.set(f"{self.namespace}:{key}", value, ex=self.ttl)
+            except redis.RedisError as e:
+                logger.warning(f"LLM cache redis write failed: {e}")
+
+    def _store_local(self, key, value):
+        self._local[key] = value
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.local_hits + self.redis_hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+                "entries": len(self._local),
+            }
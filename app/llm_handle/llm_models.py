@@ -1,7 +1,17 @@
 import google.generativeai as genai
-from openai import OpenAI
 from dotenv import load_dotenv
-import openai
+from app.llm_handle.clients import get_openai_client, get_async_openai_client, get_concurrency_limiter
+from app.llm_handle.llm_cache import LLMCache, request_key
+from app.llm_handle.single_flight import single_flight
+from app.llm_handle.rate_limit import retry_policy, get_rate_limiter
+from app.llm_handle.tokenizer import count_tokens
+from app.llm_handle.embedding_cache import get_embedding_cache
+from app.llm_handle.embedding_batcher import embed_in_batches
+from app.prompts.router_prompt import TOOL_SELECTION_PROMPT
+from app.lib.tracing import span
+from app.lib.metrics import track, count_cache_lookup
+import threading
+import asyncio
 import time
 import os
 import logging
@@ -17,65 +27,122 @@ load_dotenv()
 
 EMBEDDING_MODEL = "text-embedding-3-small"
 GEMINI_EMBEDDING_MODEL="models/text-embedding-004"
+EMBEDDING_DIMENSION = 1536
+GEMINI_EMBEDDING_DIMENSION = 768
+# sum of the tokens of one embedding request, the OpenAI limit is 300k
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv('EMBEDDING_BATCH_MAX_TOKENS', 250000))
 api = os.getenv('OPENAI_API_KEY')
 gemini_api = os.getenv('GEMINI_API_KEY')
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'false').lower() == 'true'
+
+
+class EmbeddingError(Exception):
+    """Raised when a batch could not be embedded after all retries, no embedding is dropped silently."""
+
+
+def _cached_embeddings(batch, model, dimension, embed, provider):
+    """
+    Serves the texts found in the embedding cache and sends only the missing ones upstream, in one call.
+    """
+    if isinstance(batch, str):
+        batch = [batch]
+    cache = get_embedding_cache(model, dimension)
+    with span("embedding", model=model, texts=len(batch)) as embedding_span:
+        embeddings = cache.get_many(batch)
+        missing = list(dict.fromkeys(text for text, embedding in zip(batch, embeddings) if embedding is None))
+        embedding_span.set(cache_hits=len(batch) - len(missing))
+        count_cache_lookup("embedding", True, len(batch) - len(missing))
+        count_cache_lookup("embedding", False, len(missing))
+        if not missing:
+            return embeddings
+
+        logger.info(f"Embedding {len(missing)} uncached texts of {len(batch)}")
+        # concurrent requests embedding the same texts share a single upstream call
+        key = request_key(model, missing)
+        with track(provider, "embedding"):
+            vectors = single_flight.do(key, lambda: embed(missing))
+        cache.set_many(missing, vectors)
+    new_embeddings = dict(zip(missing, vectors))
+    return [embedding if embedding is not None else new_embeddings[text] for text, embedding in zip(batch, embeddings)]
+
+
 # Function to generate OpenAI embeddings
-def openai_embedding_model(batch):
-    openai.api_key = api
-    embeddings = []
-    batch_size = 1000
-    sleep_time = 10
+def openai_embedding_model(batch, bulk=False):
+    """
+    :param batch: text or list of texts to embed.
+    :param bulk: document ingestion, paced within the bulk share of the rate limit.
+    :return: list of embeddings in the order of the texts.
+    """
+    return _cached_embeddings(batch, EMBEDDING_MODEL, EMBEDDING_DIMENSION,
+                              lambda texts: _openai_embeddings(texts, bulk), "openai")
 
-    for i in range(0, len(batch), batch_size):
-        batch_segment = batch[i:i + batch_size]
-        print(batch_segment)
-        logger.info(f"Embedding batch {i // batch_size + 1} of {len(batch) // batch_size + 1}")
+def _openai_embeddings(batch, bulk=False):
+    client = get_openai_client(api)
+    limiter = get_rate_limiter('openai')
 
-        try:
-            response = openai.embeddings.create(
+    def embed_batch(batch_segment, tokens):
+        def embed_segment():
+            limiter.acquire(tokens, bulk=bulk)
+            return client.embeddings.create(
                 model=EMBEDDING_MODEL,
                 input=batch_segment
             )
-            batch_embeddings = [data.embedding for data in response.data]
-            embeddings.extend(batch_embeddings)
-
+        try:
+            response = retry_policy.call(embed_segment)
         except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}")
-            time.sleep(sleep_time)
-    
-    return embeddings
+            logger.error(f"Embedding batch of {len(batch_segment)} texts failed after retries: {e}")
+            raise EmbeddingError(f"Failed to embed a batch of {len(batch_segment)} texts: {e}") from e
+        return [data.embedding for data in response.data]
+
+    return embed_in_batches(batch, embed_batch, EMBEDDING_MODEL, max_input_tokens=8191,
+                            max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS, max_batch_items=2048)
 
 # Function to generate gemini embeddings
-def gemini_embedding_model(batch):
-    embeddings = []
-    batch_size = 1000
-    sleep_time = 10
-
-    for i in range(0, len(batch), batch_size):
-        batch_segment = batch[i:i + batch_size]
-        print(batch_segment)
-        logger.info(f"Embedding batch {i // batch_size + 1} of {len(batch) // batch_size + 1}")
-
-    
-        genai.configure(api_key=gemini_api)
-        try:
-                response = genai.embed_content(
+def gemini_embedding_model(batch, bulk=False):
+    return _cached_embeddings(batch, GEMINI_EMBEDDING_MODEL, GEMINI_EMBEDDING_DIMENSION,
+                              lambda texts: _gemini_embeddings(texts, bulk), "gemini")
+
+def _gemini_embeddings(batch, bulk=False):
+    limiter = get_rate_limiter('gemini')
+    genai.configure(api_key=gemini_api)
+
+    def embed_batch(batch_segment, tokens):
+        def embed_segment():
+            limiter.acquire(tokens, bulk=bulk)
+            return genai.embed_content(
                     model=GEMINI_EMBEDDING_MODEL,
                     content=batch_segment
                 )
-                batch_embeddings = response['embedding']
-                embeddings.extend(batch_embeddings)
-
+        try:
+            response = retry_policy.call(embed_segment)
         except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}")
-            time.sleep(sleep_time)
-    
-    return embeddings
+            logger.error(f"Embedding batch of {len(batch_segment)} texts failed after retries: {e}")
+            raise EmbeddingError(f"Failed to embed a batch of {len(batch_segment)} texts: {e}") from e
+        return response['embedding']
+
+    # token counts use the cl100k_base approximation for gemini
+    return embed_in_batches(batch, embed_batch, GEMINI_EMBEDDING_MODEL, max_input_tokens=2048,
+                            max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS, max_batch_items=100)
 
 
+_models = {}
+_models_lock = threading.Lock()
+
 def get_llm_model(model_provider, model_version=None):
     # model_type = config['LLM_MODEL']
+    # one instance per provider and version so every component shares the same pooled client
+    key = (model_provider, model_version)
+    with _models_lock:
+        if key not in _models:
+            model = _create_llm_model(model_provider, model_version)
+            if LLM_CACHE_ENABLED:
+                model.cache = LLMCache()
+                logger.info(f"LLM response cache enabled for {model_provider} {model.model_name}")
+            _models[key] = model
+        return _models[key]
+
 
+def _create_llm_model(model_provider, model_version=None):
     if model_provider == 'openai':
         openai_api_key = os.getenv('OPENAI_API_KEY')
         if not openai_api_key:
@@ -92,30 +159,165 @@ def get_llm_model(model_provider, model_version=None):
 
 
 class LLMInterface:
-    def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
-        raise NotImplementedError("Subclasses must implement the generate method")
+    """
+    Base class of the LLM providers.
+    Subclasses implement `_complete` (blocking) and `_acomplete` (coroutine) returning the raw text,
+    the public methods take care of the optional response cache and of parsing the JSON answers.
+    """
+    cache = None
 
+    def generate(self, prompt: str, system_prompt=None, task=None, **kwargs) -> Dict[str, Any]:
+        # task names the call site, it is only used by the ModelRouter
+        key = self._request_key(prompt, system_prompt, kwargs)
+        content = self.cache.get(key) if self.cache else None
+        if content is None:
+            # identical concurrent requests share a single upstream call
+            content = single_flight.do(key, lambda: retry_policy.call(self._paced_complete, prompt, system_prompt, **kwargs))
+            if self.cache:
+                self.cache.set(key, content)
+        return self._parse_content(content)
 
+    async def agenerate(self, prompt: str, system_prompt=None, task=None, **kwargs) -> Dict[str, Any]:
+        """Async version of generate, the number of concurrent calls is capped by LLM_MAX_CONCURRENCY."""
+        key = self._request_key(prompt, system_prompt, kwargs)
+        content = self.cache.get(key) if self.cache else None
+        if content is None:
+            content = await single_flight.ado(key, lambda: retry_policy.acall(self._paced_acomplete, prompt, system_prompt, **kwargs))
+            if self.cache:
+                self.cache.set(key, content)
+        return self._parse_content(content)
 
-class GeminiModel(LLMInterface):
-    def __init__(self, api_key: str, model_provider,model_name="gemini-pro"): 
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model_name or "gemini-pro")
-        self.model_name = model_name
-        self.model_provider = model_provider
-        self.api_key = api_key
+    def _paced_complete(self, prompt, system_prompt=None, **kwargs):
+        get_rate_limiter(self.model_provider).acquire(self._estimate_tokens(prompt, system_prompt, kwargs))
+        return self._complete(prompt, system_prompt, **kwargs)
 
-    def generate(self, prompt: str,system_prompt=None, temperature=0.0, top_k=1) -> Dict[str, Any]:
-        response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0,
-                    top_k=top_k
-                )
-            )
-            
-        content = response.text
+    async def _paced_acomplete(self, prompt, system_prompt=None, **kwargs):
+        await get_rate_limiter(self.model_provider).aacquire(self._estimate_tokens(prompt, system_prompt, kwargs))
+        async with get_concurrency_limiter():
+            return await self._acomplete(prompt, system_prompt, **kwargs)
+
+    def _estimate_tokens(self, prompt, system_prompt, params):
+        # tokens counted against the TPM quota: the prompt plus the completion allowance
+        return count_tokens(prompt, self.model_name) + count_tokens(system_prompt, self.model_name) + (params.get("max_tokens") or 1000)
+
+    def generate_stream(self, prompt: str, system_prompt=None, task=None, **kwargs):
+        """
+        Yields the completion text as it is produced by the model.
+        The raw text is yielded without JSON parsing, cached completions are yielded in one piece.
+        """
+        key = self._request_key(prompt, system_prompt, kwargs)
+        content = self.cache.get(key) if self.cache else None
+        if content is not None:
+            yield content
+            return
+
+        parts = []
+        attempt = 0
+        while True:
+            try:
+                get_rate_limiter(self.model_provider).acquire(self._estimate_tokens(prompt, system_prompt, kwargs))
+                for part in self._stream(prompt, system_prompt, **kwargs):
+                    parts.append(part)
+                    yield part
+                break
+            except Exception as e:
+                # once text was sent to the caller the stream can't be restarted
+                if parts or attempt >= retry_policy.max_retries or not retry_policy.is_retryable(e):
+                    raise
+                time.sleep(retry_policy.delay(attempt, e))
+                attempt += 1
+        if self.cache:
+            self.cache.set(key, "".join(parts))
+
+    def _stream(self, prompt: str, system_prompt=None, **kwargs):
+        # providers without streaming support return the whole completion at once
+        yield self._complete(prompt, system_prompt, **kwargs)
+
+    async def agenerate_stream(self, prompt: str, system_prompt=None, task=None, **kwargs):
+        """Async version of generate_stream."""
+        key = self._request_key(prompt, system_prompt, kwargs)
+        content = self.cache.get(key) if self.cache else None
+        if content is not None:
+            yield content
+            return
+
+        parts = []
+        attempt = 0
+        while True:
+            try:
+                await get_rate_limiter(self.model_provider).aacquire(self._estimate_tokens(prompt, system_prompt, kwargs))
+                async with get_concurrency_limiter():
+                    async for part in self._astream(prompt, system_prompt, **kwargs):
+                        parts.append(part)
+                        yield part
+                break
+            except Exception as e:
+                if parts or attempt >= retry_policy.max_retries or not retry_policy.is_retryable(e):
+                    raise
+                await asyncio.sleep(retry_policy.delay(attempt, e))
+                attempt += 1
+        if self.cache:
+            self.cache.set(key, "".join(parts))
+
+    async def _astream(self, prompt: str, system_prompt=None, **kwargs):
+        yield await self._acomplete(prompt, system_prompt, **kwargs)
+
+    def select_tool(self, prompt: str, tools, system_prompt=None, task=None, **kwargs):
+        """
+        Makes one function calling request asking the model to call one of the tools.
+
+        :param tools: OpenAI style function definitions.
+        :return: the name of the selected tool, None if the model did not call any.
+        """
+        key = self._request_key(prompt, system_prompt, {"tools": [tool["function"]["name"] for tool in tools], **kwargs})
+        name = self.cache.get(key) if self.cache else None
+        if name is None:
+            name = single_flight.do(key, lambda: retry_policy.call(self._paced_select_tool, prompt, tools, system_prompt, **kwargs))
+            if self.cache and name:
+                self.cache.set(key, name)
+        return name
+
+    def _paced_select_tool(self, prompt, tools, system_prompt=None, **kwargs):
+        get_rate_limiter(self.model_provider).acquire(self._estimate_tokens(prompt, system_prompt, kwargs))
+        return self._select_tool(prompt, tools, system_prompt, **kwargs)
+
+    async def aselect_tool(self, prompt: str, tools, system_prompt=None, task=None, **kwargs):
+        """Async version of select_tool."""
+        key = self._request_key(prompt, system_prompt, {"tools": [tool["function"]["name"] for tool in tools], **kwargs})
+        name = self.cache.get(key) if self.cache else None
+        if name is None:
+            name = await single_flight.ado(key, lambda: retry_policy.acall(self._paced_aselect_tool, prompt, tools, system_prompt, **kwargs))
+            if self.cache and name:
+                self.cache.set(key, name)
+        return name
+
+    async def _paced_aselect_tool(self, prompt, tools, system_prompt=None, **kwargs):
+        await get_rate_limiter(self.model_provider).aacquire(self._estimate_tokens(prompt, system_prompt, kwargs))
+        async with get_concurrency_limiter():
+            return await self._aselect_tool(prompt, tools, system_prompt, **kwargs)
+
+    def _select_tool(self, prompt: str, tools, system_prompt=None, **kwargs):
+        # providers without native function calling name the tool in a JSON answer
+        tool_descriptions = "\n".join(f"- {tool['function']['name']}: {tool['function']['description']}" for tool in tools)
+        response = self._parse_content(self._complete(
+            TOOL_SELECTION_PROMPT.format(system_prompt=system_prompt or "", tools=tool_descriptions, query=prompt), **kwargs))
+        return response.get("tool") if isinstance(response, dict) else None
 
+    async def _aselect_tool(self, prompt: str, tools, system_prompt=None, **kwargs):
+        return await asyncio.to_thread(self._select_tool, prompt, tools, system_prompt, **kwargs)
+
+    def _request_key(self, prompt, system_prompt, params):
+        # all completions run at temperature 0 so identical inputs can share one answer
+        return request_key(self.model_name, system_prompt, prompt, params)
+
+    def _complete(self, prompt: str, system_prompt=None, **kwargs) -> str:
+        raise NotImplementedError("Subclasses must implement the _complete method")
+
+    async def _acomplete(self, prompt: str, system_prompt=None, **kwargs) -> str:
+        # providers without a native async client fall back to a worker thread
+        return await asyncio.to_thread(self._complete, prompt, system_prompt, **kwargs)
+
+    def _parse_content(self, content: str):
         json_content = self._extract_json_from_codeblock(content)
         try:
             return json.loads(json_content)
@@ -132,41 +334,155 @@ class GeminiModel(LLMInterface):
             return content
 
 
+class GeminiModel(LLMInterface):
+    def __init__(self, api_key: str, model_provider,model_name="gemini-pro"): 
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name or "gemini-pro")
+        self.model_name = model_name
+        self.model_provider = model_provider
+        self.api_key = api_key
+
+    def _generation_config(self, top_k=1, max_tokens=None):
+        return genai.types.GenerationConfig(
+                    temperature=0,
+                    top_k=top_k,
+                    max_output_tokens=max_tokens
+                )
+
+    def _complete(self, prompt: str, system_prompt=None, temperature=0.0, top_k=1, max_tokens=None) -> str:
+        response = self.model.generate_content(
+                prompt,
+                generation_config=self._generation_config(top_k, max_tokens)
+            )
+        return response.text
+
+    async def _acomplete(self, prompt: str, system_prompt=None, temperature=0.0, top_k=1, max_tokens=None) -> str:
+        response = await self.model.generate_content_async(
+                prompt,
+                generation_config=self._generation_config(top_k, max_tokens)
+            )
+        return response.text
+
+    def _stream(self, prompt: str, system_prompt=None, temperature=0.0, top_k=1, max_tokens=None):
+        response = self.model.generate_content(
+                prompt,
+                generation_config=self._generation_config(top_k, max_tokens),
+                stream=True
+            )
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    async def _astream(self, prompt: str, system_prompt=None, temperature=0.0, top_k=1, max_tokens=None):
+        response = await self.model.generate_content_async(
+                prompt,
+                generation_config=self._generation_config(top_k, max_tokens),
+                stream=True
+            )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    def _tool_request(self, prompt, tools, system_prompt=None, max_tokens=None):
+        declarations = [{"name": tool["function"]["name"], "description": tool["function"]["description"]} for tool in tools]
+        return dict(
+                contents=f"{system_prompt}\n\n{prompt}" if system_prompt else prompt,
+                tools=[{"function_declarations": declarations}],
+                tool_config={"function_calling_config": {"mode": "ANY"}},
+                generation_config=self._generation_config(max_tokens=max_tokens)
+            )
+
+    def _called_tool(self, response):
+        for part in response.candidates[0].content.parts:
+            if part.function_call and part.function_call.name:
+                return part.function_call.name
+        return None
+
+    def _select_tool(self, prompt: str, tools, system_prompt=None, max_tokens=None, **kwargs):
+        return self._called_tool(self.model.generate_content(**self._tool_request(prompt, tools, system_prompt, max_tokens)))
+
+    async def _aselect_tool(self, prompt: str, tools, system_prompt=None, max_tokens=None, **kwargs):
+        response = await self.model.generate_content_async(**self._tool_request(prompt, tools, system_prompt, max_tokens))
+        return self._called_tool(response)
+
+
 class OpenAIModel(LLMInterface):
     def __init__(self, api_key: str, model_provider, model_name: str = "gpt-3.5-turbo"):
         self.api_key = api_key
         self.model_name = model_name
         self.model_provider = model_provider
-        openai.api_key = self.api_key
-    
-    def generate(self, prompt: str, system_prompt=None) -> Dict[str, Any]:
+        self.client = get_openai_client(self.api_key)
+
+    def _messages(self, prompt, system_prompt=None):
         if system_prompt:
-            response = openai.chat.completions.create(
+            return [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}]
+        return [{"role": "user", "content": prompt}]
+
+    def _complete(self, prompt: str, system_prompt=None, max_tokens=1000) -> str:
+        response = self.client.chat.completions.create(
             model=self.model_name,
-            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}],
+            messages=self._messages(prompt, system_prompt),
             temperature=0,
-            max_tokens=1000
+            max_tokens=max_tokens
         )
-        else:
-            response = openai.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-                max_tokens=1000
-            )
-        content = response.choices[0].message.content
-        
-        json_content = self._extract_json_from_codeblock(content)
-        try:
-            return json.loads(json_content)
-        except json.JSONDecodeError:
-            return json_content
+        return response.choices[0].message.content
 
-    def _extract_json_from_codeblock(self, content: str) -> str:
-        start = content.find("```json")
-        end = content.rfind("```")
-        if start != -1 and end != -1:
-            json_content = content[start + 7:end].strip()
-            return json_content
-        else:
-            return content
\ No newline at end of file
+    async def _acomplete(self, prompt: str, system_prompt=None, max_tokens=1000) -> str:
+        client = get_async_openai_client(self.api_key)
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=self._messages(prompt, system_prompt),
+            temperature=0,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content
+
+    def _stream(self, prompt: str, system_prompt=None, max_tokens=1000):
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=self._messages(prompt, system_prompt),
+            temperature=0,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def _astream(self, prompt: str, system_prompt=None, max_tokens=1000):
+        client = get_async_openai_client(self.api_key)
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=self._messages(prompt, system_prompt),
+            temperature=0,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _select_tool(self, prompt: str, tools, system_prompt=None, max_tokens=100):
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=self._messages(prompt, system_prompt),
+            tools=tools,
+            tool_choice="required",
+            temperature=0,
+            max_tokens=max_tokens
+        )
+        tool_calls = response.choices[0].message.tool_calls
+        return tool_calls[0].function.name if tool_calls else None
+
+    async def _aselect_tool(self, prompt: str, tools, system_prompt=None, max_tokens=100):
+        client = get_async_openai_client(self.api_key)
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=self._messages(prompt, system_prompt),
+            tools=tools,
+            tool_choice="required",
+            temperature=0,
+            max_tokens=max_tokens
+        )
+        tool_calls = response.choices[0].message.tool_calls
+        return tool_calls[0].function.name if tool_calls else None
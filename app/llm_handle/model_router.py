@@ -0,0 +1,147 @@
+from collections import defaultdict
+import threading
+import logging
+import time
+from typing import Any, Dict
+from app.llm_handle.llm_models import LLMInterface
+from app.llm_handle.tokenizer import count_tokens
+from app.lib.tracing import span, record_span
+from app.lib.metrics import track
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROUTE = {"tier": "advanced", "max_tokens": 1000}
+
+
+class ModelRouter(LLMInterface):
+    """
+    Routes each LLM call to a model tier according to the task it performs.
+
+    Call sites pass `task=` to generate/agenerate/generate_stream/select_tool (and their async versions), the routing configuration
+    (MODEL_ROUTING in config.yaml) maps the task to a tier ("basic" or "advanced") and to the
+    max_tokens of the completion. Unknown tasks use the default route.
+    Latency and (tiktoken estimated) token counts are recorded per task.
+
+    MODEL_ROUTING:
+      default: {tier: advanced, max_tokens: 1000}
+      tasks:
+        select_property_value: {tier: basic, max_tokens: 200}
+    """
+    def __init__(self, tiers: Dict[str, LLMInterface], routing_config=None) -> None:
+        routing_config = routing_config or {}
+        self.tiers = tiers
+        self.default_route = {**DEFAULT_ROUTE, **(routing_config.get("default") or {})}
+        self.routes = routing_config.get("tasks") or {}
+        self.default_llm = self.tiers[self.default_route["tier"]]
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"calls": 0, "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0})
+
+        for task, route in self.routes.items():
+            if route.get("tier") not in self.tiers:
+                raise ValueError(f"Unknown model tier '{route.get('tier')}' for task '{task}'")
+        logger.info(f"Model router initialized with routes {self.routes}")
+
+    # the router stands in for the default model wherever a model attribute is read
+    @property
+    def model_name(self):
+        return self.default_llm.model_name
+
+    @property
+    def model_provider(self):
+        return self.default_llm.model_provider
+
+    @property
+    def api_key(self):
+        return self.default_llm.api_key
+
+    def route(self, task=None):
+        """
+        :param task: name of the call site.
+        :return: the model and the completion params for the task.
+        """
+        route = {**self.default_route, **self.routes.get(task, {})}
+        params = {"max_tokens": route["max_tokens"]} if route.get("max_tokens") else {}
+        return self.tiers[route["tier"]], params
+
+    def generate(self, prompt: str, system_prompt=None, task=None, **kwargs) -> Dict[str, Any]:
+        llm, params = self.route(task)
+        with span(f"llm.{task or 'default'}", model=llm.model_name) as llm_span:
+            start = time.perf_counter()
+            with track(llm.model_provider, task or 'default'):
+                response = llm.generate(prompt, system_prompt, **{**params, **kwargs})
+            llm_span.set(**self._record(task, llm, prompt, system_prompt, response, start))
+        return response
+
+    async def agenerate(self, prompt: str, system_prompt=None, task=None, **kwargs) -> Dict[str, Any]:
+        llm, params = self.route(task)
+        with span(f"llm.{task or 'default'}", model=llm.model_name) as llm_span:
+            start = time.perf_counter()
+            with track(llm.model_provider, task or 'default'):
+                response = await llm.agenerate(prompt, system_prompt, **{**params, **kwargs})
+            llm_span.set(**self._record(task, llm, prompt, system_prompt, response, start))
+        return response
+
+    def generate_stream(self, prompt: str, system_prompt=None, task=None, **kwargs):
+        llm, params = self.route(task)
+        start = time.perf_counter()
+        parts = []
+        with track(llm.model_provider, task or 'default'):
+            for part in llm.generate_stream(prompt, system_prompt, **{**params, **kwargs}):
+                parts.append(part)
+                yield part
+        # a span can't stay open across the yields, it is recorded once the stream is done
+        usage = self._record(task, llm, prompt, system_prompt, "".join(parts), start)
+        record_span(f"llm.{task or 'default'}", time.perf_counter() - start, model=llm.model_name, stream=True, **usage)
+
+    def select_tool(self, prompt: str, tools, system_prompt=None, task=None, **kwargs):
+        llm, params = self.route(task)
+        with span(f"llm.{task or 'default'}", model=llm.model_name) as llm_span:
+            start = time.perf_counter()
+            with track(llm.model_provider, task or 'default'):
+                response = llm.select_tool(prompt, tools, system_prompt, **{**params, **kwargs})
+            llm_span.set(**self._record(task, llm, prompt, system_prompt, response, start))
+        return response
+
+    async def agenerate_stream(self, prompt: str, system_prompt=None, task=None, **kwargs):
+        llm, params = self.route(task)
+        start = time.perf_counter()
+        parts = []
+        with track(llm.model_provider, task or 'default'):
+            async for part in llm.agenerate_stream(prompt, system_prompt, **{**params, **kwargs}):
+                parts.append(part)
+                yield part
+        usage = self._record(task, llm, prompt, system_prompt, "".join(parts), start)
+        record_span(f"llm.{task or 'default'}", time.perf_counter() - start, model=llm.model_name, stream=True, **usage)
+
+    async def aselect_tool(self, prompt: str, tools, system_prompt=None, task=None, **kwargs):
+        llm, params = self.route(task)
+        with span(f"llm.{task or 'default'}", model=llm.model_name) as llm_span:
+            start = time.perf_counter()
+            with track(llm.model_provider, task or 'default'):
+                response = await llm.aselect_tool(prompt, tools, system_prompt, **{**params, **kwargs})
+            llm_span.set(**self._record(task, llm, prompt, system_prompt, response, start))
+        return response
+
+    def _record(self, task, llm, prompt, system_prompt, response, start):
+        latency = time.perf_counter() - start
+        prompt_tokens = count_tokens(prompt, llm.model_name) + count_tokens(system_prompt, llm.model_name)
+        completion_tokens = count_tokens(response if isinstance(response, str) else str(response), llm.model_name)
+        task = task or "default"
+        with self._lock:
+            stats = self._stats[task]
+            stats["calls"] += 1
+            stats["latency"] += latency
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+        logger.info(f"LLM task={task} model={llm.model_name} latency={latency * 1000:.0f}ms "
+                    f"prompt_tokens={prompt_tokens} completion_tokens={completion_tokens}")
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+    def stats(self):
+        """Per task call count, average latency in seconds and token totals."""
+        with self._lock:
+            return {
+                task: {**stats, "avg_latency": stats["latency"] / stats["calls"] if stats["calls"] else 0.0}
+                for task, stats in self._stats.items()
+            }
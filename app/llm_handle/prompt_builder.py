@@ -0,0 +1,105 @@
+import logging
+from app.llm_handle.tokenizer import count_tokens, truncate_tokens
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TRUNCATION_MARKER = " ..."
+
+
+class PromptBuilder:
+    """
+    Fills a prompt template while keeping every section within a token budget.
+
+    Each section has its own budget and a priority (lower number = more important).
+    A section over its budget is cut down: list sections drop whole items (keeping the first or the
+    last ones), text sections are truncated. If the assembled prompt is still over `max_tokens`,
+    the lowest priority sections are shrunk, and dropped if needed, until it fits.
+    Sections without a budget and with priority 0 are never touched.
+
+    Usage:
+        builder = PromptBuilder(RETRIEVE_PROMPT, model_name="gpt-4o", max_tokens=4000)
+        builder.add("query", query)
+        builder.add("retrieved_content", chunks, budget=3000, priority=1)
+        prompt = builder.build()
+    """
+    def __init__(self, template, model_name=None, max_tokens=None, name="prompt"):
+        self.template = template
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.name = name
+        self.sections = {}
+
+    def add(self, key, value, budget=None, priority=0, keep="first", separator="\n"):
+        """
+        :param key: name of the template placeholder.
+        :param value: text or list of items, lists are joined with the separator.
+        :param budget: maximum tokens of the section, unlimited when None.
+        :param priority: 0 for required sections, higher numbers are reduced first.
+        :param keep: for lists, "first" keeps the leading items, "last" the trailing ones.
+        """
+        self.sections[key] = {
+            "value": value,
+            "budget": budget,
+            "priority": priority,
+            "keep": keep,
+            "separator": separator,
+        }
+        return self
+
+    def build(self):
+        template_tokens = count_tokens(self.template.format(**{key: "" for key in self.sections}), self.model_name)
+        rendered = {key: self._fit(section, section["budget"]) for key, section in self.sections.items()}
+        counts = {key: count_tokens(text, self.model_name) for key, text in rendered.items()}
+
+        if self.max_tokens:
+            overflow = template_tokens + sum(counts.values()) - self.max_tokens
+            reducible = sorted((key for key, section in self.sections.items() if section["priority"] > 0),
+                               key=lambda key: self.sections[key]["priority"], reverse=True)
+            for key in reducible:
+                if overflow <= 0:
+                    break
+                target = max(counts[key] - overflow, 0)
+                rendered[key] = self._fit(self.sections[key], target)
+                new_count = count_tokens(rendered[key], self.model_name)
+                overflow -= counts[key] - new_count
+                counts[key] = new_count
+
+        prompt = self.template.format(**rendered)
+        logger.info(f"{self.name} tokens: template={template_tokens} "
+                    + " ".join(f"{key}={count}" for key, count in counts.items())
+                    + f" total={template_tokens + sum(counts.values())}")
+        return prompt
+
+    def _fit(self, section, budget):
+        value = section["value"]
+        if isinstance(value, (list, tuple)):
+            return self._fit_items([str(item) for item in value if item is not None and item != ""],
+                                   budget, section["keep"], section["separator"])
+        text = "" if value is None else str(value)
+        if budget is None or count_tokens(text, self.model_name) <= budget:
+            return text
+        marker_tokens = count_tokens(TRUNCATION_MARKER, self.model_name)
+        if budget <= marker_tokens:
+            return ""
+        return truncate_tokens(text, budget - marker_tokens, self.model_name) + TRUNCATION_MARKER
+
+    def _fit_items(self, items, budget, keep, separator):
+        if budget is None:
+            return separator.join(items)
+        ordered = items if keep == "first" else list(reversed(items))
+        kept = []
+        used = 0
+        separator_tokens = count_tokens(separator, self.model_name)
+        for item in ordered:
+            item_tokens = count_tokens(item, self.model_name) + (separator_tokens if kept else 0)
+            if used + item_tokens > budget:
+                break
+            kept.append(item)
+            used += item_tokens
+        if not kept and ordered:
+            # a single oversized item is truncated rather than dropped
+            kept.append(self._fit({"value": ordered[0]}, budget))
+        if keep != "first":
+            kept.reverse()
+        return separator.join(kept)
@@ -0,0 +1,177 @@
+import threading
+import asyncio
+import logging
+import random
+import time
+import os
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 5))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', 1))
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', 60))
+# quotas are per organisation, every process calling the providers gets an equal share of them:
+# the web workers plus the memory worker and the job worker (python -m app.jobs.worker)
+WORKER_PROCESSES = int(os.getenv('LLM_QUOTA_PROCESSES', int(os.getenv('WEB_CONCURRENCY', 1)) + 2))
+# fraction of the quota that bulk work (document ingestion) may use, the rest stays free for chat traffic
+BULK_RATE_LIMIT_SHARE = float(os.getenv('BULK_RATE_LIMIT_SHARE', 0.5))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# connection/timeout errors of the openai and google clients carry no status code
+RETRYABLE_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "TooManyRequests",
+}
+
+
+class RetryPolicy:
+    """
+    Retries transient provider errors with jittered exponential backoff.
+    A Retry-After header sent with the error takes precedence over the computed delay.
+    """
+    def __init__(self, max_retries=LLM_MAX_RETRIES, base_delay=LLM_RETRY_BASE_DELAY, max_delay=LLM_RETRY_MAX_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, error):
+        status = getattr(error, "status_code", None) or getattr(error, "code", None)
+        if isinstance(status, int) and status in RETRYABLE_STATUS_CODES:
+            return True
+        return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+    def delay(self, attempt, error=None):
+        retry_after = self._retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # full jitter: a random delay up to the exponential backoff cap
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _retry_after(self, error):
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            return None
+        return None
+
+    def call(self, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                delay = self.delay(attempt, e)
+                logger.warning(f"{type(e).__name__} calling the model, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    async def acall(self, coro_fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return await coro_fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                delay = self.delay(attempt, e)
+                logger.warning(f"{type(e).__name__} calling the model, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most one minute of tokens.
+    A rate of 0 disables the bucket.
+    """
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = float(rate_per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, amount):
+        """Takes amount tokens and returns how long the caller must wait for them."""
+        if self.rate <= 0:
+            return 0.0
+        # a request larger than the bucket would never fit, it waits for a full bucket instead
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, amount=1):
+        wait = self._reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, amount=1):
+        wait = self._reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Client side pacing of a provider's requests (RPM) and tokens (TPM).
+    Bulk requests also draw from buckets sized to BULK_RATE_LIMIT_SHARE of the quota,
+    so ingestion can never use up the whole quota of the interactive traffic.
+    """
+    def __init__(self, rpm=0, tpm=0, bulk_share=BULK_RATE_LIMIT_SHARE):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.bulk_requests = TokenBucket(rpm * bulk_share)
+        self.bulk_tokens = TokenBucket(tpm * bulk_share)
+
+    def acquire(self, tokens=0, bulk=False):
+        if bulk:
+            self.bulk_requests.acquire(1)
+            self.bulk_tokens.acquire(tokens)
+        self.requests.acquire(1)
+        self.tokens.acquire(tokens)
+
+    async def aacquire(self, tokens=0, bulk=False):
+        if bulk:
+            await self.bulk_requests.aacquire(1)
+            await self.bulk_tokens.aacquire(tokens)
+        await self.requests.aacquire(1)
+        await self.tokens.aacquire(tokens)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider):
+    """
+    Returns the rate limiter shared by all calls to the provider, sized from
+    <PROVIDER>_RPM and <PROVIDER>_TPM (0 = unlimited) divided by LLM_QUOTA_PROCESSES.
+    """
+    with _limiters_lock:
+        if provider not in _limiters:
+            rpm = float(os.getenv(f'{provider.upper()}_RPM', 0)) / WORKER_PROCESSES
+            tpm = float(os.getenv(f'{provider.upper()}_TPM', 0)) / WORKER_PROCESSES
+            _limiters[provider] = RateLimiter(rpm, tpm)
+        return _limiters[provider]
+
+
+retry_policy = RetryPolicy()
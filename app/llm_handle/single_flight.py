@@ -0,0 +1,189 @@
+from concurrent.futures import Future
+import threading
+import asyncio
+import weakref
+import logging
+import json
+import time
+import os
+import uuid
+import redis
+from dotenv import load_dotenv
+from app.lib.async_clients import get_async_redis
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+REDIS_URL = os.getenv('REDIS_URL')
+SINGLE_FLIGHT_REDIS_ENABLED = os.getenv('SINGLE_FLIGHT_REDIS_ENABLED', 'false').lower() == 'true'
+# how long a leader may hold the cross worker lock and how long followers can read its result
+SINGLE_FLIGHT_LOCK_TIMEOUT = int(os.getenv('SINGLE_FLIGHT_LOCK_TIMEOUT', 90))
+SINGLE_FLIGHT_RESULT_TTL = int(os.getenv('SINGLE_FLIGHT_RESULT_TTL', 30))
+SINGLE_FLIGHT_POLL_INTERVAL = 0.1
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight calls.
+    The first caller of a key (the leader) runs the function, concurrent callers with the same key
+    wait for the leader's result instead of repeating the call.
+    Threads of a worker share one Future, coroutines of an event loop share one task.
+    With a Redis client, calls are also coalesced across workers: the leader holds a Redis lock
+    and publishes its JSON serializable result for the followers of the other workers.
+    """
+    def __init__(self, redis_url=None, namespace="single_flight",
+                 lock_timeout=SINGLE_FLIGHT_LOCK_TIMEOUT, result_ttl=SINGLE_FLIGHT_RESULT_TTL):
+        self.namespace = namespace
+        self.lock_timeout = lock_timeout
+        self.result_ttl = result_ttl
+        self.redis_url = redis_url
+        self.redis = redis.Redis.from_url(redis_url, decode_responses=True) if redis_url else None
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._loop_calls = weakref.WeakKeyDictionary()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """
+        Runs fn() once for all concurrent callers of key and returns its result to each of them.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = Future()
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = self._run_across_workers(key, fn) if self.redis is not None else fn()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    async def ado(self, key, coro_fn):
+        """
+        Coroutine version of do, coro_fn() must return an awaitable.
+        The call runs in its own task that every caller awaits through a shield, so a cancelled caller
+        (client disconnect, discarded speculation), the leader included, doesn't cancel it for the others.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._loop_calls.setdefault(loop, {})
+            call = calls.get(key)
+            if call is None:
+                runner = self._arun_across_workers(key, coro_fn) if self.redis is not None else coro_fn()
+                call = asyncio.ensure_future(runner)
+                calls[key] = call
+                call.add_done_callback(lambda done: self._call_done(calls, key, done))
+            else:
+                self.coalesced += 1
+        return await asyncio.shield(call)
+
+    def _call_done(self, calls, key, call):
+        with self._lock:
+            if calls.get(key) is call:
+                calls.pop(key)
+        if not call.cancelled():
+            # marks the exception as retrieved when every caller was cancelled
+            call.exception()
+
+    async def _arun_across_workers(self, key, coro_fn):
+        """Async version of _run_across_workers, on the redis.asyncio client of the running loop."""
+        client = get_async_redis(self.redis_url)
+        lock_key = f"{self.namespace}:lock:{key}"
+        result_key = f"{self.namespace}:result:{key}"
+        token = str(uuid.uuid4())
+        try:
+            acquired = await client.set(lock_key, token, nx=True, ex=self.lock_timeout)
+        except redis.RedisError as e:
+            logger.warning(f"Single flight redis lock failed, running the call locally: {e}")
+            return await coro_fn()
+
+        if acquired:
+            try:
+                result = await coro_fn()
+                try:
+                    await client.set(result_key, json.dumps(result), ex=self.result_ttl)
+                except (redis.RedisError, TypeError) as e:
+                    logger.warning(f"Single flight result could not be shared: {e}")
+                return result
+            finally:
+                try:
+                    # release only our own lock, it may have expired and been taken by another leader
+                    if await client.get(lock_key) == token:
+                        await client.delete(lock_key)
+                except redis.RedisError:
+                    pass
+
+        # another worker is running the same call, wait for its result
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            try:
+                value = await client.get(result_key)
+                if value is not None:
+                    self.coalesced += 1
+                    return json.loads(value)
+                if not await client.exists(lock_key):
+                    break
+            except redis.RedisError:
+                break
+            await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        logger.info("Single flight leader of another worker did not publish a result, running the call locally")
+        return await coro_fn()
+
+    def _run_across_workers(self, key, fn):
+        lock_key = f"{self.namespace}:lock:{key}"
+        result_key = f"{self.namespace}:result:{key}"
+        token = str(uuid.uuid4())
+        try:
+            acquired = self.redis.set(lock_key, token, nx=True, ex=self.lock_timeout)
+        except redis.RedisError as e:
+            logger.warning(f"Single flight redis lock failed, running the call locally: {e}")
+            return fn()
+
+        if acquired:
+            try:
+                result = fn()
+                try:
+                    self.redis.set(result_key, json.dumps(result), ex=self.result_ttl)
+                except (redis.RedisError, TypeError) as e:
+                    logger.warning(f"Single flight result could not be shared: {e}")
+                return result
+            finally:
+                try:
+                    # release only our own lock, it may have expired and been taken by another leader
+                    if self.redis.get(lock_key) == token:
+                        self.redis.delete(lock_key)
+                except redis.RedisError:
+                    pass
+
+        # another worker is running the same call, wait for its result
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            try:
+                value = self.redis.get(result_key)
+                if value is not None:
+                    self.coalesced += 1
+                    return json.loads(value)
+                if not self.redis.exists(lock_key):
+                    break
+            except redis.RedisError:
+                break
+            time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        logger.info("Single flight leader of another worker did not publish a result, running the call locally")
+        return fn()
+
+
+single_flight = SingleFlight(REDIS_URL if SINGLE_FLIGHT_REDIS_ENABLED else None)
@@ -0,0 +1,35 @@
+from functools import lru_cache
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name=None):
+    """
+    Returns the tiktoken encoding of the model.
+    Models unknown to tiktoken (e.g. Gemini) are approximated with cl100k_base.
+    """
+    if model_name:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            pass
+    return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text, model_name=None):
+    if not text:
+        return 0
+    return len(get_encoding(model_name).encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, model_name=None):
+    """Cuts text down to at most max_tokens tokens."""
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(model_name)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
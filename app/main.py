@@ -1,17 +1,23 @@
-
-
-import autogen
-from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
 from .llm_handle.llm_models import LLMInterface,OpenAIModel,get_llm_model,openai_embedding_model
+from app.llm_handle.prompt_builder import PromptBuilder
+from app.llm_handle.model_router import ModelRouter
+from app.routing.tool_router import ToolRouter
+from app.routing.intent_classifier import IntentClassifier, INTENT_CLASSIFIER_ENABLED
+from app.routing.small_talk import SmallTalk, SMALL_TALK_ENABLED
+from app.prompts.router_prompt import ANNOTATION_TOOL, RAG_TOOL, HYPOTHESIS_TOOL
 from .annotation_graph.annotated_graph import Graph
 from app.annotation_graph.schema_handler import SchemaHandler
 from app.rag.rag import RAG
+from app.rag.speculative import SpeculativeRetrieval, SPECULATIVE_RETRIEVAL_ENABLED
 from app.prompts.conversation_handler import conversation_prompt
 from app.prompts.classifier_prompt import classifier_prompt
 from app.summarizer import Graph_Summarizer
 from app.hypothesis_generation.hypothesis import HypothesisGeneration
 from app.storage.history import History
 from app.storage.sql_redis_storage import DatabaseManager
+from app.socket_manager import progress_publisher, apublish
+from app.lib.tracing import traced
+from app.jobs.jobs import get_job_store, PDF_INGESTION_JOB, HYPOTHESIS_JOB, JOB_UPLOAD_DIR
 import asyncio
 import logging.handlers as loghandlers
 from dotenv import load_dotenv
@@ -20,7 +26,7 @@ import traceback
 import logging
 import asyncio
 import json
-import autogen
+import uuid
 import os
 
 logger = logging.getLogger(__name__)
@@ -40,198 +46,225 @@ loghandle.setFormatter(
     logging.Formatter("%(asctime)s %(message)s"))
 logger.addHandler(loghandle)
 load_dotenv()
+
+CONVERSATION_PROMPT_MAX_TOKENS = 4000
+
 class AiAssistance:
 
-    def __init__(self, advanced_llm:LLMInterface, basic_llm:LLMInterface, schema_handler:SchemaHandler) -> None:
+    def __init__(self, advanced_llm:LLMInterface, basic_llm:LLMInterface, schema_handler:SchemaHandler, model_routing=None) -> None:
         self.advanced_llm = advanced_llm     
         self.basic_llm = basic_llm
-        self.annotation_graph = Graph(advanced_llm, schema_handler)
-        self.graph_summarizer = Graph_Summarizer(self.advanced_llm)
-        self.rag = RAG(llm=advanced_llm)
+        # components call the router with a task name, it picks the model tier for each call
+        self.llm_router = ModelRouter({"advanced": advanced_llm, "basic": basic_llm}, model_routing)
+        self.annotation_graph = Graph(self.llm_router, schema_handler)
+        self.graph_summarizer = Graph_Summarizer(self.llm_router)
+        self.rag = RAG(llm=self.llm_router)
         self.history = History()
         self.store = DatabaseManager()
-        self.hypothesis_generation = HypothesisGeneration(advanced_llm)
-    
-        if self.advanced_llm.model_provider == 'gemini':
-            self.llm_config = [{"model":"gemini-1.5-flash","api_key": self.advanced_llm.api_key}]
-        else:
-            self.llm_config = [{"model": self.advanced_llm.model_name, "api_key":self.advanced_llm.api_key}]
-
-    def agent(self,message,user_id, token):
-        # message = self.preprocess_message(message)
-
-        # graph_agent = AssistantAgent(
-        #     name="gragh_generate",
-        #     llm_config = {"config_list" : self.llm_config},
-        #     system_message=("""
-        #                     You are a knowledgeable assistant that executes biological queries in JSON format.
-        #                     You must not interpret or modify the JSON.
-        #                     When you receive a JSON query, use the `generate_graph` tool to process it and return the output.
-        #                     Do not respond with explanations or summaries—just run the tool and return its result.
-        #                     End your response with 'TERMINATE'.
-        #                 """))
-
-        annotation_validate_agent = AssistantAgent(
-            name="validate a json format for a validation",
-            llm_config = {"config_list" : self.llm_config},
-            system_message=("""
-                You are responsible for handling ONLY factual annotation-related user queries. 
-                YOUR PRIMARY ROLE:
-                - Convert user questions into valid JSON format for Neo4j graph database execution
-                - Handle entity identification and relationship queries
-                
-                TYPES OF QUERIES YOU HANDLE:
-                - Gene ID lookups (e.g., "What is ENSG00000140718?")
-                - Protein information retrieval (e.g., "Show me information about TP53 protein")
-                - Known gene-gene interactions (e.g., "How does BRCA1 interact with BRCA2?")
-                - Any query asking for ESTABLISHED FACTS or DOCUMENTED RELATIONSHIPS
-                DO NOT generate any text-based responses using your internal knowledge
-                ALWAYS use the function to process user queries about genomic information
-                When receiving a query, immediately execute the function with the query parameters
-                """),
-                )
-        
-        hypothesis_generation_agent = AssistantAgent(
-            name="hypothesis generations",
-            llm_config = {"config_list" : self.llm_config},
-            system_message=("""
-                You are responsible for identifying hypothesis-generation queries about biological mechanisms and ALWAYS using the hypothesis_generation function to process them.
-                
-                YOUR PRIMARY ROLE:
-                - Recognize when a user is asking for speculative biological reasoning
-                - ALWAYS use the hypothesis_generation function to process these queries
-                - Do not provide direct responses or explanations - use only the function
-                - Return only what the hypothesis_generation function outputs
-                
-                QUERY IDENTIFICATION CRITERIA:
-                - The query asks about potential mechanisms or causal relationships
-                - The query uses speculative language (e.g., "how might," "could," "possibly")
-                - The query seeks explanations rather than established facts
-                - The user wants reasoning about biological processes or effects
-                - ANY query asking to explain variants (rs numbers) or phenotypes
-                """),
-            )
-        
-        rag_agent = AssistantAgent(
-            name="rag_retrival",
-            llm_config = {"config_list" : self.llm_config},
-            system_message=("""
-                You are responsible for identifying general information queries that fall outside specific biological entity lookups or mechanisms.
-                YOUR PRIMARY ROLE:
-                - Recognize general information requests that aren't targeted biological lookups or hypothesis generation
-                - Route these general queries to the appropriate retrieval function
-                - Handle queries that don't fit the specific criteria of the other specialized agents
-
-                QUERY IDENTIFICATION CRITERIA:
-                - The query requests general scientific or contextual information
-                - The query doesn't focus on specific biological entity data retrieval
-                - The query doesn't ask for speculative biological mechanisms
-                KEY DETECTION PHRASES:
-                "what is rejuve"
-                "General information about this site?"
-                IMPORTANT: You only identify and route queries to the appropriate function. The function will retrieve and present the actual information. Reply 'TERMINATE' when the identification and routing is complete.
-               """
-               ),)
-
-        user_agent = UserProxyAgent(
-            name="user",
-            llm_config=False,
-            code_execution_config=False,
-            human_input_mode="NEVER",
-            is_termination_msg=lambda x: x.get("content", "") and x.get("content", "").rstrip().endswith("TERMINATE"))
-
-        @user_agent.register_for_execution()
-        @annotation_validate_agent.register_for_llm(description="retrieve the json format provided from the tool")
-        def get_json_format() -> str:
-            try:
-                logger.info(f"Generating graph with arguments: {message}")  # Add this line to log the arguments
-                response = self.annotation_graph.validated_json(message)
-                return response
-            except Exception as e:                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                     
-                logger.error("Error in generating graph", exc_info=True)
-                return f"I couldn't generate a graph for the given question {message} please try again."
-        
-        # @user_agent.register_for_execution()
-        # @graph_agent.register_for_llm(description="Generate and handle bio-knowledge graphs for annotation-related queries.")
-        # def generate_graph():
-        #     try:
-        #         logger.info(f"Generating graph with arguments: {message}")  # Add this line to log the arguments
-        #         response = self.annotation_graph.generate_graph("message",message,token)
-        #         return response
-        #     except Exception as e:
-        #         logger.error("Error in generating graph", exc_info=True)
-        #         return f"I couldn't generate a graph for the given question {message} please try again."
-
-        @user_agent.register_for_execution()
-        @rag_agent.register_for_llm(description="Retrieve information for general knowledge queries.")
-        def get_general_response() -> str:
-            try:
-                response = self.rag.get_result_from_rag(message, user_id)
-                return response
-            except Exception as e:
-                logger.error("Error in retrieving response", exc_info=True)
-                return "Error in retrieving response."
-
-        @user_agent.register_for_execution()
-        @hypothesis_generation_agent.register_for_llm(description="generation of hypothesis")
-        def hypothesis_generation() -> str:
-            try:
-                logger.info(f"Here is the user query passed to the agent {message}")
-                response = self.hypothesis_generation.generate_hypothesis(token=token,user_query=message)
-                return response
-            except:
-                traceback.print_exc()
-       
-        group_chat = GroupChat(agents=[user_agent, rag_agent,annotation_validate_agent,hypothesis_generation_agent], messages=[],max_round=3)
-        group_manager = GroupChatManager(
-            groupchat=group_chat,
-            llm_config = {"config_list" : self.llm_config},
-            human_input_mode="NEVER")
-
-        user_agent.initiate_chat(group_manager, message=message, clear_history=True)
-
-        response = group_chat.messages[2]['content']
-        if response:
+        self.hypothesis_generation = HypothesisGeneration(self.llm_router)
+        self.speculative_retrieval = SpeculativeRetrieval(self.rag)
+        self.small_talk = SmallTalk(self.rag.embedding_model) if SMALL_TALK_ENABLED else None
+        self.intent_classifier = IntentClassifier(self.rag.embedding_model) if INTENT_CLASSIFIER_ENABLED else None
+        self.tool_router = ToolRouter(self.llm_router, {
+            ANNOTATION_TOOL: self._annotation_tool,
+            RAG_TOOL: self._rag_tool,
+            HYPOTHESIS_TOOL: self._hypothesis_tool,
+        }, classifier=self.intent_classifier)
+
+    async def _annotation_tool(self, message, user_id=None, token=None):
+        try:
+            logger.info(f"Generating graph with arguments: {message}")  # Add this line to log the arguments
+            response = await self.annotation_graph.validated_json(message)
+            return response
+        except Exception as e:
+            logger.error("Error in generating graph", exc_info=True)
+            return f"I couldn't generate a graph for the given question {message} please try again."
+
+    async def _rag_tool(self, message, user_id=None, token=None, retrieved=None):
+        try:
+            response = await self.rag.get_result_from_rag(message, user_id, retrieved=retrieved)
             return response
-        return group_chat.messages[1]['content']
+        except Exception as e:
+            logger.error("Error in retrieving response", exc_info=True)
+            return "Error in retrieving response."
+
+    async def _hypothesis_tool(self, message, user_id=None, token=None):
+        try:
+            logger.info(f"Here is the user query passed to the agent {message}")
+            response = await self.hypothesis_generation.generate_hypothesis(
+                token=token, user_query=message, progress=progress_publisher(user_id, "hypothesis"))
+            await apublish(user_id, "hypothesis", {"stage": "done", "result": response})
+            return response
+        except:
+            traceback.print_exc()
+
+    async def agent(self,message,user_id, token, deferred=None, speculation=None):
+        """
+        Routes the message to the annotation, RAG or hypothesis tool and returns the tool's response.
+        When `deferred` is a dict and the RAG tool is selected, the query is stored in deferred["rag"]
+        and None is returned so that the caller can stream the answer itself.
+        A speculative retrieval started for the request is handed to the RAG tool or discarded.
+        """
+        tool = await self.tool_router.select(message)
+        if deferred is not None and tool == RAG_TOOL:
+            deferred["rag"] = message
+            return None
+        if speculation is not None:
+            if tool == RAG_TOOL:
+                retrieved = await speculation.take(message)
+                return await self.tool_router.dispatch(tool, message, user_id=user_id, token=token, retrieved=retrieved)
+            speculation.discard("other_tool")
+        return await self.tool_router.dispatch(tool, message, user_id=user_id, token=token)
     
-    async def assistant(self,query,user_id, token, user_context=None,context=None):
+    @traced("conversation_prompt")
+    async def _conversation_prompt(self, query, user_id, user_context=None):
         try:
-            user_information = self.store.get_context_and_memory(user_id)
-            context=None 
+            # SQLite reads are blocking
+            user_information = await asyncio.to_thread(self.store.get_context_and_memory, user_id)
             memory=user_information['memories']
             history = user_information['questions']
             logger.info(f"here is the memory and history {memory} {history}")
         except:
-            context = {""}
             history = {""}
             memory = {""}
-        prompt = conversation_prompt.format(memory=memory,query=query,history=history,user_context=user_context)
-        response = self.advanced_llm.generate(prompt)
+        # the graph summary in user_context can be arbitrarily large, every section gets a token budget
+        builder = PromptBuilder(conversation_prompt, model_name=self.llm_router.route("conversation")[0].model_name,
+                                max_tokens=CONVERSATION_PROMPT_MAX_TOKENS, name="conversation_prompt")
+        builder.add("query", query)
+        builder.add("user_context", user_context, budget=1500, priority=1)
+        builder.add("memory", list(memory), budget=500, priority=2, keep="last")
+        builder.add("history", list(history), budget=500, priority=3, keep="last")
+        return builder.build()
+
+    @traced("small_talk")
+    async def _small_talk_response(self, query, user_id):
+        """
+        Answers greetings, thanks and goodbyes from templates.
+        These turns skip the conversation LLM call and the memory extraction, only the history is saved.
+        """
+        if self.small_talk is None:
+            return None
+        reply = await asyncio.to_thread(self.small_talk.respond, query)
+        if reply is None:
+            return None
+        await self.history.acreate_history(user_id, query, reply)
+        return {"text": reply}
+
+    async def assistant(self,query,user_id, token, user_context=None,context=None, speculation=None):
+        context = None
+        small_talk = await self._small_talk_response(query, user_id)
+        if small_talk:
+            return small_talk
+        prompt = await self._conversation_prompt(query, user_id, user_context)
+        response = await self.llm_router.agenerate(prompt, task="conversation")
 
         if response:
             if "response:" in response:
                 result = response.split("response:")[1].strip()
                 final_response = result.strip('"')
-                await self.store.save_user_information(self.advanced_llm,query, user_id, context)
-                self.history.create_history(user_id, query, final_response)
+                await self.store.save_user_information(self.llm_router,query, user_id, context)
+                await self.history.acreate_history(user_id, query, final_response)
                 return {"text": final_response}
                 
             elif "question:" in response:
                 refactored_question = response.split("question:")[1].strip()
-                await self.store.save_user_information(self.advanced_llm,query, user_id, context)
-                agent_response = self.agent(refactored_question, user_id, token)
+                await self.store.save_user_information(self.llm_router,query, user_id, context)
+                agent_response = await self.agent(refactored_question, user_id, token, speculation=speculation)
                 return agent_response
             else:
                 logger.warning(f"Unexpected response format: {response}")
-                await self.store.save_user_information(self.advanced_llm,query, user_id, context)
+                await self.store.save_user_information(self.llm_router,query, user_id, context)
                 return {"text": response or "I'm sorry, I couldn't process your request properly."}
         else:
             logger.error("No response generated from LLM")
-            await self.store.save_user_information(self.advanced_llm,query, user_id, context)
+            await self.store.save_user_information(self.llm_router,query, user_id, context)
             return {"text": "I'm sorry, I couldn't generate a response at this time."}
     
-    def assistant_response(self,query,user_id,token,graph=None,graph_id=None,file=None,resource="annotation"):  
+    async def assistant_stream(self, query, user_id, token, graph_id=None, file=None, resource="annotation"):
+        """
+        Streaming version of assistant_response, an async generator.
+        Yields (event, data) tuples: "stage" events while the request is routed and processed,
+        "token" events with the answer text as it is generated and a final "done" event with the full response.
+        Requests with a file or a graph id are processed as usual and returned in the "done" event.
+        """
+        try:
+            if file or graph_id:
+                yield "stage", {"stage": "generating"}
+                response = await self.assistant_response(query=query, user_id=user_id, token=token,
+                                                         graph_id=graph_id, file=file, resource=resource)
+                yield "done", response
+                return
+
+            small_talk = await self._small_talk_response(query, user_id)
+            if small_talk:
+                yield "token", small_talk
+                yield "done", small_talk
+                return
+
+            yield "stage", {"stage": "routing"}
+            prompt = await self._conversation_prompt(query, user_id)
+            response = await self.llm_router.agenerate(prompt, task="conversation")
+
+            if response and "question:" in response and "response:" not in response:
+                refactored_question = response.split("question:")[1].strip()
+                yield "stage", {"stage": "retrieving"}
+                deferred = {}
+                agent_response = await self.agent(refactored_question, user_id, token, deferred=deferred)
+                if "rag" in deferred:
+                    yield "stage", {"stage": "generating"}
+                    parts = []
+                    async for part in self.rag.stream_result_from_rag(deferred["rag"], user_id):
+                        parts.append(part)
+                        yield "token", {"text": part}
+                    final_response = {"text": "".join(parts)}
+                else:
+                    final_response = agent_response
+            elif response and "response:" in response:
+                final_response = {"text": response.split("response:")[1].strip().strip('"')}
+                yield "token", final_response
+            else:
+                logger.warning(f"Unexpected response format: {response}")
+                final_response = {"text": response or "I'm sorry, I couldn't generate a response at this time."}
+                yield "token", final_response
+
+            # saved before the final event: the client usually disconnects when it receives it, the generator
+            # is then closed and code after the yield never runs. The memory extraction is only queued.
+            await self.store.save_user_information(self.llm_router, query, user_id)
+            await self.history.acreate_history(user_id, query, json.dumps(final_response, default=str))
+            yield "done", final_response
+        except Exception as e:
+            traceback.print_exc()
+            yield "error", {"text": "I'm sorry, I couldn't process your request properly."}
+
+    async def submit_pdf_job(self, file, user_id):
+        """
+        Queues the ingestion of an uploaded PDF for the job worker.
+        The file is saved in JOB_UPLOAD_DIR, shared with the job worker, and removed once it is ingested.
+        :return: the job id.
+        """
+        os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+        path = os.path.join(JOB_UPLOAD_DIR, f"{uuid.uuid4()}.pdf")
+        await file.save(path)
+        try:
+            return await get_job_store().create(PDF_INGESTION_JOB, user_id, {"path": path, "file_name": file.filename})
+        except Exception:
+            os.remove(path)
+            raise
+
+    async def submit_hypothesis_job(self, query, user_id, token):
+        """
+        Queues the hypothesis generation of the query for the job worker.
+        :return: the job id.
+        """
+        # the hypothesis service is called with the user's token
+        return await get_job_store().create(HYPOTHESIS_JOB, user_id, {"query": query, "token": token})
+
+    async def assistant_response(self,query,user_id,token,graph=None,graph_id=None,file=None,resource="annotation",
+                           speculative=SPECULATIVE_RETRIEVAL_ENABLED):
+        """
+        :param speculative: start the RAG retrieval of a plain query while it is being routed,
+                            the retrieval is discarded when the query is not answered by RAG.
+        """
         try:
             logger.info(f"passes parameters are query = {query}, user_id= {user_id}, graphid={graph_id}, graph = {graph}, resource = {resource}")
             if (file and query) or (file and graph):
@@ -239,8 +272,11 @@ class AiAssistance:
 
             if file:
                 if file.filename.lower().endswith('.pdf'):
-                    response = self.rag.save_retrievable_docs(file,user_id,filter=True)   
-                    self.history.create_history(user_id, query, json.dumps(response))
+                    # PDF parsing and bulk embedding are blocking, they run in a worker thread
+                    response = await asyncio.to_thread(self.rag.save_retrievable_docs, file, user_id, filter=True,
+                                                       progress=progress_publisher(user_id, "pdf"))
+                    await apublish(user_id, "pdf", {"stage": "done", "result": response})
+                    await self.history.acreate_history(user_id, query, json.dumps(response))
                     return response
                 else:
                     response = {
@@ -256,21 +292,21 @@ class AiAssistance:
                     logger.debug("Query provided with graph_id")
                     if resource == "annotation":
                             # Process summary with query
-                            summary = self.graph_summarizer.summary(token=token, graph_id=graph_id)
+                            summary = await self.graph_summarizer.summary(token=token, graph_id=graph_id)
                             prompt = classifier_prompt.format(query=query, graph_summary=summary)
-                            response = self.advanced_llm.generate(prompt)
+                            response = await self.llm_router.agenerate(prompt, task="graph_classifier")
                             
                             if response.startswith("related:"):
                                 logger.info("question is related with the graph")
                                 query_response = response[len("related:"):].strip()
                                 # creating users history
-                                self.history.create_history(user_id, query, query_response)
+                                await self.history.acreate_history(user_id, query, query_response)
                                 logger.info(f"user query is {query} response is {query_response}")
                                 return {"text":query_response}
 
                             elif "not" in response:
                                 logger.info("question not related with the graph so sending the query {query} to agent")
-                                response = asyncio.run(self.assistant(query, user_id, token, user_context=summary,context=resource))
+                                response = await self.assistant(query, user_id, token, user_context=summary,context=resource)
                                 logger.info(f"user query is {query} response is {response}")  
                                 return response           
                             else:
@@ -282,30 +318,30 @@ class AiAssistance:
                         TODO
                         save hypothesis graphs ids along summary if same graph is asked again we won't send an api call instead we will just refer from the db by the id
                         """
-                        summary = self.hypothesis_generation.get_by_hypothesis_id(token,graph_id,query)
+                        summary = await self.hypothesis_generation.get_by_hypothesis_id(token,graph_id,query)
                         logger.info(f"Summaries of the graph id {graph_id} is {summary}")
                         if summary is None:
                             logger.info(f"question not related with the graph so sending the query {query} to agent")
                             try:
-                                response = asyncio.run(self.assistant(query, user_id, token, user_context=summary))
+                                response = await self.assistant(query, user_id, token, user_context=summary)
                                 logger.info(f"user query is {query} response is {response}")
                                 return response
                             except:
                                 return {"text":"Sorry I coudnt understand your question"}
                             
                         prompt = classifier_prompt.format(query=query,graph_summary=summary)
-                        response = self.advanced_llm.generate(prompt)
+                        response = await self.llm_router.agenerate(prompt, task="graph_classifier")
 
                         if response.startswith("related:"):
                             logger.info("question is related with the graph")
                             query_response = response[len("related:"):].strip()
-                            self.history.create_history(user_id, query, query_response)
+                            await self.history.acreate_history(user_id, query, query_response)
                             logger.info(f"user query is {query} response is {query_response}")
                             return {"text":query_response}
                             
                         elif response.strip() == "not":
                             logger.info(f"question not related with the graph so sending the query {query} to agent")
-                            response = asyncio.run(self.assistant(query, user_id, token, user_context=summary))
+                            response = await self.assistant(query, user_id, token, user_context=summary)
                             logger.info(f"user query is {query} response is {response}")
                             return response
 
@@ -321,13 +357,13 @@ class AiAssistance:
                     logger.debug("No query provided, but graph_id is available")
                     if resource == "annotation":
                         # Process summary without query
-                        summary = self.graph_summarizer.summary(token=token, graph_id=graph_id, user_query=None)
+                        summary = await self.graph_summarizer.summary(token=token, graph_id=graph_id, user_query=None)
                         # creating users history
-                        self.history.create_history(user_id, query, summary)
+                        await self.history.acreate_history(user_id, query, summary)
                         return summary
                     elif resource == "hypothesis":
                         logger.info("Hypothesis resource, no query provided")
-                        summary = self.hypothesis_generation.get_by_hypothesis_id(token,graph_id,query)
+                        summary = await self.hypothesis_generation.get_by_hypothesis_id(token,graph_id,query)
                         return {"text": summary}
                     else:
                         logger.error(f"Unsupported resource type: '{resource}'")
@@ -335,24 +371,33 @@ class AiAssistance:
  
             if query:
                 logger.info(f"agent being called for a given query {query} from resource {resource}")
-                response = asyncio.run(self.assistant(query=query, user_id=user_id, token=token,context=resource))
+                speculation = self.speculative_retrieval.start(query, user_id) if speculative else None
+                try:
+                    response = await self.assistant(query=query, user_id=user_id, token=token,context=resource,
+                                                    speculation=speculation)
+                finally:
+                    if speculation is not None:
+                        # answered without the RAG tool (small talk, direct answer or error)
+                        speculation.discard("unused")
                 return response 
 
             if query and graph:
-                summary = self.graph_summarizer.summary(user_query=query,graph=graph)
-                self.history.create_history(user_id, query, response)             
+                summary = await self.graph_summarizer.summary(user_query=query,graph=graph,
+                                                              progress=progress_publisher(user_id, "summary"))
+                await self.history.acreate_history(user_id, query, response)             
                 return summary
 
             if graph:
-                summary = self.graph_summarizer.summary(user_query=query,graph=graph)
-                self.history.create_history(user_id, query, response)     
+                summary = await self.graph_summarizer.summary(user_query=query,graph=graph,
+                                                              progress=progress_publisher(user_id, "summary"))
+                await self.history.acreate_history(user_id, query, response)     
                 return summary
 
             if json_query:
                 logger.info(f"Executing a json query {json_query} to the annotation service")
                 try:
                     logger.info(f"Generating graph with arguments: {json_query}")  # Add this line to log the arguments
-                    response = self.annotation_graph.generate_graph(f"json format accepted from the user is {json}",json,token)
+                    response = await self.annotation_graph.generate_graph(f"json format accepted from the user is {json}",json,token)
                     return response
                 except Exception as e:
                     logger.error("Error in generating graph", exc_info=True)
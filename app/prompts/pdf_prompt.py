@@ -2,4 +2,15 @@ PDF_SUMMARY_PROMPT = '''
                     Using the provided PDF document {pdf}, create a concise and clear summary that highlights the main points, key relationships, and essential information. 
                     The summary should be no longer than 150 words and focus on the most relevant details.
                     '''
-                    
\ No newline at end of file
+                    
+PDF_SECTION_SUMMARY_PROMPT = '''
+                    The following is a section of a PDF document: {section}
+                    Summarize the section, keeping its main points, key relationships, findings and the names of the entities (genes, proteins, diseases, methods) it mentions.
+                    The summary should be no longer than 150 words.
+                    '''
+
+PDF_MERGE_SUMMARY_PROMPT = '''
+                    The following are the summaries of consecutive sections of a PDF document: {summaries}
+                    Merge them into one summary of these sections that keeps the main points, key relationships and findings, in the order of the document.
+                    The summary should be no longer than 200 words.
+                    '''
@@ -0,0 +1,58 @@
+ANNOTATION_TOOL = "get_json_format"
+RAG_TOOL = "get_general_response"
+HYPOTHESIS_TOOL = "hypothesis_generation"
+
+TOOL_ROUTER_SYSTEM_PROMPT = """
+You route user queries of the Rejuve platform's AI assistant to exactly one tool.
+Do not answer the query yourself, ALWAYS call one of the tools.
+
+- get_json_format: factual annotation queries, converted to a JSON query for the Neo4j knowledge graph.
+  Gene ID lookups (e.g. "What is ENSG00000140718?"), protein information (e.g. "Show me information about TP53 protein"),
+  known gene-gene interactions (e.g. "How does BRCA1 interact with BRCA2?"),
+  any query asking for ESTABLISHED FACTS or DOCUMENTED RELATIONSHIPS about biological entities.
+- hypothesis_generation: speculative biological reasoning.
+  Potential mechanisms or causal relationships, speculative language ("how might", "could", "possibly"),
+  explanations of biological processes or effects, ANY query asking to explain variants (rs numbers) or phenotypes.
+- get_general_response: general information queries that are neither targeted biological entity lookups nor
+  hypothesis generation, e.g. "what is rejuve", "General information about this site?", questions about uploaded documents.
+"""
+
+TOOL_DEFINITIONS = [
+    {
+        "type": "function",
+        "function": {
+            "name": ANNOTATION_TOOL,
+            "description": "Convert a factual annotation query about genes, proteins or their documented relationships "
+                           "into a JSON query for the knowledge graph.",
+            "parameters": {"type": "object", "properties": {}},
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": HYPOTHESIS_TOOL,
+            "description": "Generate a hypothesis for speculative questions about biological mechanisms, "
+                           "variants (rs numbers) or phenotypes.",
+            "parameters": {"type": "object", "properties": {}},
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": RAG_TOOL,
+            "description": "Retrieve information for general knowledge queries about Rejuve, the site or uploaded documents.",
+            "parameters": {"type": "object", "properties": {}},
+        },
+    },
+]
+
+TOOL_SELECTION_PROMPT = """
+{system_prompt}
+
+Available tools:
+{tools}
+
+Query: {query}
+
+Return only JSON in the format {{"tool": "<tool name>"}}.
+"""
@@ -0,0 +1,155 @@
+import logging
+import re
+import os
+from dotenv import load_dotenv
+from app.llm_handle.tokenizer import get_encoding
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# chunk size in tokens of the embedding model, small chunks retrieve precisely and keep RETRIEVE_PROMPT small
+CHUNK_SIZE_TOKENS = int(os.getenv('CHUNK_SIZE_TOKENS', 512))
+# tokens of the end of a chunk repeated at the start of the next one, so a passage cut in two is still retrievable
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', 64))
+
+# a blank line ends a paragraph, a sentence ends with .!? (optionally closed by a quote or bracket)
+# followed by whitespace and a character that doesn't start with a lowercase letter ("e.g. the", "et al. in")
+# the punctuation is matched (not looked behind) so that the scan only stops on candidate characters
+_BOUNDARY = re.compile(r'([.!?]["\')\]]?)\s+(?=[^\sa-z])|\n[ \t]*\n\s*')
+
+
+class Chunker:
+    """
+    Splits documents into chunks of at most `max_tokens` tokens on paragraph and sentence boundaries.
+
+    The text is cut into sentences, which are token counted in one batch, and the sentences are packed
+    into chunks. A chunk can run over a page break, it records the page and character offset of its start
+    (`page`, `start`) and of its end (`page_end`, `end`) in the source pages.
+    A sentence longer than `max_tokens` (tables, text without punctuation) is cut on token boundaries.
+    """
+
+    def __init__(self, max_tokens=CHUNK_SIZE_TOKENS, overlap=CHUNK_OVERLAP_TOKENS, model_name=None):
+        """
+        :param max_tokens: maximum number of tokens of a chunk.
+        :param overlap: tokens repeated from the end of the previous chunk, whole sentences only.
+        :param model_name: model whose tokenizer counts the tokens, cl100k_base when not passed.
+        """
+        if overlap >= max_tokens:
+            raise ValueError(f"Chunk overlap ({overlap}) must be smaller than the chunk size ({max_tokens})")
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.encoding = get_encoding(model_name)
+
+    def _segments(self, text):
+        """Yields the (start, end) character offsets of the sentences of the text, without surrounding whitespace."""
+        start = len(text) - len(text.lstrip())
+        for match in _BOUNDARY.finditer(text, start):
+            end = match.end(1) if match.group(1) else match.start()
+            if end > start:
+                yield start, end
+            start = match.end()
+        end = len(text.rstrip())
+        if end > start:
+            yield start, end
+
+    def _split_long(self, text, start, end, tokens):
+        """Cuts a sentence longer than max_tokens into pieces of max_tokens tokens."""
+        # the tokens of encode_ordinary decode back to the sentence, the offsets of a token starting inside
+        # a multi-byte character are the offset of that character
+        _, offsets = self.encoding.decode_with_offsets(tokens)
+        for i in range(0, len(tokens), self.max_tokens):
+            piece_start = start + offsets[i]
+            piece_end = start + offsets[i + self.max_tokens] if i + self.max_tokens < len(tokens) else end
+            # tokens carry the whitespace before them
+            while piece_start < piece_end and text[piece_start].isspace():
+                piece_start += 1
+            yield piece_start, piece_end, min(self.max_tokens, len(tokens) - i)
+
+    def _units(self, number, text):
+        """Sentences of a page as (page, text, start, end, tokens), sentences over max_tokens are cut."""
+        segments = list(self._segments(text)) if text else []
+        if not segments:
+            return []
+        # one batched call to the tokenizer (multithreaded, in rust) counts every sentence of the page
+        counts = self.encoding.encode_ordinary_batch([text[start:end] for start, end in segments])
+        units = []
+        for (start, end), tokens in zip(segments, counts):
+            if len(tokens) <= self.max_tokens:
+                units.append((number, text, start, end, len(tokens)))
+            else:
+                units.extend((number, text, piece_start, piece_end, count)
+                             for piece_start, piece_end, count in self._split_long(text, start, end, tokens))
+        return units
+
+    def stream_pages(self, pages, first_page=1):
+        """
+        Chunks the pages of a document as they come, e.g. from a PDF read page by page.
+        Only the sentences of the chunk being filled are kept, a chunk is yielded as soon as it is full.
+
+        :param pages: iterable of page texts, None for pages without text.
+        :param first_page: number of the first page.
+        :return: generator of dicts with the chunk `content`, its `tokens`, the `page` and `start` offset
+                 of its first sentence and the `page_end` and `end` offset of its last sentence.
+        """
+        pending = []
+        for number, text in enumerate(pages, first_page):
+            pending.extend(self._units(number, text))
+            pending = yield from self._pack(pending, final=False)
+        yield from self._pack(pending, final=True)
+
+    def chunk_pages(self, pages, first_page=1):
+        """Chunks the pages of a document, returns the list of the chunks of `stream_pages`."""
+        return list(self.stream_pages(pages, first_page))
+
+    def chunk(self, text, page=None):
+        """Chunks a single text, `page` is recorded as the page of every chunk."""
+        chunks = self.chunk_pages([text])
+        for chunk in chunks:
+            chunk["page"] = chunk["page_end"] = page
+        return chunks
+
+    def _pack(self, units, final=True):
+        """
+        Yields the chunks of the units and returns the units left for the next page.
+        Unless final, the last chunk is only yielded when the next sentence doesn't fit in it.
+        """
+        first = 0
+        while first < len(units):
+            last, tokens = first, units[first][4]
+            while last + 1 < len(units) and tokens + units[last + 1][4] <= self.max_tokens:
+                last += 1
+                tokens += units[last][4]
+            if last + 1 == len(units):
+                if not final:
+                    return units[first:]
+                yield self._chunk(units[first:], tokens)
+                return []
+            yield self._chunk(units[first:last + 1], tokens)
+            # the next chunk starts with the last sentences of this one, up to `overlap` tokens
+            next_first, overlap = last + 1, 0
+            while next_first - 1 > first and overlap + units[next_first - 1][4] <= self.overlap:
+                next_first -= 1
+                overlap += units[next_first][4]
+            first = next_first
+        return []
+
+    @staticmethod
+    def _chunk(units, tokens):
+        parts = []
+        for number, text, start, end, _ in units:
+            if parts and parts[-1][0] == number and parts[-1][1] is text:
+                # sentences of the same page keep the text between them (spaces, line breaks)
+                parts[-1][3] = end
+            else:
+                parts.append([number, text, start, end])
+        first, last = units[0], units[-1]
+        return {
+            "content": "\n\n".join(text[start:end] for _, text, start, end in parts),
+            "tokens": tokens,
+            "page": first[0],
+            "start": first[2],
+            "page_end": last[0],
+            "end": last[3],
+        }
@@ -0,0 +1,141 @@
+"""
+PDF text extraction backends and the process pool that runs them.
+
+Text extraction is CPU bound (PyPDF2 is pure Python), so page ranges are extracted in a pool of processes,
+outside of the GIL of the web and job workers. A backend is a PdfExtractor registered in EXTRACTORS and
+selected with PDF_EXTRACTOR, compare them with `python -m helper.benchmark_pdf_extraction`.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
+import threading
+import logging
+import os
+from dotenv import load_dotenv
+from PyPDF2 import PdfReader
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+PDF_EXTRACTOR = os.getenv('PDF_EXTRACTOR', 'pypdf2')
+# processes of the extraction pool of each worker, 0 extracts in the calling thread
+PDF_EXTRACTION_PROCESSES = int(os.getenv('PDF_EXTRACTION_PROCESSES', min(4, os.cpu_count() or 1)))
+# pages extracted by a task, every task opens the pdf again so small ranges add parsing overhead
+PDF_EXTRACTION_PAGES_PER_TASK = int(os.getenv('PDF_EXTRACTION_PAGES_PER_TASK', 16))
+
+
+class PdfExtractor:
+    """Extracts the text of the pages of a pdf file, implementations must be picklable by name (see EXTRACTORS)."""
+    name = None
+
+    def page_count(self, path):
+        raise NotImplementedError
+
+    def extract(self, path, start, end):
+        """:return: the texts of the pages start to end (excluded), None for a page without text."""
+        raise NotImplementedError
+
+
+class PyPDF2Extractor(PdfExtractor):
+    name = "pypdf2"
+
+    def page_count(self, path):
+        return len(PdfReader(path).pages)
+
+    def extract(self, path, start, end):
+        reader = PdfReader(path)
+        return [reader.pages[i].extract_text() for i in range(start, end)]
+
+
+class PyMuPDFExtractor(PdfExtractor):
+    """MuPDF (C) backend, several times faster than PyPDF2. Requires the optional `pymupdf` package."""
+    name = "pymupdf"
+
+    def page_count(self, path):
+        import fitz
+        with fitz.open(path) as doc:
+            return doc.page_count
+
+    def extract(self, path, start, end):
+        import fitz
+        with fitz.open(path) as doc:
+            return [doc[i].get_text() for i in range(start, end)]
+
+
+EXTRACTORS = {extractor.name: extractor for extractor in (PyPDF2Extractor, PyMuPDFExtractor)}
+
+
+def get_extractor(name=PDF_EXTRACTOR):
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown pdf extractor {name}, available: {', '.join(EXTRACTORS)}")
+    return EXTRACTORS[name]()
+
+
+def _extract_range(name, path, start, end):
+    return get_extractor(name).extract(path, start, end)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(processes=PDF_EXTRACTION_PROCESSES):
+    """Process pool of the worker, created on first use and shared by its threads."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking the threads and locks of a running web worker is unsafe
+            _pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"PDF extraction pool started with {processes} processes")
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def extract_pages(path, extractor=None, processes=PDF_EXTRACTION_PROCESSES, pages_per_task=PDF_EXTRACTION_PAGES_PER_TASK,
+                  total=None):
+    """
+    Extracts the text of the pages of the pdf in order, page ranges are extracted concurrently in the process pool.
+    At most two ranges per process are in flight, the memory used doesn't depend on the number of pages.
+
+    :param path: path of the pdf file, the pool processes open it themselves.
+    :param extractor: PdfExtractor, the PDF_EXTRACTOR backend when not passed.
+    :param processes: size of the pool, 0 extracts in the calling thread.
+    :param total: number of pages of the pdf when the caller knows it already.
+    :return: generator of the page texts.
+    """
+    extractor = extractor or get_extractor()
+    total = extractor.page_count(path) if total is None else total
+    ranges = [(start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task)]
+    if processes <= 0 or len(ranges) <= 1:
+        for start, end in ranges:
+            yield from extractor.extract(path, start, end)
+        return
+
+    pool = get_pool(processes)
+    ranges = iter(ranges)
+    pending = deque()
+
+    def submit():
+        page_range = next(ranges, None)
+        if page_range is not None:
+            pending.append(pool.submit(_extract_range, extractor.name, path, *page_range))
+
+    try:
+        for _ in range(2 * processes):
+            submit()
+        while pending:
+            texts = pending.popleft().result()
+            submit()
+            yield from texts
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from dotenv import load_dotenv
+from app.prompts.pdf_prompt import PDF_SUMMARY_PROMPT, PDF_SECTION_SUMMARY_PROMPT, PDF_MERGE_SUMMARY_PROMPT
+from app.llm_handle.tokenizer import truncate_tokens
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# tokens of document text summarized by one LLM call (map)
+PDF_SUMMARY_SECTION_TOKENS = int(os.getenv('PDF_SUMMARY_SECTION_TOKENS', 4000))
+# partial summaries merged by one LLM call (reduce)
+PDF_SUMMARY_FAN_IN = int(os.getenv('PDF_SUMMARY_FAN_IN', 8))
+# merge levels at most, the final summary is then written from the partial summaries left
+PDF_SUMMARY_MAX_DEPTH = int(os.getenv('PDF_SUMMARY_MAX_DEPTH', 2))
+# LLM calls in flight per document
+PDF_SUMMARY_CONCURRENCY = int(os.getenv('PDF_SUMMARY_CONCURRENCY', 8))
+# token budget of the prompt of the final summary
+PDF_SUMMARY_MAX_TOKENS = int(os.getenv('PDF_SUMMARY_MAX_TOKENS', 6000))
+
+
+class MapReduceSummarizer:
+    """
+    Summarizes a document of any length with a bounded number of sequential LLM calls.
+
+    The text is added chunk by chunk while the document is read. Every section of `section_tokens` tokens is
+    summarized as soon as it is complete (map), concurrently with the rest of the ingestion. The section summaries
+    are then merged by groups of `fan_in`, every group concurrently (reduce), until at most `fan_in` are left or
+    `max_depth` levels were merged, and the final summary is written from them. The time spent after the document
+    is read depends on the depth, not on the number of pages.
+    A document that fits in one section is summarized by a single call.
+    """
+
+    def __init__(self, llm, section_tokens=PDF_SUMMARY_SECTION_TOKENS, fan_in=PDF_SUMMARY_FAN_IN,
+                 max_depth=PDF_SUMMARY_MAX_DEPTH, concurrency=PDF_SUMMARY_CONCURRENCY):
+        if fan_in < 2:
+            raise ValueError(f"PDF summary fan in must be at least 2, got {fan_in}")
+        self.llm = llm
+        self.section_tokens = section_tokens
+        self.fan_in = fan_in
+        self.max_depth = max_depth
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix="pdf-summary")
+        self.section = []
+        self.tokens = 0
+        self.summaries = []
+
+    def add(self, text, tokens):
+        """Adds the next chunk of the document, `tokens` is its token count."""
+        if self.section and self.tokens + tokens > self.section_tokens:
+            self._map()
+        self.section.append(text)
+        self.tokens += tokens
+
+    def _map(self):
+        self.summaries.append(self.executor.submit(self._summarize_section, "\n\n".join(self.section)))
+        self.section, self.tokens = [], 0
+
+    def _summarize_section(self, section):
+        return self.llm.generate(PDF_SECTION_SUMMARY_PROMPT.format(section=section), task="pdf_section_summary")
+
+    def _merge(self, summaries):
+        return self.llm.generate(PDF_MERGE_SUMMARY_PROMPT.format(summaries="\n\n".join(summaries)),
+                                 task="pdf_summary_merge")
+
+    def _final(self, text):
+        return self.llm.generate(PDF_SUMMARY_PROMPT.format(pdf=truncate_tokens(text, PDF_SUMMARY_MAX_TOKENS,
+                                                                               self.llm.model_name)),
+                                 task="pdf_summary")
+
+    def result(self):
+        """Waits for the section summaries, merges them and returns the summary of the document."""
+        try:
+            if not self.summaries:
+                return self._final("\n\n".join(self.section))
+            if self.section:
+                self._map()
+            summaries = [summary.result() for summary in self.summaries]
+            depth = 0
+            while len(summaries) > self.fan_in and depth < self.max_depth:
+                groups = [summaries[i:i + self.fan_in] for i in range(0, len(summaries), self.fan_in)]
+                summaries = list(self.executor.map(self._merge, groups))
+                depth += 1
+            logger.info(f"Summarized {len(self.summaries)} sections in {depth} merge levels")
+            return self._final("\n\n".join(summaries))
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops the summarization, e.g. when the ingestion failed. Section summaries in progress are not waited for."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,20 +1,34 @@
 from app.prompts.rag_prompts import SYSTEM_PROMPT, RETRIEVE_PROMPT
-from app.prompts.pdf_prompt import PDF_SUMMARY_PROMPT
 from app.llm_handle.llm_models import (
     LLMInterface,
     openai_embedding_model,
     gemini_embedding_model,
+    EMBEDDING_MODEL,
 )
 from app.storage.qdrant import Qdrant
 from app.storage.memory_layer import MemoryManager
-from PyPDF2 import PdfReader
+from app.storage.sql_redis_storage import MEMORY_QUEUE_ENABLED, MEMORY_QUEUE, MEMORY_JOB
+from app.jobs.queue import get_queue
+from app.lib.tracing import traced
+from app.lib.async_clients import close_clients
+from app.rag.semantic_cache import SemanticCache, SEMANTIC_CACHE_ENABLED
+from app.rag.chunker import Chunker, CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS
+from app.lib.pipeline import Pipeline
+from app.rag.pdf_summarizer import MapReduceSummarizer
+from app.llm_handle.prompt_builder import PromptBuilder
+from app.rag.pdf_extractors import get_extractor, extract_pages
+from app.rag.user_pdfs import get_user_pdfs, EXISTS, QUOTA_FULL
+import contextlib
 import traceback
+import tempfile
+import shutil
+import asyncio
+import uuid
 import os
 import numpy as np
 import pandas as pd
 import logging
 import re
-import json
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,7 +38,43 @@ logger = logging.getLogger(__name__)
 VECTOR_COLLECTION = os.getenv("VECTOR_COLLECTION","SITE_INFORMATION")
 USER_COLLECTION = os.getenv("USER_COLLECTION","CHAT_MEMORY")
 USERS_PDF_COLLECTION = os.getenv("PDF_COLLECTION","PDF_COLLECTION")
-PDF_LIMIT=5
+# token budget of the retrieved chunks in RETRIEVE_PROMPT, lowest scoring chunks are dropped first
+RETRIEVED_CONTENT_TOKEN_BUDGET = 3000
+RETRIEVE_PROMPT_MAX_TOKENS = 4000
+# PDF ingestion: chunks per embedding request and per Qdrant upsert
+PDF_EMBED_BATCH_SIZE = int(os.getenv("PDF_EMBED_BATCH_SIZE", 64))
+PDF_UPSERT_BATCH_SIZE = int(os.getenv("PDF_UPSERT_BATCH_SIZE", 256))
+# rank constant of the reciprocal rank fusion of the site and PDF results
+RRF_K = 60
+
+
+@contextlib.contextmanager
+def _pdf_path(file):
+    """Path of the pdf, an uploaded file object is copied to a temporary file the extraction processes can open."""
+    if isinstance(file, (str, os.PathLike)):
+        yield file
+        return
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as copy:
+        shutil.copyfileobj(file, copy)
+        copy.flush()
+        yield copy.name
+
+
+def _fuse_by_rank(*results):
+    """
+    Merges the chunks of several searches by reciprocal rank fusion (score 1 / (RRF_K + rank) in each search).
+    The scores of the searches are not comparable (cosine similarity, or RRF scores of the hybrid search),
+    only the ranks within each search are used.
+    """
+    fused = []
+    for result in results:
+        chunks = sorted((item for item in result.values() if isinstance(item, dict)),
+                        key=lambda item: item.get("score", 0), reverse=True)
+        fused.extend((1 / (RRF_K + rank), item) for rank, item in enumerate(chunks, 1))
+    fused.sort(key=lambda pair: pair[0], reverse=True)
+    return [item for _, item in fused]
+
+
 class RAG:
 
     def __init__(self, llm: LLMInterface,client=Qdrant()) -> None:
@@ -36,70 +86,55 @@ class RAG:
         """
         self.client = client
         self.llm = llm
-        if self.llm.__class__.__name__ == 'GeminiModel':
+        if self.llm.model_provider == 'gemini':
             self.max_token=2000
             self.embedding_model = gemini_embedding_model
             self.embedding_size = 768 # Gemini embedding size
-        elif self.llm.__class__.__name__ == 'OpenAIModel':
+            tokenizer_model = None # approximated with cl100k_base
+        elif self.llm.model_provider == 'openai':
             self.max_token=8000
             self.embedding_model = openai_embedding_model
             self.embedding_size = 1536 # OpenAI embedding size
+            tokenizer_model = EMBEDDING_MODEL
+        # max_token is the input limit of the embedding model, chunks never exceed it
+        self.chunker = Chunker(min(CHUNK_SIZE_TOKENS, self.max_token), CHUNK_OVERLAP_TOKENS, tokenizer_model)
+        self.semantic_cache = SemanticCache(self.client, self.embedding_size) if SEMANTIC_CACHE_ENABLED else None
         logger.info("RAG initialized with LLM model and Qdrant client.")
+        self.user_pdfs = get_user_pdfs()
 
-        self.user_pdf_file = "user_pdf.json"
-        if os.path.exists(self.user_pdf_file):
-            with open(self.user_pdf_file, "r") as f:
-                self.user_pdf = json.load(f)
-        else:
-            self.user_pdf = {}
+    def extract_pages(self, path, extractor, total):
+        """
+        Reads the text of the pdf page by page, page ranges are extracted in the extraction process pool.
 
-    def extract_preprocess_pdf(self,pdf, file_name):
-        logger.info("Extracting text using PyPDF2...")
-        try:
-            reader = PdfReader(pdf)
-            docs = []
-            for page in reader.pages:
-                docs.append(page.extract_text())
-            logger.info("extracting pdf is done")
-
-            #create a topic and summary of the pdf
-            PROMPT = PDF_SUMMARY_PROMPT.format(pdf=docs)
-            summary = self.llm.generate(PROMPT)
-            docs.append(f"{file_name} summary: {summary}")
-            return docs
-        except Exception as e:
-            traceback.print_exc()
+        :param path: path of the pdf file.
+        :param extractor: PdfExtractor backend.
+        :param total: number of pages of the pdf.
+        :return: generator of the page texts.
+        """
+        logger.info(f"Extracting text using {extractor.name}...")
+        yield from extract_pages(path, extractor, total=total)
+        logger.info(f"extracting pdf is done, {total} pages")
 
     def chunking_data(self, datas) -> pd.DataFrame:
         """
-        This function is a placeholder for data chunking implementation, 
-        which will handle dynamic chunking of various types of documents.
+        Chunks documents with the token aware chunker.
+        A list of dicts is already chunked (sample site data) and is used as is, a list of texts
+        is chunked as the pages of one document, every chunk records its page numbers and source offsets.
 
-        :datas:A data to be chunked.
-        :return: DataFrame with chunked data 
+        :param datas: A data to be chunked.
+        :return: DataFrame with chunked data
         """
-        """Process documents to ensure each chunk has at most self.max_token."""
-        
         if isinstance(datas, list) and all(isinstance(d, dict) for d in datas):
             return pd.DataFrame(datas)
-        '''
-        todo:
-        add a token length counter for the models
-        add a chunking mechanism for the dict files 
-        '''
-        result = []
-        for doc in datas:
-            tokens = doc.split()
-            chunks = []
-            while len(tokens) > self.max_token:
-                chunks.append(" ".join(tokens[:self.max_token]))
-                tokens = tokens[self.max_token:]
-            if tokens:
-                chunks.append(" ".join(tokens))
-            result.extend(chunks)
-        df =pd.DataFrame({"content":result})
-        return df
-    
+
+        chunks = self.chunker.chunk_pages(datas)
+        for index, chunk in enumerate(chunks):
+            chunk["chunk_index"] = index
+        logger.info(f"Chunked {len(datas)} pages into {len(chunks)} chunks")
+        # object columns keep the page of the summary None instead of NaN, which isn't valid in the payload
+        return pd.DataFrame(chunks, columns=["content", "chunk_index", "page", "page_end", "start", "end", "tokens"],
+                            dtype=object)
+
     def get_contents_embed(self, df) -> pd.DataFrame:
         """
         Generates dense embeddings for the content column of the provided DataFrame.
@@ -109,7 +144,9 @@ class RAG:
         """
         try:
             logger.info("Generating embeddings for content column.")
-            embeddings = self.embedding_model(df['content'].tolist())
+            embeddings = self.embedding_model(df['content'].tolist(), bulk=True)
+            if len(embeddings) != len(df):
+                raise ValueError(f"Got {len(embeddings)} embeddings for {len(df)} chunks")
             embed = np.array(embeddings)
             embedding = embed.reshape(-1, self.embedding_size) # Dynamic embedding size for Qdrant's format
             df['dense'] = embedding.tolist()  # Add embeddings to DataFrame
@@ -135,78 +172,204 @@ class RAG:
             if df is not None:
                 logger.info(f"Saving data to collection {collection_name}.")
                 response = self.client.upsert_data(collection_name, df,user_id)
+                if collection_name == VECTOR_COLLECTION and self.semantic_cache:
+                    # cached answers may be outdated by the new site content
+                    self._invalidate_semantic_cache()
                 return response
         except Exception as e:
             logger.error(f"Embedding generation failed. Data not upserted to collection {collection_name}")
             logger.error(f"Error saving to collection {collection_name}: {e}")
             traceback.print_exc()
 
-    def save_retrievable_docs(self,file,user_id,filter=True):
+    def _invalidate_semantic_cache(self):
+        """Runs SemanticCache.invalidate from the blocking ingestion, on an event loop of its own."""
+        async def run():
+            try:
+                await self.semantic_cache.invalidate()
+            finally:
+                await close_clients()
+        asyncio.run(run())
+
+    def ingest_pdf(self, file, file_name, user_id, collection_name=USERS_PDF_COLLECTION, progress=None):
+        """
+        Streams the pdf into the collection: pages are extracted, chunked, embedded in batches of
+        PDF_EMBED_BATCH_SIZE chunks and upserted in batches of PDF_UPSERT_BATCH_SIZE, the stages run
+        concurrently and are connected by bounded queues. Memory doesn't grow with the size of the pdf and
+        the first chunks are searchable while the rest of the document is still being read.
+        The sections of the pdf are summarized while it is read (MapReduceSummarizer), its summary is saved last.
+
+        :param file: path or file object of the pdf.
+        :param progress: optional callback progress(stage, step, total), called with the pages saved so far.
+        :return: number of chunks saved.
+        """
+        with _pdf_path(file) as path:
+            return self._ingest_pdf(path, file_name, user_id, collection_name, progress)
+
+    def _ingest_pdf(self, path, file_name, user_id, collection_name, progress):
+        progress = progress or (lambda stage, step=None, total=None: None)
+        extractor = get_extractor()
+        total_pages = extractor.page_count(path)
+        summarizer = MapReduceSummarizer(self.llm)
+
+        def chunk(pages):
+            for index, item in enumerate(self.chunker.stream_pages(pages)):
+                item["chunk_index"] = index
+                summarizer.add(item["content"], item["tokens"])
+                yield item
+
+        def batch(chunks):
+            items = []
+            for item in chunks:
+                items.append(item)
+                if len(items) == PDF_EMBED_BATCH_SIZE:
+                    yield items
+                    items = []
+            if items:
+                yield items
+
+        def embed(batches):
+            for items in batches:
+                yield self._embed_chunks(items)
+
+        saved, pending = 0, []
+        try:
+            for items in Pipeline(self.extract_pages(path, extractor, total_pages), chunk, batch, embed, name="pdf"):
+                pending.extend(items)
+                if len(pending) >= PDF_UPSERT_BATCH_SIZE:
+                    saved += self._upsert_chunks(collection_name, pending, file_name, user_id)
+                    progress("embedding", pending[-1]["page_end"], total_pages)
+                    pending = []
+
+            progress("summarizing")
+            summary = self.chunker.chunk(f"{file_name} summary: {summarizer.result()}")
+            for item in summary:
+                item["chunk_index"] = None
+            pending.extend(self._embed_chunks(summary))
+            saved += self._upsert_chunks(collection_name, pending, file_name, user_id)
+        except BaseException:
+            summarizer.close()
+            # a failed upload can be uploaded again, without duplicating the chunks saved so far
+            if saved:
+                self.client.delete_file(collection_name, user_id, file_name)
+            raise
+        progress("embedding", total_pages, total_pages)
+        logger.info(f"Saved {saved} chunks of {file_name} ({total_pages} pages)")
+        return saved
+
+    def _embed_chunks(self, items):
+        if not items:
+            return items
+        embeddings = self.embedding_model([item["content"] for item in items], bulk=True)
+        if len(embeddings) != len(items):
+            raise ValueError(f"Got {len(embeddings)} embeddings for {len(items)} chunks")
+        for item, embedding in zip(items, embeddings):
+            item["dense"] = embedding
+        return items
+
+    def _upsert_chunks(self, collection_name, chunks, file_name, user_id):
+        if not chunks:
+            return 0
+        # object columns keep the page of the summary None instead of NaN, which isn't valid in the payload
+        df = pd.DataFrame(chunks, columns=["content", "chunk_index", "page", "page_end", "start", "end", "tokens", "dense"],
+                          dtype=object)
+        df["filename"] = file_name
+        # the points of a pdf are upserted in several batches, random ids would collide
+        df["id"] = [str(uuid.uuid4()) for _ in range(len(df))]
+        if self.client.upsert_data(collection_name, df, user_id) is None:
+            raise RuntimeError(f"Failed to upsert {len(df)} chunks of {file_name} to {collection_name}")
+        return len(df)
+
+    @traced("rag.ingest_pdf")
+    def save_retrievable_docs(self,file,user_id,filter=True,file_name=None,progress=None):
+        """
+        :param file_name: name of the file, read from file.filename when it is not passed.
+        :param progress: optional callback progress(stage, step=None, total=None) called during each stage of the ingestion.
+        """
+        progress = progress or (lambda stage, step=None, total=None: None)
         try:
             return_response = {
                             "text": None,
                             "resource": {}
                             }
 
-            if user_id not in self.user_pdf:
-                self.user_pdf[user_id] = {"count": 0, "names": [], "id": None}
-            
-            file_name = file.filename
-            if file_name in self.user_pdf[user_id]["names"]:
+            file_name = file_name or file.filename
+            status, last_id = self.user_pdfs.reserve(user_id, file_name)
+            if status == EXISTS:
                 return_response["text"] = "PDF already exists."
-                return_response["resource"]["id"] = self.user_pdf[user_id]["id"]
+                return_response["resource"]["id"] = last_id
                 return return_response
-            if self.user_pdf[user_id]["count"] >= PDF_LIMIT:
+            if status == QUOTA_FULL:
                 return_response["text"] = "Your quota is full."
-                return_response["resource"]["id"] = self.user_pdf[user_id]["id"]
+                return_response["resource"]["id"] = last_id
                 return return_response
 
-            data = self.extract_preprocess_pdf(file, file_name)
-            saved_data = self.save_doc_to_rag(data=data, file_name=file_name,user_id=user_id,collection_name=USERS_PDF_COLLECTION)
-            
-            self.user_pdf[user_id]["count"]+=1
-            self.user_pdf[user_id]["names"].append(file_name)
-            self.user_pdf[user_id]["id"] = f"{user_id}_{file_name}"
-            
-            with open(self.user_pdf_file, 'w') as f:
-                json.dump(self.user_pdf,f)
-
-            memory = MemoryManager(self.llm,self.client).add_memory(f"pdf file : {file_name}", user_id)
-            return_response["text"] = saved_data
-            return_response["resource"]["id"] = self.user_pdf[user_id]["id"]
+            progress("extracting")
+            try:
+                self.ingest_pdf(file, file_name, user_id, USERS_PDF_COLLECTION, progress)
+            except BaseException:
+                self.user_pdfs.release(user_id, file_name)
+                raise
+            resource_id = self.user_pdfs.saved(user_id, file_name)
+
+            self.save_memory(f"pdf file : {file_name}", user_id)
+            return_response["text"] = "Data Successfully Uploaded"
+            return_response["resource"]["id"] = resource_id
             return_response["resource"]["type"] = "file"
             return return_response
         except:
             traceback.print_exc()
             return_response["text"] = "Error uploading your document."
 
-    def query(self, query_str: str, user_id=None,collection=VECTOR_COLLECTION, filter=None):
+    def save_memory(self, message, user_id):
+        """Queues the memory extraction of the message for the memory worker, it runs inline without the queue."""
+        if MEMORY_QUEUE_ENABLED:
+            try:
+                get_queue(MEMORY_QUEUE).enqueue({"type": MEMORY_JOB, "message": message, "user_id": user_id})
+                return
+            except Exception as e:
+                logger.error(f"Failed to queue the memory of user {user_id}, extracting it now: {e}")
+        try:
+            MemoryManager(self.llm,self.client).add_memory(message, user_id)
+        except Exception as e:
+            # the memory is not retried without the queue, the caller (e.g. the PDF upload) still succeeds
+            logger.error(f"Failed to save the memory of user {user_id}: {e}")
+
+    async def embed_query(self, query_str: str):
+        """
+        Generates the dense embedding of a single query string.
+        The embedding client is blocking, it runs in a worker thread.
+
+        :param query_str: The query string to embed.
+        :return: The embedding as a list or None if the embedding failed.
+        """
+        embeddings = await asyncio.to_thread(self.embedding_model, [query_str])
+        if not embeddings or len(embeddings) == 0:
+            logger.error("Failed to generate dense embeddings for the query.")
+            return None
+        embed = np.array(embeddings)
+        return embed.reshape(-1, self.embedding_size).tolist()[0]
+
+    async def query(self, query_str: str, user_id=None,collection=VECTOR_COLLECTION, filter=None, embedding=None):
         """
         Processes a query string by generating its embeddings and retrieving related content 
         from the Qdrant vector collection.
 
         :param query_str: The query string to process.
         :param user_id: The ID of the user making the query.
+        :param embedding: Precomputed query embedding, generated from query_str when not passed.
         :return: Retrieved content from the collection or None if no content is found.
         """
         try:
             if filter:
                 collection=USERS_PDF_COLLECTION
 
-            logger.info("Query embedding started.")
-            if isinstance(query_str, str):
-                query_str = [query_str]  
-
-            query = {}
-            embeddings = self.embedding_model(query_str)
-            if not embeddings or len(embeddings) == 0:
-                logger.error("Failed to generate dense embeddings for the query.")
-                return None
-
-            embed = np.array(embeddings)
-            query["dense"] = embed.reshape(-1, self.embedding_size).tolist()[0]
+            if embedding is None:
+                logger.info("Query embedding started.")
+                embedding = await self.embed_query(query_str)
+                if embedding is None:
+                    return None
 
-            result = self.client.retrieve_data(collection, query["dense"],user_id,filter)
+            result = await self.client.aretrieve_data(collection, embedding,user_id,filter,query_text=query_str)
             logger.warning("results found for the query.")
             return result
         except Exception as e:
@@ -214,27 +377,93 @@ class RAG:
             traceback.print_exc()
             return {}
 
-    def get_result_from_rag(self, query_str: str, user_id: str):
+    @traced("rag.retrieve")
+    async def retrieve_for_answer(self, query_str: str, user_id: str):
+        """
+        Runs the retrieval part of get_result_from_rag.
+        Answers built only from the public site collection are served from the semantic cache,
+        answers that use the user's PDFs are never cached.
+        The PDF search and the semantic cache lookup run concurrently with the site search.
+
+        :param query_str: The query string to process.
+        :param user_id: The ID of the user making the request.
+        :return: dict with the query embedding, the cached answer (if any), the retrieved content
+                 and whether the generated answer may be stored in the semantic cache, None if embedding failed.
+        """
+        embedding = await self.embed_query(query_str)
+        if embedding is None:
+            return None
+        # read before the site search, an answer generated from content that changed meanwhile is never served
+        cache_version = await self.semantic_cache.version() if self.semantic_cache is not None else None
+
+        site_search = asyncio.ensure_future(self.query(query_str=query_str, user_id=user_id, embedding=embedding))
+        try:
+            pdf_search = self.query(query_str=query_str, user_id=user_id, filter=True, embedding=embedding)
+            if self.semantic_cache is not None:
+                result2, cached_answer = await asyncio.gather(pdf_search,
+                                                              self.semantic_cache.lookup(embedding, cache_version))
+            else:
+                result2, cached_answer = await pdf_search, None
+            pdf_results = {key: value for key, value in (result2 or {}).items() if key != "error"}
+            cacheable = self.semantic_cache is not None and not pdf_results
+            if cacheable and cached_answer is not None:
+                site_search.cancel()
+                return {"embedding": embedding, "cached_answer": cached_answer, "content": None, "cacheable": False,
+                        "cache_version": cache_version}
+            result1 = await site_search or {}
+        except BaseException:
+            site_search.cancel()
+            raise
+        chunks = _fuse_by_rank(result1, pdf_results)
+        return {
+            "embedding": embedding,
+            "cached_answer": None,
+            "content": chunks,
+            "cacheable": cacheable and bool(result1) and "error" not in result1,
+            "cache_version": cache_version,
+        }
+
+    def build_retrieve_prompt(self, query_str, chunks):
+        """
+        Formats RETRIEVE_PROMPT with the retrieved chunks, best scoring first, within the token budget.
+        """
+        formatted = []
+        for item in chunks:
+            text = item.get("content", "")
+            if item.get("authors") and item.get("authors") != "Unknown":
+                text = f"{text} (authors: {item['authors']})"
+            formatted.append(text)
+
+        builder = PromptBuilder(RETRIEVE_PROMPT, model_name=self.llm.model_name,
+                                max_tokens=RETRIEVE_PROMPT_MAX_TOKENS, name="retrieve_prompt")
+        builder.add("query", query_str)
+        builder.add("retrieved_content", formatted, budget=RETRIEVED_CONTENT_TOKEN_BUDGET, priority=1, separator="\n---\n")
+        return builder.build()
+
+    async def get_result_from_rag(self, query_str: str, user_id: str, retrieved=None):
         """
         Retrieves the result for a query by calling the query method 
         and generating a response based on the retrieved content.
 
         :param query_str: The query string to process.
         :param user_id: The ID of the user making the request.
+        :param retrieved: retrieve_for_answer result computed ahead of time (speculative retrieval).
         :return: The result from the LLM generated based on the query and retrieved content.
         """
         try:
             logger.info("Generating result for the query.")
-            result1 = self.query(query_str=query_str, user_id=user_id)
-            result2 = self.query(query_str=query_str, user_id=user_id,filter=True)
-            query_result = {**result1, **result2}
-            if query_result is None:
-                logger.error("No query result to process.")
+            if retrieved is None:
+                retrieved = await self.retrieve_for_answer(query_str, user_id)
+            if retrieved is None:
                 return None
+            if retrieved["cached_answer"] is not None:
+                return {"text": retrieved["cached_answer"]}
 
-            prompt = RETRIEVE_PROMPT.format(query=query_str, retrieved_content=query_result)
-            result = self.llm.generate(prompt)
+            prompt = self.build_retrieve_prompt(query_str, retrieved["content"])
+            result = await self.llm.agenerate(prompt, task="rag_answer")
             logger.info("Result generated successfully.")
+            if retrieved["cacheable"]:
+                await self.semantic_cache.store(query_str, retrieved["embedding"], result, retrieved["cache_version"])
             response = {
                 "text": result
             }
@@ -243,3 +472,26 @@ class RAG:
             logger.error(f"An error occurred while generating the result: {e}")
             traceback.print_exc()
             return None
+
+    async def stream_result_from_rag(self, query_str: str, user_id: str):
+        """
+        Streaming version of get_result_from_rag, yields the answer text as the LLM produces it.
+
+        :param query_str: The query string to process.
+        :param user_id: The ID of the user making the request.
+        """
+        retrieved = await self.retrieve_for_answer(query_str, user_id)
+        if retrieved is None:
+            yield "I can't help with your question."
+            return
+        if retrieved["cached_answer"] is not None:
+            yield retrieved["cached_answer"]
+            return
+
+        prompt = self.build_retrieve_prompt(query_str, retrieved["content"])
+        parts = []
+        async for part in self.llm.agenerate_stream(prompt, task="rag_answer"):
+            parts.append(part)
+            yield part
+        if retrieved["cacheable"]:
+            await self.semantic_cache.store(query_str, retrieved["embedding"], "".join(parts), retrieved["cache_version"])
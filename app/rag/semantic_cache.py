@@ -0,0 +1,142 @@
+from datetime import datetime
+from qdrant_client.http import models
+from dotenv import load_dotenv
+from app.lib.async_clients import get_async_qdrant, get_async_redis
+from app.lib.tracing import span
+from app.lib.metrics import track, count_cache_lookup
+import traceback
+import logging
+import uuid
+import os
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SEMANTIC_CACHE_COLLECTION = os.getenv("SEMANTIC_CACHE_COLLECTION", "RAG_ANSWER_CACHE")
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+
+
+class SemanticCache:
+    """
+    Answer cache for general questions answered from the public site collection.
+    Stores the query embedding together with the final answer and serves it back to any
+    query whose embedding is closer than the similarity threshold.
+    Only answers built exclusively from public content may be stored here, user scoped
+    (PDF) answers must never be put in this cache.
+
+    Every answer records the version of the site content it was retrieved from (a Redis counter shared by
+    the workers), only answers of the current version are served. A change of the site content increments
+    the version, an answer stored afterwards by a request that retrieved the old content is never served.
+    """
+    def __init__(self, client, embedding_size, collection=SEMANTIC_CACHE_COLLECTION, threshold=SEMANTIC_CACHE_THRESHOLD):
+        self.client = client
+        self.embedding_size = embedding_size
+        self.collection = collection
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._collection_ready = False
+
+    @property
+    def _version_key(self):
+        return f"semantic_cache:version:{self.collection}"
+
+    async def version(self):
+        """
+        Current version of the site content, read before retrieving it and passed to lookup and store.
+        None when it can't be read, the cache is then bypassed.
+        """
+        try:
+            return int(await get_async_redis().get(self._version_key) or 0)
+        except Exception as e:
+            logger.warning(f"Failed to read the semantic cache version, bypassing the cache: {e}")
+            return None
+
+    async def lookup(self, embedding, version):
+        """
+        :param embedding: dense embedding of the incoming query.
+        :param version: version of the site content.
+        :return: the cached answer or None when no cached query of this version is similar enough.
+        """
+        if version is None:
+            return None
+        with span("semantic_cache.lookup") as lookup_span:
+            try:
+                with track("qdrant", "semantic_cache_lookup"):
+                    result = await get_async_qdrant().search(
+                        collection_name=self.collection,
+                        query_vector=embedding,
+                        query_filter=models.Filter(must=[models.FieldCondition(
+                            key="version", match=models.MatchValue(value=version))]),
+                        with_payload=True,
+                        score_threshold=self.threshold,
+                        limit=1)
+            except Exception:
+                # the collection does not exist until the first answer is stored
+                result = []
+            lookup_span.set(hit=bool(result))
+            count_cache_lookup("semantic", bool(result))
+
+        if result:
+            self.hits += 1
+            point = result[0]
+            logger.info(f"Semantic cache hit for '{point.payload.get('query')}' with score {point.score}")
+            return point.payload.get("answer")
+        self.misses += 1
+        return None
+
+    async def _create_collection(self, client):
+        if self._collection_ready or await client.collection_exists(self.collection):
+            self._collection_ready = True
+            return
+        try:
+            await client.create_collection(
+                self.collection,
+                vectors_config=models.VectorParams(size=self.embedding_size, distance=models.Distance.COSINE))
+            await client.create_payload_index(self.collection, "version", models.PayloadSchemaType.INTEGER)
+        except Exception:
+            # created at the same time by another request or worker
+            if not await client.collection_exists(self.collection):
+                raise
+        self._collection_ready = True
+
+    async def store(self, query, embedding, answer, version):
+        """:param version: version of the site content the answer was generated from."""
+        if version is None:
+            return
+        try:
+            client = get_async_qdrant()
+            await self._create_collection(client)
+            with track("qdrant", "semantic_cache_store"):
+                await client.upsert(
+                    collection_name=self.collection,
+                    points=[models.PointStruct(
+                        id=str(uuid.uuid4()),
+                        vector=embedding,
+                        payload={"query": query, "answer": answer, "version": version,
+                                 "created_at": datetime.utcnow().isoformat()})])
+        except Exception:
+            traceback.print_exc()
+            logger.warning("Failed to store answer in the semantic cache")
+
+    async def invalidate(self):
+        """
+        Outdates every cached answer, called whenever the public collection changes.
+        The answers of the previous versions are then deleted, the collection itself is kept.
+        """
+        try:
+            version = await get_async_redis().incr(self._version_key)
+            client = get_async_qdrant()
+            if await client.collection_exists(self.collection):
+                await client.delete(
+                    collection_name=self.collection,
+                    points_selector=models.FilterSelector(filter=models.Filter(should=[
+                        models.FieldCondition(key="version", range=models.Range(lt=version)),
+                        # answers stored before they recorded a version
+                        models.IsEmptyCondition(is_empty=models.PayloadField(key="version"))])))
+            logger.info(f"Semantic cache {self.collection} invalidated, version {version}")
+        except Exception:
+            traceback.print_exc()
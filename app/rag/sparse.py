@@ -0,0 +1,72 @@
+"""
+BM25 sparse vectors computed locally, for the hybrid (dense + sparse) retrieval.
+
+Exact identifiers (ENSG ids, rs numbers, gene symbols) are matched poorly by dense embeddings, the sparse vector
+of a text has one dimension per term so they are matched exactly. The document side holds the BM25 term frequency
+part, the IDF part is computed by Qdrant over the collection (Modifier.IDF of the sparse vector), the query side
+weights each of its terms 1. Terms are hashed to the dimensions, no vocabulary has to be stored or shared.
+"""
+from collections import Counter
+import zlib
+import re
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SPARSE_VECTOR_NAME = "bm25"
+# BM25 parameters, the average length is in terms (CHUNK_SIZE_TOKENS tokens are about 350 terms)
+BM25_K1 = float(os.getenv('BM25_K1', 1.2))
+BM25_B = float(os.getenv('BM25_B', 0.75))
+BM25_AVG_LENGTH = float(os.getenv('BM25_AVG_LENGTH', 350))
+
+# identifiers keep their inner separators: ENSG00000139618.5, HLA-DRB1, rs12345, chr17:7668402
+_TERM = re.compile(r'[a-z0-9]+(?:[-_.:/][a-z0-9]+)*')
+_PARTS = re.compile(r'[-_.:/]')
+_STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers herself him
+himself his how i if in into is it its itself just me more most my myself no nor not now of off on once only or other
+our ours ourselves out over own same she should so some such than that the their theirs them themselves then there
+these they this those through to too under until up very was we were what when where which while who whom why will
+with would you your yours yourself yourselves
+""".split())
+
+
+def terms(text):
+    """Lowercased terms of the text without stopwords, compound identifiers also count their parts (hla-drb1, hla, drb1)."""
+    result = []
+    for term in _TERM.findall(text.lower()):
+        if term in _STOPWORDS:
+            continue
+        result.append(term)
+        if _PARTS.search(term):
+            result.extend(part for part in _PARTS.split(term) if part and part not in _STOPWORDS)
+    return result
+
+
+def _index(term):
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(term.encode("utf-8"))
+
+
+def _vector(weights):
+    """Sums the weights of terms hashed to the same index, returns (indices, values)."""
+    merged = {}
+    for term, weight in weights.items():
+        index = _index(term)
+        merged[index] = merged.get(index, 0.0) + weight
+    return list(merged.keys()), list(merged.values())
+
+
+def document_vector(text):
+    """BM25 term frequency weights of a document (chunk), :return: (indices, values)."""
+    counts = Counter(terms(text or ""))
+    length = sum(counts.values())
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / BM25_AVG_LENGTH)
+    return _vector({term: count * (BM25_K1 + 1) / (count + norm) for term, count in counts.items()})
+
+
+def query_vector(text):
+    """Every distinct term of the query weighs 1, Qdrant applies the IDF. :return: (indices, values)."""
+    return _vector({term: 1.0 for term in set(terms(text or ""))})
@@ -0,0 +1,108 @@
+import threading
+import asyncio
+import logging
+import time
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SPECULATIVE_RETRIEVAL_ENABLED = os.getenv('SPECULATIVE_RETRIEVAL_ENABLED', 'false').lower() == 'true'
+# a rewritten question reuses the speculative retrieval when its embedding is this close to the original query
+SPECULATIVE_RETRIEVAL_MIN_SIMILARITY = float(os.getenv('SPECULATIVE_RETRIEVAL_MIN_SIMILARITY', 0.95))
+
+
+class Speculation:
+    """Retrieval of one request started before its route is known, resolved once with take or discard."""
+    def __init__(self, speculative, query, task):
+        self.speculative = speculative
+        self.query = query
+        self.task = task
+        self.resolved = False
+
+    async def take(self, query):
+        """
+        :param query: the question the RAG tool was routed with.
+        :return: the retrieve_for_answer result when it applies to the question, None otherwise.
+        """
+        if self.resolved:
+            return None
+        self.resolved = True
+        start = time.perf_counter()
+        try:
+            retrieved, duration = await self.task
+        except Exception as e:
+            logger.warning(f"Speculative retrieval failed: {e}")
+            self.speculative.record("failed")
+            return None
+        waited = time.perf_counter() - start
+
+        if retrieved is None or not await self.speculative.same_question(self.query, query, retrieved["embedding"]):
+            self.speculative.record("rewritten")
+            return None
+        self.speculative.record("hit", saved=max(duration - waited, 0.0))
+        return retrieved
+
+    def discard(self, reason):
+        """Drops the speculative retrieval and cancels it if it is still running."""
+        if self.resolved:
+            return
+        self.resolved = True
+        self.task.cancel()
+        # retrieves the error of a retrieval that failed before it was cancelled, so it is not logged as unhandled
+        self.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self.speculative.record(reason)
+
+
+class SpeculativeRetrieval:
+    """
+    Starts the cheap part of RAG (query embedding, PDF and SITE_INFORMATION searches, semantic cache lookup)
+    as a task while the conversation prompt and the tool router are still running.
+    The result is used when the query is routed to the RAG tool with the same (or an almost identical) question,
+    otherwise it is cancelled. Outcomes are counted to measure how often the speculation pays off.
+    """
+    def __init__(self, rag, min_similarity=SPECULATIVE_RETRIEVAL_MIN_SIMILARITY):
+        self.rag = rag
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "hit": 0, "saved_seconds": 0.0}
+
+    def start(self, query, user_id):
+        """Must be called from inside a coroutine, the retrieval runs on the running event loop."""
+        with self._lock:
+            self._stats["started"] += 1
+        return Speculation(self, query, asyncio.ensure_future(self._retrieve(query, user_id)))
+
+    async def _retrieve(self, query, user_id):
+        start = time.perf_counter()
+        retrieved = await self.rag.retrieve_for_answer(query, user_id)
+        return retrieved, time.perf_counter() - start
+
+    async def same_question(self, speculated, query, speculated_embedding):
+        if " ".join(speculated.lower().split()) == " ".join(query.lower().split()):
+            return True
+        # the embedding of the routed question is needed by the RAG tool anyway and is cached
+        embedding = await self.rag.embed_query(query)
+        if embedding is None:
+            return False
+        a, b = np.array(speculated_embedding), np.array(embedding)
+        similarity = float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+        return similarity >= self.min_similarity
+
+    def record(self, outcome, saved=0.0):
+        with self._lock:
+            self._stats[outcome] = self._stats.get(outcome, 0) + 1
+            self._stats["saved_seconds"] += saved
+            hit_rate = self._stats["hit"] / self._stats["started"]
+        logger.info(f"Speculative retrieval {outcome}, saved {saved:.2f}s, hit rate {hit_rate:.1%}")
+
+    def stats(self):
+        """Number of speculations started, count of every outcome, hit rate and the retrieval time saved."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = stats["hit"] / stats["started"] if stats["started"] else 0.0
+        return stats
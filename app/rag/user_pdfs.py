@@ -0,0 +1,118 @@
+import threading
+import logging
+import json
+import os
+import redis
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+REDIS_URL = os.getenv('REDIS_URL')
+# pdfs a user can upload
+PDF_LIMIT = int(os.getenv('PDF_LIMIT', 5))
+# file of the uploaded pdfs before they were kept in Redis, imported once
+USER_PDF_FILE = "user_pdf.json"
+
+RESERVED, EXISTS, QUOTA_FULL = 1, 0, -1
+
+# KEYS[1] names of the pdfs of the user (set), KEYS[2] resource id of their last pdf, ARGV: file name, limit
+# the name is checked and added in one step, concurrent uploads (web and job workers) can't exceed the limit
+# a missing resource id (nil) ends the returned table, it is then one element long
+_RESERVE = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    return {0, redis.call('GET', KEYS[2])}
+end
+if redis.call('SCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return {-1, redis.call('GET', KEYS[2])}
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+return {1}
+"""
+
+
+class UserPdfs:
+    """
+    The pdfs uploaded by each user, shared by every process ingesting them: the names in a Redis set
+    `pdfs:<user>` (their count is the quota) and the resource id of the last one in `pdfs:last:<user>`.
+
+    An upload reserves its name before the ingestion, the reservation is released when the ingestion fails.
+    """
+    def __init__(self, url=REDIS_URL, limit=PDF_LIMIT):
+        self.url = url
+        self.limit = limit
+        self._redis = None
+        self._reserve = None
+        self._lock = threading.Lock()
+
+    @property
+    def redis(self):
+        with self._lock:
+            if self._redis is None:
+                self._redis = redis.Redis.from_url(self.url, decode_responses=True)
+                self._reserve = self._redis.register_script(_RESERVE)
+                self._import_file()
+            return self._redis
+
+    @staticmethod
+    def _names_key(user_id):
+        return f"pdfs:{user_id}"
+
+    @staticmethod
+    def _last_key(user_id):
+        return f"pdfs:last:{user_id}"
+
+    def _import_file(self):
+        if not os.path.exists(USER_PDF_FILE):
+            return
+        with open(USER_PDF_FILE, "r") as f:
+            user_pdf = json.load(f)
+        with self._redis.pipeline() as pipe:
+            for user_id, pdfs in user_pdf.items():
+                if pdfs["names"]:
+                    pipe.sadd(self._names_key(user_id), *pdfs["names"])
+                if pdfs["id"]:
+                    pipe.set(self._last_key(user_id), pdfs["id"], nx=True)
+            pipe.execute()
+        try:
+            os.rename(USER_PDF_FILE, f"{USER_PDF_FILE}.imported")
+        except FileNotFoundError:
+            # imported by another process at the same time
+            pass
+        logger.info(f"Imported the pdfs of {len(user_pdf)} users from {USER_PDF_FILE}")
+
+    def reserve(self, user_id, file_name):
+        """
+        Adds the pdf to the user's pdfs unless it is already there or the quota is full.
+
+        :return: (RESERVED, None), (EXISTS, last resource id) or (QUOTA_FULL, last resource id).
+        """
+        # connects and registers the script on first use
+        self.redis
+        result = self._reserve(keys=[self._names_key(user_id), self._last_key(user_id)], args=[file_name, self.limit])
+        return result[0], result[1] if len(result) > 1 else None
+
+    def release(self, user_id, file_name):
+        """Removes a reserved pdf whose ingestion failed, it can be uploaded again."""
+        self.redis.srem(self._names_key(user_id), file_name)
+
+    def saved(self, user_id, file_name):
+        """Records the ingested pdf as the last one of the user, :return: its resource id."""
+        resource_id = f"{user_id}_{file_name}"
+        self.redis.set(self._last_key(user_id), resource_id)
+        return resource_id
+
+
+_user_pdfs = None
+_user_pdfs_lock = threading.Lock()
+
+
+def get_user_pdfs():
+    """Returns the process wide UserPdfs."""
+    global _user_pdfs
+    with _user_pdfs_lock:
+        if _user_pdfs is None:
+            _user_pdfs = UserPdfs()
+        return _user_pdfs
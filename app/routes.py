@@ -1,5 +1,7 @@
 from app.lib.auth import token_required
-from flask import Blueprint, request, current_app,jsonify
+from app.jobs.jobs import get_job_store, JobLimitExceeded
+from app.lib.tracing import trace, current_trace, TRACE_SERVER_TIMING
+from quart import Blueprint, request, current_app,jsonify, Response, g
 from dotenv import load_dotenv
 import traceback
 import json
@@ -9,7 +11,7 @@ main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/query', methods=['POST'])
 @token_required
-def process_query(current_user_id, auth_token):
+async def process_query(current_user_id, auth_token):
     """
     Notes:
     - `query`: Contains the user's question or prompt.
@@ -18,31 +20,45 @@ def process_query(current_user_id, auth_token):
     - `resource`: Identifies the type of resource associated with the `id`. Currently not in use but it may support other types (e.g., "Hypothesis") in the future.
     """
     
+    with trace("query", route="/query", user_id=current_user_id) as request_trace:
+        response = await _process_query(current_user_id, auth_token)
+    response = await current_app.make_response(response)
+    if TRACE_SERVER_TIMING and request_trace is not None:
+        response.headers["Server-Timing"] = request_trace.server_timing()
+    return response
+
+
+async def _process_query(current_user_id, auth_token):
     try:
         ai_assistant = current_app.config['ai_assistant']
+        form = await request.form
+        files = await request.files
     
-        if not request.form and 'file' not in request.files:
+        if not form and 'file' not in files:
             return jsonify({"error": "Null request is invalid format."}), 400
-        if request.form.get('query') and request.form.get('json_query'):
+        if form.get('query') and form.get('json_query'):
             return jsonify({"error": "Invalid format."}), 400
 
 
-        data = request.form
+        data = form
         query = data.get('query', None)
         context = json.loads(data.get('context', '{}'))  
         context_id = context.get('id', None)
         resource = context.get('resource', 'annotation')
+        g.resource = _resource_label(resource)
+        if current_trace() is not None:
+            current_trace().attrs["resource"] = resource
         graph = data.get('graph', None)
         json_query = data.get('json_query',None)
         
         # Handle file upload
         file = None
-        if 'file' in request.files:
-            file = request.files['file']            
+        if 'file' in files:
+            file = files['file']            
 
         # Ensure query exists before processing
         if query:
-            response = ai_assistant.assistant_response(
+            response = await ai_assistant.assistant_response(
                 query=query,
                 file=file,
                 user_id=current_user_id,
@@ -54,7 +70,7 @@ def process_query(current_user_id, auth_token):
         else:
             # Handle case when only context is provided
             print("no query provided")
-            response = ai_assistant.assistant_response(
+            response = await ai_assistant.assistant_response(
                 query=None,
                 file=file,
                 user_id=current_user_id,
@@ -71,4 +87,111 @@ def process_query(current_user_id, auth_token):
         current_app.logger.error(f"Exception: {e}")
         traceback.print_exc()
         return f"Bad Response: {e}", 400
- 
\ No newline at end of file
+
+
+def _resource_label(resource):
+    """Resource type of the request latency metric, unknown values share one label."""
+    return resource if resource in ("annotation", "hypothesis") else "other"
+
+
+def _sse(event, data):
+    """Formats one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@main_bp.route('/query/stream', methods=['POST'])
+@token_required
+async def process_query_stream(current_user_id, auth_token):
+    """
+    Same form fields as `/query`, but the answer is sent as server-sent events:
+    - `stage`: progress of the pipeline ("routing", "retrieving", "generating")
+    - `token`: a piece of the answer text as soon as it is generated
+    - `done`: the complete response, same shape as the `/query` response
+    - `error`: the request could not be processed
+    """
+    ai_assistant = current_app.config['ai_assistant']
+    form = await request.form
+    files = await request.files
+
+    if not form and 'file' not in files:
+        return jsonify({"error": "Null request is invalid format."}), 400
+
+    data = form
+    query = data.get('query', None)
+    context = json.loads(data.get('context', '{}'))
+    g.resource = _resource_label(context.get('resource', 'annotation'))
+    file = files.get('file')
+    if not query and not file and not context.get('id'):
+        return jsonify({"error": "Invalid format."}), 400
+
+    events = ai_assistant.assistant_stream(
+        query=query,
+        user_id=current_user_id,
+        token=auth_token,
+        graph_id=context.get('id', None),
+        file=file,
+        resource=context.get('resource', 'annotation')
+    )
+
+    async def generate():
+        # headers are sent before the answer is generated, the spans of a stream are only logged
+        with trace("query_stream", route="/query/stream", user_id=current_user_id):
+            async for event, payload in events:
+                yield _sse(event, payload)
+
+    return Response(generate(),
+                    mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+
+
+@main_bp.route('/jobs/pdf', methods=['POST'])
+@token_required
+async def submit_pdf_job(current_user_id, auth_token):
+    """
+    Uploads a PDF (`file` form field) to be ingested in the background.
+    Returns the job id right away, the progress and the result are read from `/jobs/<job_id>`.
+    """
+    ai_assistant = current_app.config['ai_assistant']
+    files = await request.files
+    file = files.get('file')
+    if not file or not file.filename.lower().endswith('.pdf'):
+        return jsonify({"text": "Only PDF files are supported."}), 400
+    try:
+        job_id = await ai_assistant.submit_pdf_job(file, current_user_id)
+    except JobLimitExceeded as e:
+        return jsonify({"text": str(e)}), 429
+    return jsonify({"job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+
+@main_bp.route('/jobs/hypothesis', methods=['POST'])
+@token_required
+async def submit_hypothesis_job(current_user_id, auth_token):
+    """
+    Generates a hypothesis for the `query` form field in the background.
+    Returns the job id right away, the progress and the result are read from `/jobs/<job_id>`.
+    """
+    ai_assistant = current_app.config['ai_assistant']
+    form = await request.form
+    query = form.get('query')
+    if not query:
+        return jsonify({"text": "A query is required."}), 400
+    try:
+        job_id = await ai_assistant.submit_hypothesis_job(query, current_user_id, auth_token)
+    except JobLimitExceeded as e:
+        return jsonify({"text": str(e)}), 429
+    return jsonify({"job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+
+@main_bp.route('/jobs/<job_id>', methods=['GET'])
+@token_required
+async def get_job(current_user_id, auth_token, job_id):
+    """
+    Status of a job of the user: `status` is "queued", "running", "succeeded" or "failed",
+    `progress` holds the current stage, `result` the response once the job succeeded and `error` why it failed.
+    """
+    job = await get_job_store().get(job_id, user_id=current_user_id)
+    if job is None:
+        return jsonify({"text": "Job not found."}), 404
+    return jsonify(job)
@@ -0,0 +1,147 @@
+import threading
+import logging
+import json
+import re
+import os
+import numpy as np
+from dotenv import load_dotenv
+from app.prompts.router_prompt import ANNOTATION_TOOL, RAG_TOOL, HYPOTHESIS_TOOL
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# off until the threshold is supported by helper.evaluate_intent_classifier on held out labeled queries
+INTENT_CLASSIFIER_ENABLED = os.getenv('INTENT_CLASSIFIER_ENABLED', 'false').lower() == 'true'
+# queries classified below this probability are routed by the LLM
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv('INTENT_CONFIDENCE_THRESHOLD', 0.7))
+INTENT_EXAMPLES_PATH = os.getenv('INTENT_EXAMPLES_PATH', './config/intent_examples.json')
+# softmax temperature of the cosine similarities to the intent centroids, lower is more confident
+INTENT_TEMPERATURE = float(os.getenv('INTENT_TEMPERATURE', 0.05))
+
+# intent labels of the labeled query files and the tool handling each intent
+INTENT_TOOLS = {
+    "annotation": ANNOTATION_TOOL,
+    "hypothesis": HYPOTHESIS_TOOL,
+    "rag": RAG_TOOL,
+}
+
+RS_ID = re.compile(r'\brs\d+\b', re.IGNORECASE)
+ENSEMBL_ID = re.compile(r'\bENS[A-Z]*[GTP]\d{6,}\b', re.IGNORECASE)
+# upper case tokens such as TP53, BRCA1 or APOE, words that are capitalized for other reasons are excluded
+GENE_SYMBOL = re.compile(r'\b[A-Z][A-Z0-9-]{1,9}\b')
+NOT_GENE_SYMBOLS = {"AI", "DNA", "RNA", "PDF", "GWAS", "SNP", "LDL", "HDL", "GO", "OK", "USA", "FAQ", "URL", "ID", "IDS"}
+SPECULATIVE = re.compile(r'\b(how might|how could|could|might|possibly|hypothes\w*|why|explain\w*|mechanism\w*|propose)\b',
+                         re.IGNORECASE)
+
+
+def load_labeled_queries(path):
+    """
+    Reads a labeled query file, either a JSON list or JSON lines of {"query": ..., "intent": ...}.
+    """
+    with open(path, 'r') as f:
+        content = f.read().strip()
+    if content.startswith('['):
+        examples = json.loads(content)
+    else:
+        examples = [json.loads(line) for line in content.splitlines() if line.strip()]
+    for example in examples:
+        if example.get("intent") not in INTENT_TOOLS:
+            raise ValueError(f"Unknown intent {example.get('intent')} for query {example.get('query')}")
+    return examples
+
+
+class IntentClassifier:
+    """
+    Nearest centroid classifier of the query intent (annotation, hypothesis or rag) on query embeddings,
+    with lexical features for rs IDs, Ensembl IDs, gene symbols and speculative wording.
+
+    The logit of an intent is the cosine similarity of the query to the intent centroid divided by the temperature,
+    plus the weights of the lexical features found in the query, the logits are turned into probabilities with a
+    softmax. A feature weight w multiplies the odds of its intent by e^w whatever the temperature, the features
+    only tip queries the embedding leaves ambiguous.
+    Centroids are computed from the labeled examples on first use, their embeddings go through the embedding cache.
+    """
+    # lexical feature -> logit added to each intent. The gene symbol pattern also matches acronyms (FDA, BMI, COVID)
+    # and rs IDs are also annotated, so neither decides the intent on its own
+    FEATURE_WEIGHTS = {
+        "rs_id": {"hypothesis": 0.5},
+        "ensembl_id": {"annotation": 0.7},
+        "gene_symbol": {"annotation": 0.2},
+        "speculative": {"hypothesis": 0.4},
+    }
+
+    def __init__(self, embed, examples=None, temperature=INTENT_TEMPERATURE):
+        """
+        :param embed: embedding function taking a list of texts (openai_embedding_model or gemini_embedding_model).
+        :param examples: labeled examples, read from INTENT_EXAMPLES_PATH by default.
+        :param temperature: softmax temperature of the cosine similarities, lower is more confident.
+        """
+        self.embed = embed
+        self.examples = examples
+        self.temperature = temperature
+        self.intents = list(INTENT_TOOLS)
+        self._centroids = None
+        self._lock = threading.Lock()
+
+    def _get_centroids(self):
+        with self._lock:
+            if self._centroids is None:
+                examples = self.examples if self.examples is not None else load_labeled_queries(INTENT_EXAMPLES_PATH)
+                vectors = self._normalize(np.array(self.embed([example["query"] for example in examples], bulk=True)))
+                labels = np.array([example["intent"] for example in examples])
+                centroids = []
+                for intent in self.intents:
+                    if not (labels == intent).any():
+                        raise ValueError(f"No labeled examples for intent {intent}")
+                    centroids.append(vectors[labels == intent].mean(axis=0))
+                self._centroids = self._normalize(np.array(centroids))
+                logger.info(f"Intent classifier built from {len(examples)} labeled examples")
+            return self._centroids
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def lexical_features(query):
+        symbols = [token for token in GENE_SYMBOL.findall(query) if token.upper() not in NOT_GENE_SYMBOLS]
+        return {
+            "rs_id": bool(RS_ID.search(query)),
+            "ensembl_id": bool(ENSEMBL_ID.search(query)),
+            "gene_symbol": bool(symbols),
+            "speculative": bool(SPECULATIVE.search(query)),
+        }
+
+    def predict(self, query, embedding=None):
+        """
+        :param embedding: embedding of the query if it was already computed.
+        :return: (intent, probability, probabilities of every intent).
+        """
+        centroids = self._get_centroids()
+        if embedding is None:
+            embedding = self.embed([query])[0]
+        logits = centroids @ self._normalize(np.array(embedding)) / self.temperature
+
+        for feature, present in self.lexical_features(query).items():
+            if present:
+                for intent, weight in self.FEATURE_WEIGHTS[feature].items():
+                    logits[self.intents.index(intent)] += weight
+
+        exp = np.exp(logits - logits.max())
+        probabilities = exp / exp.sum()
+        best = int(probabilities.argmax())
+        return self.intents[best], float(probabilities[best]), dict(zip(self.intents, probabilities.tolist()))
+
+    def classify(self, query, threshold=INTENT_CONFIDENCE_THRESHOLD):
+        """
+        :return: the tool of the predicted intent, None when the prediction is below the confidence threshold.
+        """
+        intent, probability, _ = self.predict(query)
+        if probability < threshold:
+            logger.info(f"Intent {intent} below confidence threshold ({probability:.2f} < {threshold})")
+            return None
+        logger.info(f"Intent classified as {intent} ({probability:.2f})")
+        return INTENT_TOOLS[intent]
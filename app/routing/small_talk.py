@@ -0,0 +1,110 @@
+import threading
+import logging
+import random
+import re
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SMALL_TALK_ENABLED = os.getenv('SMALL_TALK_ENABLED', 'true').lower() == 'true'
+SMALL_TALK_SIMILARITY_THRESHOLD = float(os.getenv('SMALL_TALK_SIMILARITY_THRESHOLD', 0.9))
+# longer messages are never small talk, they are not embedded here
+SMALL_TALK_MAX_WORDS = int(os.getenv('SMALL_TALK_MAX_WORDS', 6))
+
+SMALL_TALK = {
+    "greeting": {
+        "phrases": ["hi", "hello", "hey", "hi there", "hello there", "hey there", "good morning", "good afternoon",
+                    "good evening", "greetings", "how are you", "how are you doing", "whats up"],
+        "responses": ["Hello! How can I help you with your research today?",
+                      "Hi! Ask me about genes, variants, hypotheses or Rejuve."],
+    },
+    "thanks": {
+        "phrases": ["thanks", "thank you", "thanks a lot", "thank you very much", "thx", "ty", "many thanks",
+                    "great thanks", "ok thanks", "perfect thank you", "awesome thanks"],
+        "responses": ["You're welcome! Let me know if there is anything else I can help with.",
+                      "Glad I could help!"],
+    },
+    "acknowledgement": {
+        "phrases": ["ok", "okay", "cool", "great", "nice", "got it", "sounds good", "alright", "perfect", "awesome"],
+        "responses": ["Great! Is there anything else you would like to know?"],
+    },
+    "goodbye": {
+        "phrases": ["bye", "goodbye", "see you", "see you later", "bye bye", "good night", "have a nice day",
+                    "talk to you later"],
+        "responses": ["Goodbye! Come back any time.", "See you later!"],
+    },
+}
+
+
+def normalize(text):
+    """Lower cases the text and drops punctuation, emojis and repeated white space."""
+    text = re.sub(r"[^\w\s]", "", text.lower())
+    return " ".join(text.split())
+
+
+class SmallTalk:
+    """
+    Answers greetings, thanks, acknowledgements and goodbyes from templates without calling the LLM.
+
+    A message is small talk when its normalized text is one of the phrases, or when it is short and its
+    embedding is close enough to one of the phrases (e.g. "hiya!", "thank u so much").
+    """
+    def __init__(self, embed=None, small_talk=SMALL_TALK, threshold=SMALL_TALK_SIMILARITY_THRESHOLD,
+                 max_words=SMALL_TALK_MAX_WORDS):
+        """
+        :param embed: embedding function taking a list of texts, the embedding match is skipped when None.
+        """
+        self.embed = embed
+        self.small_talk = small_talk
+        self.threshold = threshold
+        self.max_words = max_words
+        self.phrases = {normalize(phrase): category for category, item in small_talk.items() for phrase in item["phrases"]}
+        self._vectors = None
+        self._lock = threading.Lock()
+
+    def _get_vectors(self):
+        with self._lock:
+            if self._vectors is None:
+                vectors = np.array(self.embed(list(self.phrases), bulk=True))
+                self._vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            return self._vectors
+
+    def match(self, message):
+        """
+        :return: the small talk category of the message or None.
+        """
+        text = normalize(message or "")
+        if not text or len(text.split()) > self.max_words:
+            return None
+        if text in self.phrases:
+            return self.phrases[text]
+        if self.embed is None:
+            return None
+
+        try:
+            vectors = self._get_vectors()
+            embedding = np.array(self.embed([text])[0])
+        except Exception as e:
+            logger.warning(f"Small talk embedding match failed: {e}")
+            return None
+        similarities = vectors @ (embedding / np.linalg.norm(embedding))
+        best = int(similarities.argmax())
+        if similarities[best] >= self.threshold:
+            phrase = list(self.phrases)[best]
+            logger.info(f"Message {message!r} matched small talk phrase {phrase!r} ({similarities[best]:.2f})")
+            return self.phrases[phrase]
+        return None
+
+    def respond(self, message):
+        """
+        :return: the template answer to the message, None when it is not small talk.
+        """
+        category = self.match(message)
+        if category is None:
+            return None
+        return random.choice(self.small_talk[category]["responses"])
@@ -0,0 +1,89 @@
+import threading
+import asyncio
+import logging
+from app.prompts.router_prompt import TOOL_DEFINITIONS, TOOL_ROUTER_SYSTEM_PROMPT, RAG_TOOL
+from app.lib.tracing import span, annotate
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class ToolRouter:
+    """
+    Routes a query to one of the assistant's tools with a single function calling request
+    and dispatches it to the tool's handler.
+    The tool definitions are built once and shared by every request.
+    When an intent classifier is given, confidently classified queries are routed without the LLM call.
+    """
+    def __init__(self, llm, handlers, tools=TOOL_DEFINITIONS, system_prompt=TOOL_ROUTER_SYSTEM_PROMPT, default_tool=RAG_TOOL,
+                 classifier=None):
+        """
+        :param llm: LLMInterface (or ModelRouter) used for the function calling request.
+        :param handlers: dict mapping every tool name to its async handler, called as handler(query, **kwargs).
+        :param default_tool: tool used when the model does not select a known tool.
+        :param classifier: optional IntentClassifier tried before the LLM.
+        """
+        missing = {tool["function"]["name"] for tool in tools} - set(handlers)
+        if missing:
+            raise ValueError(f"No handler registered for tools {missing}")
+        self.llm = llm
+        self.handlers = handlers
+        self.tools = tools
+        self.system_prompt = system_prompt
+        self.default_tool = default_tool
+        self.classifier = classifier
+        self._lock = threading.Lock()
+        self._stats = {"classifier": 0, "llm": 0}
+
+    async def select(self, query):
+        """
+        :return: the name of the tool that should handle the query.
+        """
+        with span("tool_routing") as routing_span:
+            tool = await self._select(query)
+            routing_span.set(tool=tool)
+            return tool
+
+    async def _select(self, query):
+        if self.classifier is not None:
+            try:
+                # the classifier embeds the query with the blocking embedding client
+                tool = await asyncio.to_thread(self.classifier.classify, query)
+            except Exception as e:
+                logger.error(f"Intent classification failed, routing with the LLM: {e}")
+                tool = None
+            if tool in self.handlers:
+                self._count("classifier")
+                logger.info(f"Query routed to {tool} by the intent classifier")
+                return tool
+
+        self._count("llm")
+        try:
+            tool = await self.llm.aselect_tool(query, self.tools, self.system_prompt, task="tool_routing")
+        except Exception as e:
+            logger.error(f"Tool selection failed, using {self.default_tool}: {e}")
+            return self.default_tool
+
+        if tool not in self.handlers:
+            logger.warning(f"Model selected unknown tool {tool}, using {self.default_tool}")
+            return self.default_tool
+        logger.info(f"Query routed to {tool}")
+        return tool
+
+    def _count(self, router):
+        annotate(routed_by=router)
+        with self._lock:
+            self._stats[router] += 1
+
+    def stats(self):
+        """Number of queries routed by the intent classifier and by the LLM."""
+        with self._lock:
+            return dict(self._stats)
+
+    async def dispatch(self, tool, query, **kwargs):
+        """Awaits the handler of the tool, handlers are coroutine functions called as handler(query, **kwargs)."""
+        with span(f"tool.{tool}"):
+            return await self.handlers[tool](query, **kwargs)
+
+    async def route(self, query, **kwargs):
+        return await self.dispatch(await self.select(query), query, **kwargs)
@@ -1,5 +1,135 @@
+import threading
+import asyncio
+import logging
+import json
+import time
+import os
+import redis
+from quart import websocket
+from dotenv import load_dotenv
+from app.lib.auth import decode_token
+from app.lib.async_clients import get_async_redis
 
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
-def init_socketio():
-    """Initialize the SocketIO instance with Redis message queue for scaling."""
-    pass
+load_dotenv()
+
+REDIS_URL = os.getenv('REDIS_URL')
+SOCKET_ENABLED = os.getenv('SOCKET_ENABLED', 'true' if REDIS_URL else 'false').lower() == 'true'
+SOCKET_PATH = os.getenv('SOCKET_PATH', '/ws')
+
+_redis = None
+_redis_lock = threading.Lock()
+
+
+def room(user_id):
+    """Redis pub/sub channel of the user, every socket of the user (on any web worker) is subscribed to it."""
+    return f"room:{user_id}"
+
+
+def _message(event, data):
+    return json.dumps({"event": event, "data": data, "time": time.time()}, default=str)
+
+
+def _get_redis():
+    global _redis
+    with _redis_lock:
+        if _redis is None:
+            _redis = redis.Redis.from_url(REDIS_URL)
+        return _redis
+
+
+def publish(user_id, event, data):
+    """
+    Sends an event to the sockets of the user from blocking code (worker threads, the job worker).
+    Progress is best effort, a failed publish never fails the operation.
+    """
+    if not SOCKET_ENABLED or user_id is None:
+        return
+    try:
+        _get_redis().publish(room(user_id), _message(event, data))
+    except Exception as e:
+        logger.warning(f"Failed to publish {event} to user {user_id}: {e}")
+
+
+async def apublish(user_id, event, data):
+    """Sends an event to the sockets of the user from a coroutine."""
+    if not SOCKET_ENABLED or user_id is None:
+        return
+    try:
+        await get_async_redis(REDIS_URL).publish(room(user_id), _message(event, data))
+    except Exception as e:
+        logger.warning(f"Failed to publish {event} to user {user_id}: {e}")
+
+
+_background_tasks = set()
+
+
+def progress_publisher(user_id, event):
+    """
+    Returns a progress(stage, step=None, total=None) callback that sends `event` to the sockets of the user.
+    It can be called from coroutines, where the publish does not block the event loop, and from threads.
+    """
+    def progress(stage, step=None, total=None):
+        data = {"stage": stage}
+        if total:
+            data.update(step=step, total=total)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            publish(user_id, event, data)
+            return
+        task = asyncio.ensure_future(apublish(user_id, event, data))
+        # keeps a reference until the task is done, the event loop only holds weak references
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return progress
+
+
+async def _socket():
+    """
+    Forwards the events of the user's room to the socket.
+    The token is passed in the `token` query parameter (browsers can't set headers on a WebSocket)
+    or in the Authorization header. A "ping" message is answered with a "pong" event.
+    """
+    token = websocket.args.get('token') or websocket.headers.get('Authorization')
+    try:
+        user_id, _ = decode_token(token or "")
+    except Exception as e:
+        logger.warning(f"Socket rejected: {e}")
+        await websocket.close(1008)
+        return
+
+    await websocket.accept()
+    pubsub = get_async_redis(REDIS_URL).pubsub()
+    await pubsub.subscribe(room(user_id))
+
+    async def forward():
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                await websocket.send(message["data"])
+
+    forwarding = asyncio.ensure_future(forward())
+    try:
+        while True:
+            if await websocket.receive() == "ping":
+                await websocket.send(_message("pong", {}))
+    finally:
+        # the client disconnected
+        forwarding.cancel()
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+
+
+def init_socketio(app):
+    """
+    Registers the WebSocket channel of the progress events.
+    Redis pub/sub is the message bus between the web workers, the memory and job workers and the sockets,
+    so an event published by any process reaches the user's sockets whichever worker holds them.
+    """
+    if not SOCKET_ENABLED:
+        logger.info("Socket disabled, REDIS_URL is not set")
+        return
+    app.add_websocket(SOCKET_PATH, 'progress_socket', _socket)
+    logger.info(f"Socket registered on {SOCKET_PATH}")
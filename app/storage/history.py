@@ -1,6 +1,9 @@
+import threading
+import asyncio
 import json
 from datetime import datetime
 import logging
+from app.lib.tracing import traced
 
 
 
@@ -11,6 +14,8 @@ logger = logging.getLogger(__name__)
 class History:
     def __init__(self, filename="history.json"):
         self.filename = filename
+        # create_history reads and rewrites the whole file, concurrent writers of a worker would lose entries
+        self._lock = threading.Lock()
         self.history = self._load_history()
     
     def _load_history(self):
@@ -24,6 +29,7 @@ class History:
         with open(self.filename, "w", encoding="utf-8") as file:
             json.dump(self.history, file, indent=4)
     
+    @traced("history.save")
     def create_history(self, user_id, user_message, assistant_answer):
         entry = {
             "user": user_message,
@@ -31,17 +37,22 @@ class History:
             "time": datetime.now().isoformat()
         }
         user_id_str = str(user_id)
-        self.history = self._load_history()
-        
-        if user_id_str not in self.history:
-            self.history[user_id_str] = []
-        
-        # Append new entry
-        self.history[user_id_str].append(entry)
-
-        self.history[user_id_str].sort(key=lambda x: x["time"])
-        self.history[user_id_str] = self.history[user_id_str][-3:]
-        self._save_history()
+        with self._lock:
+            self.history = self._load_history()
+
+            if user_id_str not in self.history:
+                self.history[user_id_str] = []
+
+            # Append new entry
+            self.history[user_id_str].append(entry)
+
+            self.history[user_id_str].sort(key=lambda x: x["time"])
+            self.history[user_id_str] = self.history[user_id_str][-3:]
+            self._save_history()
+
+    async def acreate_history(self, user_id, user_message, assistant_answer):
+        """Async version of create_history, the file is read and written in a worker thread."""
+        await asyncio.to_thread(self.create_history, user_id, user_message, assistant_answer)
     
     def retrieve_user_history(self, user_id):
         user_id_str = str(user_id)
@@ -1,22 +1,23 @@
 
 import uuid
 import json
-import openai
 from app.prompts.memory_prompt import FACT_RETRIEVAL_PROMPT,get_update_memory_messages
 from ..llm_handle.llm_models import LLMInterface,OpenAIModel,get_llm_model,openai_embedding_model
 from app.storage.qdrant import Qdrant
-import traceback
+
+# namespace of the memory ids derived from the memory job, a retried job upserts the same points
+MEMORY_ID_NAMESPACE = uuid.UUID("8f6b1c2e-3d4a-4f5b-9c6d-7e8f9a0b1c2d")
 
 class MemoryManager:
-    def __init__(self, llm):
+    def __init__(self, llm, client=None):
         """
         Initializes the MemoryManager with the necessary components.
         :param llm: The language model instance.
-        :param client: The Qdrant client instance.
+        :param client: The Qdrant client instance, a new connection is opened when it is not passed.
         """
         self.llm = llm
         self.embedding_model = openai_embedding_model
-        self.client = Qdrant()
+        self.client = client or Qdrant()
 
     def get_fact_retrieval_message(self, messages):
         """
@@ -35,82 +36,91 @@ class MemoryManager:
         """
         return self.client._retrieve_memory(user_id, embedding)
 
-    def add_memory(self, messages, user_id):
-        try:
-            """
-            Adds memory for a user.
-            :param messages: Messages from the user.
-            :param user_id: The user ID.
-            :return: A list of returned memories with their details.
-            """
-            if not user_id:
-                return "userid is an obligatory to save memory"
-            if isinstance(messages, str):
-                messages = [{"role": "user", "content": messages}]
-            else:
-                messages = []
-
-            metadata = {}
+    def add_memory(self, messages, user_id, job=None):
+        """
+        Adds memory for a user.
+        Failures (LLM, embedding, Qdrant) are raised, so that the memory worker retries the job.
+        :param messages: Messages from the user.
+        :param user_id: The user ID.
+        :param job: the memory job (app.jobs.queue) when run by the memory worker. The extracted facts are recorded
+                    in its payload, which the queue saves with a failed job, and a retry reuses them. The ids of the
+                    added memories are derived from the job id and the fact, so a retry overwrites the memories its
+                    failed attempt added instead of duplicating them.
+        :return: A list of returned memories with their details.
+        """
+        if not user_id:
+            return "userid is an obligatory to save memory"
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        else:
+            messages = []
+
+        metadata = {}
+        if job is not None and "facts" in job["payload"]:
+            new_retrieved_facts = job["payload"]["facts"]
+        else:
             system_prompt, user_prompt = self.get_fact_retrieval_message(messages)
-            response = self.llm.generate(user_prompt,system_prompt)
+            response = self.llm.generate(user_prompt,system_prompt, task="fact_extraction")
 
             try:
                 new_retrieved_facts = response["facts"]
             except Exception:
                 new_retrieved_facts = []
-
-            retrieved_old_memory = []
-            new_message_embeddings = {}
-
-            for fact in new_retrieved_facts:
-                embedded_message = self.embedding_model(fact)
-                new_message_embeddings[fact] = embedded_message
-                existing_memory = self.qdrant_client_retrieved_user_similar_preferences(user_id, embedded_message[0])
-
-                if existing_memory:
-                    for mem in existing_memory:
-                        retrieved_old_memory.append({"id": mem["id"], "text": mem["content"]})
-
-            temp_uuid_mapping = {str(idx): item["id"] for idx, item in enumerate(retrieved_old_memory)}
-            for idx, item in enumerate(retrieved_old_memory):
-                retrieved_old_memory[idx]["id"] = str(idx)
-
-            function_calling_prompt = get_update_memory_messages(retrieved_old_memory, new_retrieved_facts)
-            new_memories_with_actions = self.llm.generate(prompt=function_calling_prompt)
-            returned_memories = []
-
-            for resp in new_memories_with_actions["memory"]:
-                data = resp["text"]
-                if resp["event"] == "ADD":
-                    memory_id = self.client._create_memory_update_memory(
-                        user_id=user_id, data=data, embedding=new_message_embeddings[data], metadata=metadata
-                    )
-                    returned_memories.append({"id": memory_id, "memory": data, "event": resp["event"]})
-
-                elif resp["event"] == "UPDATE":
-                    self.client._create_memory_update_memory(
-                        user_id=user_id,
-                        memory_id=temp_uuid_mapping[resp["id"]],
-                        data=data,
-                        embedding=new_message_embeddings[data],
-                        metadata=metadata,
-                    )
-                    returned_memories.append(
-                        {
-                            "id": temp_uuid_mapping[resp["id"]],
-                            "memory": data,
-                            "event": resp["event"],
-                            "previous_memory": resp["old_memory"],
-                        }
-                    )
-
-                elif resp["event"] == "NONE":
-                    print("NOOP for Memory.")
-
-            print("returned memories are ",returned_memories)
-            return returned_memories
-        except:
-            traceback.print_exc()
+            if job is not None:
+                job["payload"]["facts"] = new_retrieved_facts
+
+        retrieved_old_memory = []
+        new_message_embeddings = {}
+
+        for fact in new_retrieved_facts:
+            embedded_message = self.embedding_model(fact)
+            new_message_embeddings[fact] = embedded_message
+            existing_memory = self.qdrant_client_retrieved_user_similar_preferences(user_id, embedded_message[0])
+
+            if existing_memory:
+                for mem in existing_memory:
+                    retrieved_old_memory.append({"id": mem["id"], "text": mem["content"]})
+
+        temp_uuid_mapping = {str(idx): item["id"] for idx, item in enumerate(retrieved_old_memory)}
+        for idx, item in enumerate(retrieved_old_memory):
+            retrieved_old_memory[idx]["id"] = str(idx)
+
+        function_calling_prompt = get_update_memory_messages(retrieved_old_memory, new_retrieved_facts)
+        new_memories_with_actions = self.llm.generate(prompt=function_calling_prompt, task="memory_update")
+        returned_memories = []
+
+        for resp in new_memories_with_actions["memory"]:
+            data = resp["text"]
+            if resp["event"] == "ADD":
+                new_memory_id = str(uuid.uuid5(MEMORY_ID_NAMESPACE, f"{job['id']}:{user_id}:{data}")) if job else None
+                memory_id = self.client._create_memory_update_memory(
+                    user_id=user_id, data=data, embedding=new_message_embeddings[data], metadata=metadata,
+                    new_memory_id=new_memory_id
+                )
+                returned_memories.append({"id": memory_id, "memory": data, "event": resp["event"]})
+
+            elif resp["event"] == "UPDATE":
+                self.client._create_memory_update_memory(
+                    user_id=user_id,
+                    memory_id=temp_uuid_mapping[resp["id"]],
+                    data=data,
+                    embedding=new_message_embeddings[data],
+                    metadata=metadata,
+                )
+                returned_memories.append(
+                    {
+                        "id": temp_uuid_mapping[resp["id"]],
+                        "memory": data,
+                        "event": resp["event"],
+                        "previous_memory": resp["old_memory"],
+                    }
+                )
+
+            elif resp["event"] == "NONE":
+                print("NOOP for Memory.")
+
+        print("returned memories are ",returned_memories)
+        return returned_memories
 
 
 
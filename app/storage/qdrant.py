@@ -8,6 +8,10 @@ import pandas as pd
 from typing import List
 from qdrant_client.models import PointStruct, PointIdsList
 from dotenv import load_dotenv
+from app.lib.async_clients import get_async_qdrant
+from app.lib.tracing import span
+from app.lib.metrics import track
+from app.rag.sparse import SPARSE_VECTOR_NAME, document_vector, query_vector
 import uuid
 
 MAX_MEMORY_LIMIT = 10
@@ -20,10 +24,20 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 load_dotenv()
+
+# "dense" searches the embeddings, "hybrid" also searches the BM25 sparse vectors and fuses both rankings (RRF)
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'dense')
+RETRIEVAL_LIMIT = int(os.getenv('RETRIEVAL_LIMIT', 10))
+# candidates of each of the dense and sparse searches the hybrid ranking is fused from
+RETRIEVAL_PREFETCH_LIMIT = int(os.getenv('RETRIEVAL_PREFETCH_LIMIT', 30))
+DENSE_SCORE_THRESHOLD = 0.3
+
+
 class Qdrant:
 
     def __init__(self):
-
+        # collection name -> whether it has the sparse vector, collections created before it don't
+        self._sparse_collections = {}
         try:
             self.client = QdrantClient(os.environ.get('QDRANT_CLIENT','http://localhost:6333'))
             print(f"qdrant connected")
@@ -31,7 +45,7 @@ class Qdrant:
             print('qdrant connection is failed')
 
 
-    def get_create_collection(self,collection_name):
+    def get_create_collection(self,collection_name,vector_size=1536,distance=models.Distance.DOT):
 
         try:
             self.client.get_collection(collection_name)
@@ -39,11 +53,11 @@ class Qdrant:
             print("no such collection exists")
             try:
                 logger.info(f"creating collection {collection_name}")
-                # Get vector size based on model type
-                vector_size = 1536
                 self.client.create_collection(
                     collection_name,
-                    vectors_config=models.VectorParams(size=vector_size, distance=models.Distance.DOT) )
+                    vectors_config=models.VectorParams(size=vector_size, distance=distance),
+                    # IDF is computed by qdrant, the points hold the BM25 term frequencies (app/rag/sparse.py)
+                    sparse_vectors_config={SPARSE_VECTOR_NAME: models.SparseVectorParams(modifier=models.Modifier.IDF)})
                 print(f"Collection '{collection_name}' CREATED.")
             except:
                 traceback.print_exc()
@@ -70,14 +84,21 @@ class Qdrant:
                         df['id'] = [random.randint(100000, 999999) for _ in range(len(df))]
                     
                     self.get_create_collection(collection_name)
-                    self.client.upsert(
-                        collection_name=collection_name,
-                        points=models.Batch(
-                            ids=df["id"].tolist(),
-                            vectors=df["dense"].tolist(),
-                            payloads=payloads_list,
-                        ),
-                    )
+                    vectors = df["dense"].tolist()
+                    if self.has_sparse_vectors(collection_name):
+                        # "" is the unnamed dense vector
+                        vectors = {"": vectors, SPARSE_VECTOR_NAME: [
+                            models.SparseVector(indices=indices, values=values)
+                            for indices, values in map(document_vector, df["content"].tolist())]}
+                    with track("qdrant", "upsert"):
+                        self.client.upsert(
+                            collection_name=collection_name,
+                            points=models.Batch(
+                                ids=df["id"].tolist(),
+                                vectors=vectors,
+                                payloads=payloads_list,
+                            ),
+                        )
                     print("Embedding saved")
                     return "Data Successfully Uploaded"
                 
@@ -85,44 +106,125 @@ class Qdrant:
                     traceback.print_exc()
                     print("Error saving:", e)
             
-    def retrieve_data(self,collection, query,user_id,filter=None):
+    def delete_file(self, collection_name, user_id, file_name):
+        """Deletes the points of a file of the user, e.g. the chunks saved before its ingestion failed."""
+        with track("qdrant", "delete"):
+            self.client.delete(
+                collection_name=collection_name,
+                points_selector=models.FilterSelector(filter=models.Filter(must=[
+                    models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id)),
+                    models.FieldCondition(key="filename", match=models.MatchValue(value=file_name)),
+                ])),
+            )
+
+    def has_sparse_vectors(self, collection_name):
+        if collection_name not in self._sparse_collections:
+            info = self.client.get_collection(collection_name)
+            self._cache_sparse_vectors(collection_name, info)
+        return self._sparse_collections[collection_name]
+
+    async def ahas_sparse_vectors(self, collection_name):
+        if collection_name not in self._sparse_collections:
+            info = await get_async_qdrant().get_collection(collection_name)
+            self._cache_sparse_vectors(collection_name, info)
+        return self._sparse_collections[collection_name]
+
+    def _cache_sparse_vectors(self, collection_name, info):
+        has_sparse = SPARSE_VECTOR_NAME in (info.config.params.sparse_vectors or {})
+        if not has_sparse and RETRIEVAL_MODE == "hybrid":
+            logger.warning(f"Collection {collection_name} has no sparse vectors, it is searched with the dense vectors only. "
+                           f"Recreate it and save its documents again to search it in hybrid mode")
+        self._sparse_collections[collection_name] = has_sparse
+
+    def retrieve_data(self,collection, query,user_id,filter=None,query_text=None):
+        """
+        :param query: embedding of the query.
+        :param query_text: text of the query, the sparse vector of the hybrid mode is computed from it.
+        """
+        try:
+            if query_text and RETRIEVAL_MODE == "hybrid" and self.has_sparse_vectors(collection):
+                with track("qdrant", "hybrid_search"):
+                    result = self.client.query_points(**self._hybrid_request(collection, query, query_text, user_id, filter)).points
+            else:
+                with track("qdrant", "search"):
+                    result = self.client.search(**self._search_request(collection, query, user_id, filter))
+            return self._search_response(result, filter)
+        except:
+            return {"error":"not found"}
+
+    async def aretrieve_data(self,collection, query,user_id,filter=None,query_text=None):
+        """Async version of retrieve_data on the AsyncQdrantClient of the running event loop."""
         try:
+            client = get_async_qdrant()
+            if query_text and RETRIEVAL_MODE == "hybrid" and await self.ahas_sparse_vectors(collection):
+                with span("qdrant.search", collection=collection, mode="hybrid") as search_span, track("qdrant", "hybrid_search"):
+                    result = (await client.query_points(**self._hybrid_request(collection, query, query_text, user_id, filter))).points
+                    search_span.set(results=len(result))
+            else:
+                with span("qdrant.search", collection=collection) as search_span, track("qdrant", "search"):
+                    result = await client.search(**self._search_request(collection, query, user_id, filter))
+                    search_span.set(results=len(result))
+            return self._search_response(result, filter)
+        except:
+            return {"error":"not found"}
+
+    def _user_filter(self, user_id):
+        return models.Filter(
+                        must=[models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id),),])
+
+    def _search_request(self, collection, query, user_id, filter=None):
+        request = dict(
+                collection_name=collection,
+                query_vector=query,
+                with_payload=True,
+                score_threshold=DENSE_SCORE_THRESHOLD,
+                limit=RETRIEVAL_LIMIT)
+        if filter:
+            request["query_filter"] = self._user_filter(user_id)
+        return request
+
+    def _hybrid_request(self, collection, query, query_text, user_id, filter=None):
+        """
+        Dense and sparse candidates are searched in one request and fused by reciprocal rank fusion in qdrant,
+        the score of a point is the sum of 1 / (k + rank) over the two rankings.
+        """
+        query_filter = self._user_filter(user_id) if filter else None
+        prefetch = [models.Prefetch(query=query, filter=query_filter, score_threshold=DENSE_SCORE_THRESHOLD,
+                                    limit=RETRIEVAL_PREFETCH_LIMIT)]
+        indices, values = query_vector(query_text)
+        if indices:
+            prefetch.append(models.Prefetch(query=models.SparseVector(indices=indices, values=values),
+                                            using=SPARSE_VECTOR_NAME, filter=query_filter, limit=RETRIEVAL_PREFETCH_LIMIT))
+        return dict(
+                collection_name=collection,
+                prefetch=prefetch,
+                query=models.FusionQuery(fusion=models.Fusion.RRF),
+                with_payload=True,
+                limit=RETRIEVAL_LIMIT)
+
+    def _search_response(self, result, filter=None):
+        response = {}
+        for i, point in enumerate(result):
             if filter:
-                result = self.client.search(
-                        collection_name=collection,
-                        query_vector=query,
-                        with_payload=True,
-                        score_threshold=0.3,
-                        query_filter= models.Filter(
-                                    must=[models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id),),]),
-                        limit=10)
-                response = {}
-                for i, point in enumerate(result):
-                    response[i] = {
-                        "score": point.score,
-                        "content": point.payload.get('content', 'No content available')
-                    }
-                return response
-        
-            result = self.client.search(
-                    collection_name=collection,
-                    query_vector=query,
-                    with_payload=True,
-                    score_threshold=0.3,
-                    limit=10)
-            response = {}
-            for i, point in enumerate(result):
+                response[i] = {
+                    "score": point.score,
+                    "content": point.payload.get('content', 'No content available')
+                }
+            else:
                 response[i] = {
                     "id": point.id,
                     "score": point.score,
                     "authors": point.payload.get('authors', 'Unknown'),
                     "content": point.payload.get('content', 'No content available')
                 }
-            return response
-        except:
-            return {"error":"not found"}
+        return response
 
-    def _create_memory_update_memory(self,user_id,data, embedding, metadata,memory_id=None):
+    def _create_memory_update_memory(self,user_id,data, embedding, metadata,memory_id=None,new_memory_id=None):
+        """
+        Updates the memory `memory_id`, or adds a new memory (the oldest is deleted over MAX_MEMORY_LIMIT).
+        :param new_memory_id: id of the added memory, adding it again (a retried memory job) overwrites it.
+        Errors are raised, the memory job is then retried.
+        """
 
         self.get_create_collection(USER_COLLECTION)
 
@@ -136,32 +238,31 @@ class Qdrant:
                     vectors=embedding,
                     payloads=data,),)
                 return memory_id
+        memory_id = [new_memory_id or str(uuid.uuid4())]
+        # a memory added by a previous attempt of the job is overwritten, no other memory is deleted for it
+        exists = new_memory_id and self.client.retrieve(USER_COLLECTION, ids=memory_id, with_payload=False)
         # check if a collection have top 10 collections
-        try:
-            memories = self.client.scroll(USER_COLLECTION, with_payload=True)
-            if len(memories[0]) >= MAX_MEMORY_LIMIT:
-                sorted_memories = sorted(
-                    memories[0],
-                    key=lambda memory: memory.payload["created_at_updated_at"]
-                )
-                # Delete the oldest memory
-                oldest_memory_id = sorted_memories[0].id
-                self._delete_memory(oldest_memory_id)
+        memories = self.client.scroll(USER_COLLECTION, with_payload=True)
+        if not exists and len(memories[0]) >= MAX_MEMORY_LIMIT:
+            sorted_memories = sorted(
+                memories[0],
+                key=lambda memory: memory.payload["created_at_updated_at"]
+            )
+            # Delete the oldest memory
+            oldest_memory_id = sorted_memories[0].id
+            self._delete_memory(oldest_memory_id)
 
-                logger.info(f"older memory is being deleted since you have reached the limit {MAX_MEMORY_LIMIT}")
+            logger.info(f"older memory is being deleted since you have reached the limit {MAX_MEMORY_LIMIT}")
 
-            logger.info("uploading new memory")
-            memory_id = [str(uuid.uuid4())]
-            self.client.upsert(
-                    collection_name=USER_COLLECTION,
-                    points=models.Batch(
-                        ids=memory_id,
-                        vectors=embedding,
-                        payloads=data,),)
-            logger.info("collection updated")
-            return memory_id
-        except:
-            traceback.print_exc()
+        logger.info("uploading new memory")
+        self.client.upsert(
+                collection_name=USER_COLLECTION,
+                points=models.Batch(
+                    ids=memory_id,
+                    vectors=embedding,
+                    payloads=data,),)
+        logger.info("collection updated")
+        return memory_id
 
 
     def _delete_memory(self, memory_id):
@@ -5,9 +5,13 @@ from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, F
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 import uuid
-import redis
 import json
+import asyncio
 from app.storage.memory_layer import MemoryManager
+from app.lib.async_clients import get_async_redis
+from app.jobs.queue import get_queue
+from app.lib.tracing import traced
+from app.lib.metrics import tracked, count_cache_lookup
 
 
 # SQLite database configuration
@@ -19,6 +23,12 @@ os.makedirs(DATABASE_DIR, exist_ok=True)
 
 DATABASE_URL = f"sqlite:///{os.path.join(DATABASE_DIR, DATABASE_FILE)}"
 
+# memory extraction and user information writes are processed by the memory worker
+MEMORY_QUEUE_ENABLED = os.getenv('MEMORY_QUEUE_ENABLED', 'true' if os.getenv('REDIS_URL') else 'false').lower() == 'true'
+MEMORY_QUEUE = os.getenv('MEMORY_QUEUE', 'memory_jobs')
+USER_INFORMATION_JOB = "user_information"
+MEMORY_JOB = "memory"
+
 # Create database engine with SQLite optimizations
 engine = create_engine(
     DATABASE_URL,
@@ -55,12 +65,15 @@ def get_db():
 class DatabaseManager:
     def __init__(self):
         self.SessionLocal = SessionLocal
+        self._background_tasks = set()
         # Create tables on initialization
         create_tables()
     
     def get_session(self):
         return self.SessionLocal()
     
+    @traced("sqlite.create_user_information")
+    @tracked("sqlite", "create_user_information")
     def create_user_information(self, user_id: str, user_question: str, 
                                 memory: dict = None, context: dict = None):
         """Create a new user information record and keep only the 3 most recent messages per user."""
@@ -122,6 +135,8 @@ class DatabaseManager:
         finally:
             db.close()
     
+    @traced("sqlite.context_and_memory")
+    @tracked("sqlite", "context_and_memory")
     def get_context_and_memory(self, user_id: str):
         """Extract user questions and memory for a user"""
         user_information = self.get_user_information(user_id)
@@ -193,32 +208,63 @@ class DatabaseManager:
         finally:
             db.close()
 
+    def persist_user_information(self,advanced_llm,query,user_id,context=None,job=None,client=None):
+        """
+        Extracts the memories of the query and stores the user information, run by the memory worker.
+        `job` is the memory job, a retry of the job reuses its facts and overwrites the memories it added
+        (see add_memory). `client` is the Qdrant client of the worker, a new one is opened when it is not passed.
+        """
+        memory_manager = MemoryManager(advanced_llm, client)
+        memory = memory_manager.add_memory(query, user_id, job)
+        memory_value = memory[0]['memory'] if memory and len(memory) > 0 else None
+        user_info = self.create_user_information(
+            user_id=user_id,
+            user_question=query,
+            memory=memory_value,
+            context=context)
+        print(f"Saved user information with question_id: {user_info.question_id}, {user_info.user_question} {user_info.memory} {user_info.context}")
+        return user_info
+
+    @traced("memory.enqueue")
     async def save_user_information(self,advanced_llm,query,user_id,context=None):
-        try:
-            memory_manager = MemoryManager(advanced_llm)
-            memory = memory_manager.add_memory(query, user_id)
-            memory_value = memory[0]['memory'] if memory and len(memory) > 0 else None
-            user_info = self.create_user_information(
-                user_id=user_id,
-                user_question=query,
-                memory=memory_value,
-                context=context)
-            print(f"Saved user information with question_id: {user_info.question_id}, {user_info.user_question} {user_info.memory} {user_info.context}")
-            return user_info
-        except Exception as e:
-            print(f"Error saving user information: {e}")
-            return None
+        """
+        Queues the memory extraction and persistence of a turn for the memory worker (app.jobs.worker),
+        the answer does not wait for it. Without the queue the work runs in a background thread.
+        """
+        job = {"type": USER_INFORMATION_JOB, "query": query, "user_id": user_id, "context": context}
+        if MEMORY_QUEUE_ENABLED:
+            try:
+                return await get_queue(MEMORY_QUEUE).aenqueue(job)
+            except Exception as e:
+                print(f"Error queueing user information, saving it in this worker: {e}")
+
+        async def persist():
+            try:
+                await asyncio.to_thread(self.persist_user_information, advanced_llm, query, user_id, context)
+            except Exception as e:
+                print(f"Error saving user information: {e}")
+        task = asyncio.ensure_future(persist())
+        # keeps a reference until the task is done, the event loop only holds weak references
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return None
        
 # Initialize database manager
 db_manager = DatabaseManager()
 
 REDIS_URL=os.getenv('REDIS_URL')
 class RedisGraphManager:
-    """Redis storage for graphs with automatic 24-hour expiration."""
+    """Redis storage for graphs with automatic 24-hour expiration, on the async Redis client of the running event loop."""
     def __init__(self, url=REDIS_URL):
-        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.url = url
+
+    @property
+    def redis(self):
+        return get_async_redis(self.url)
 
-    def create_graph(self, graph_id=None, graph_summary=None, context=None):
+    @traced("redis.create_graph")
+    @tracked("redis", "create_graph")
+    async def create_graph(self, graph_id=None, graph_summary=None, context=None):
         """Create a new graph that expires in 24 hours."""
         graph_id = graph_id or str(uuid.uuid4())  
         key = f"graph:{graph_id}"
@@ -228,18 +274,19 @@ class RedisGraphManager:
             "graph_summary": graph_summary or "",
             "context": context or ""
         }
-        self.redis.hset(key, mapping=data)
-        self.redis.expire(key, 86400)  # 24 hours in seconds
+        await self.redis.hset(key, mapping=data)
+        await self.redis.expire(key, 86400)  # 24 hours in seconds
         return {"graph_id": graph_id}
 
-    def get_graph_by_id(self, graph_id):
+    @traced("redis.get_graph")
+    @tracked("redis", "get_graph")
+    async def get_graph_by_id(self, graph_id):
         """Retrieve a graph by its ID if it has not yet expired."""
         key = f"graph:{graph_id}"
 
-        if not self.redis.exists(key):
-            return None
-
-        data = self.redis.hgetall(key)
+        data = await self.redis.hgetall(key)
+        # graph and hypothesis summaries are served from here instead of the remote services
+        count_cache_lookup("graph_summary", bool(data))
         if not data:
             return None
-        return {"graph_id": graph_id, **data}
\ No newline at end of file
+        return {"graph_id": graph_id, **data}
@@ -6,10 +6,11 @@ import json
 import tiktoken
 import logging
 import os
-import requests
 from dotenv import load_dotenv
 from app.prompts.summarizer_prompts import SUMMARY_PROMPT, SUMMARY_PROMPT_BASED_ON_USER_QUERY,SUMMARY_PROMPT_CHUNKING,SUMMARY_PROMPT_CHUNKING_USER_QUERY
 from app.storage.sql_redis_storage import RedisGraphManager
+from app.lib.async_clients import get_http_client
+from app.lib.tracing import traced
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -22,9 +23,9 @@ class Graph_Summarizer:
         self.llm = llm
         self.llm = llm
       
-        if self.llm.__class__.__name__ == 'GeminiModel':
+        if self.llm.model_provider == 'gemini':
             self.max_token=2000
-        elif self.llm.__class__.__name__ == 'OpenAIModel':
+        elif self.llm.model_provider == 'openai':
             self.max_token=100000     
         self.tokenizer = tiktoken.get_encoding("cl100k_base")
         self.kg_service_url = os.getenv('ANNOTATION_SERVICE_URL')
@@ -170,7 +171,7 @@ class Graph_Summarizer:
 
             return self.descriptions
 
-    def annotate_by_id(self, graph_id, token, query=None):
+    async def annotate_by_id(self, graph_id, token, query=None):
         logger.info("querying annotation by graph id...")
 
         try:
@@ -180,7 +181,7 @@ class Graph_Summarizer:
                 # Keep your original POST request flow as is
                 logger.debug(f"Sending request to {self.kg_service_url}")
                 json_payload = {"requests": {"question": query}}  
-                response = requests.post(
+                response = await get_http_client().post(
                     self.kg_service_url + '/annotation/' + graph_id,
                     params=params,  
                     json=json_payload,
@@ -196,14 +197,14 @@ class Graph_Summarizer:
 
             else:
                 # First check Redis cache for summary
-                cached_graph = self.redis_graph_manager.get_graph_by_id(graph_id)
+                cached_graph = await self.redis_graph_manager.get_graph_by_id(graph_id)
                 if cached_graph and cached_graph.get("graph_summary"):
                     logger.info(f"Cache hit for graph_id={graph_id} {cached_graph}")
                     return {"text": cached_graph["graph_summary"]}
 
                 # Cache miss, call external API
                 logger.debug(f"Sending request to {self.kg_service_url}")
-                response = requests.get(
+                response = await get_http_client().get(
                     self.kg_service_url + '/annotation/' + graph_id,
                     headers={"Authorization": f"Bearer {token}"}
                 )
@@ -212,7 +213,7 @@ class Graph_Summarizer:
                 summary_text = json_response.get("answer") or json_response.get("title") or ""
 
                 # Store summary in Redis cache for 24 hours
-                self.redis_graph_manager.create_graph(graph_id=graph_id, graph_summary=summary_text)
+                await self.redis_graph_manager.create_graph(graph_id=graph_id, graph_summary=summary_text)
 
                 logger.info(f"response is {summary_text}")
                 logger.info(f"Querying annotation by id is done")
@@ -250,12 +251,16 @@ class Graph_Summarizer:
     #         logger.info("error generating graph information from /annotation endpoint")
     #         return []
 
-    def summary(self,graph=None,user_query=None,graph_id=None, token = None):
+    @traced("graph_summary")
+    async def summary(self,graph=None,user_query=None,graph_id=None, token = None, progress=None):
+        """
+        :param progress: optional callback progress(stage, step, total) called before each batch is summarized.
+        """
 
         try:
             # send the query and the annotation id for the annotation endpoint for the answer
             if graph_id:
-                result = self.annotate_by_id(graph_id=graph_id, query=user_query,token= token)
+                result = await self.annotate_by_id(graph_id=graph_id, query=user_query,token= token)
                 return result
                 
             if graph:
@@ -263,6 +268,8 @@ class Graph_Summarizer:
 
             prev_summery=[]
             for i, batch in enumerate(self.descriptions):  
+                if progress:
+                    progress("summarizing", i + 1, len(self.descriptions))
                 if prev_summery:
                     if user_query:
                         prompt = SUMMARY_PROMPT_CHUNKING_USER_QUERY.format(description=batch,user_query=user_query,prev_summery=prev_summery)
@@ -276,7 +283,7 @@ class Graph_Summarizer:
                         prompt = SUMMARY_PROMPT.format(description=batch)
                         print("prompt", prompt)
 
-                response = self.llm.generate(prompt)
+                response = await self.llm.agenerate(prompt, task="graph_summary")
                 prev_summery = [response]  
                 return {"text": prev_summery}
                 # cleaned_desc = self.clean_and_format_response(prev_summery)
@@ -0,0 +1,19 @@
+import shutil
+import os
+
+# Prometheus multiprocess mode: every worker writes its metrics to PROMETHEUS_MULTIPROC_DIR,
+# /metrics aggregates them. The directory is emptied when gunicorn starts.
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+
+def on_starting(server):
+    if PROMETHEUS_MULTIPROC_DIR:
+        shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # drops the in-flight gauges of a worker that exited
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
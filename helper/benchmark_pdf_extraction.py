@@ -0,0 +1,84 @@
+"""
+Benchmark of the PDF text extraction backends and pool sizes.
+
+Every backend is run with every pool size on the sample PDFs, each run in its own process. It reports the
+pages extracted per second and the peak memory (RSS) of the process reading the pages and of the largest
+extraction process. The pool is started before the timing, like the long lived pool of a worker.
+
+    python -m helper.benchmark_pdf_extraction paper.pdf book.pdf
+    python -m helper.benchmark_pdf_extraction papers/*.pdf --backends pypdf2 pymupdf --processes 0 2 4
+
+Backends that are not installed (pymupdf is optional) are reported as such.
+"""
+import multiprocessing
+import argparse
+import resource
+import time
+from concurrent.futures import wait
+from app.rag.pdf_extractors import EXTRACTORS, get_extractor, get_pool, shutdown_pool, extract_pages, _extract_range
+
+
+def _max_rss_mb(who):
+    # kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _run(backend, processes, paths, results):
+    try:
+        extractor = get_extractor(backend)
+        if processes > 0:
+            pool = get_pool(processes)
+            wait([pool.submit(_extract_range, backend, paths[0], 0, 1) for _ in range(processes)])
+        pages = characters = 0
+        start = time.perf_counter()
+        for path in paths:
+            for text in extract_pages(path, extractor, processes):
+                pages += 1
+                characters += len(text or "")
+        elapsed = time.perf_counter() - start
+        # the pool processes are waited for, their peak memory is then counted in RUSAGE_CHILDREN
+        shutdown_pool()
+        results.put({
+            "pages": pages,
+            "characters": characters,
+            "seconds": elapsed,
+            "rss_mb": _max_rss_mb(resource.RUSAGE_SELF),
+            "pool_rss_mb": _max_rss_mb(resource.RUSAGE_CHILDREN) if processes > 0 else None,
+        })
+    except Exception as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def benchmark(paths, backends, process_counts):
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for backend in backends:
+        for processes in process_counts:
+            results = context.Queue()
+            run = context.Process(target=_run, args=(backend, processes, paths, results))
+            run.start()
+            result = results.get()
+            run.join()
+            rows.append({"backend": backend, "processes": processes, **result})
+    return rows
+
+
+def print_report(rows):
+    print(f"{'backend':<10} {'processes':>9} {'pages':>7} {'seconds':>8} {'pages/s':>8} {'rss MB':>8} {'pool rss MB':>12}")
+    for row in rows:
+        if "error" in row:
+            print(f"{row['backend']:<10} {row['processes']:>9} {row['error']}")
+            continue
+        pool_rss = f"{row['pool_rss_mb']:.1f}" if row["pool_rss_mb"] is not None else "-"
+        print(f"{row['backend']:<10} {row['processes']:>9} {row['pages']:>7} {row['seconds']:>8.2f} "
+              f"{row['pages'] / row['seconds']:>8.1f} {row['rss_mb']:>8.1f} {pool_rss:>12}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the PDF extraction backends on sample PDFs")
+    parser.add_argument("pdfs", nargs="+", help="sample PDF files")
+    parser.add_argument("--backends", nargs="+", default=list(EXTRACTORS), choices=list(EXTRACTORS))
+    parser.add_argument("--processes", nargs="+", type=int, default=[0, 2, 4],
+                        help="pool sizes to compare, 0 extracts in the reading process")
+    args = parser.parse_args()
+    print_report(benchmark(args.pdfs, args.backends, args.processes))
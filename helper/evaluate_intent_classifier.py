@@ -0,0 +1,106 @@
+"""
+Offline evaluation of the intent classifier used for agent routing.
+
+Reports, for a range of confidence thresholds, the share of queries routed locally, the accuracy of the
+local routes, the accuracy with the LLM router as fallback and the routing latency saved.
+
+    python -m helper.evaluate_intent_classifier labeled_queries.jsonl
+    python -m helper.evaluate_intent_classifier labeled_queries.jsonl --no-llm --llm-latency 1.2
+
+The labeled file is a JSON list or JSON lines of {"query": ..., "intent": "annotation" | "hypothesis" | "rag"}.
+Evaluate on queries that are not in the examples the classifier is built from (INTENT_EXAMPLES_PATH).
+"""
+import argparse
+import time
+import os
+from dotenv import load_dotenv
+from app.llm_handle.llm_models import get_llm_model, openai_embedding_model, gemini_embedding_model
+from app.prompts.router_prompt import TOOL_DEFINITIONS, TOOL_ROUTER_SYSTEM_PROMPT
+from app.routing.intent_classifier import IntentClassifier, INTENT_TOOLS, INTENT_EXAMPLES_PATH, load_labeled_queries
+
+load_dotenv()
+
+THRESHOLDS = [0.0, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95]
+
+
+def evaluate(labeled_path, examples_path=INTENT_EXAMPLES_PATH, use_llm=True, llm_latency=None):
+    provider = os.getenv('ADVANCED_LLM_PROVIDER', 'openai')
+    embed = gemini_embedding_model if provider == 'gemini' else openai_embedding_model
+    queries = load_labeled_queries(labeled_path)
+    if os.path.abspath(labeled_path) == os.path.abspath(examples_path):
+        print("Warning: evaluating on the classifier's own examples, the accuracy is optimistic")
+
+    classifier = IntentClassifier(embed, load_labeled_queries(examples_path))
+    classifier.predict("warm up")  # builds the centroids outside of the timings
+    llm = get_llm_model(provider, os.getenv('ADVANCED_LLM_VERSION')) if use_llm else None
+
+    results = []
+    for item in queries:
+        start = time.perf_counter()
+        intent, probability, _ = classifier.predict(item["query"])
+        classifier_latency = time.perf_counter() - start
+
+        llm_tool = None
+        if llm is not None:
+            start = time.perf_counter()
+            try:
+                llm_tool = llm.select_tool(item["query"], TOOL_DEFINITIONS, TOOL_ROUTER_SYSTEM_PROMPT)
+            except Exception as e:
+                print(f"LLM routing failed for {item['query']!r}: {e}")
+            measured = time.perf_counter() - start
+        else:
+            measured = llm_latency or 0.0
+
+        results.append({
+            "query": item["query"],
+            "expected": INTENT_TOOLS[item["intent"]],
+            "classified": INTENT_TOOLS[intent],
+            "probability": probability,
+            "llm": llm_tool,
+            "classifier_latency": classifier_latency,
+            "llm_latency": measured,
+        })
+    return results
+
+
+def report(results):
+    total = len(results)
+    avg_classifier = sum(r["classifier_latency"] for r in results) / total
+    avg_llm = sum(r["llm_latency"] for r in results) / total
+    classifier_accuracy = sum(r["classified"] == r["expected"] for r in results) / total
+    print(f"\n{total} labeled queries")
+    print(f"Classifier accuracy (no threshold): {classifier_accuracy:.1%}, avg latency {avg_classifier * 1000:.0f}ms")
+    has_llm = any(r["llm"] is not None for r in results)
+    if has_llm:
+        llm_accuracy = sum(r["llm"] == r["expected"] for r in results) / total
+        print(f"LLM router accuracy: {llm_accuracy:.1%}, avg latency {avg_llm * 1000:.0f}ms")
+
+    print(f"\n{'threshold':>9} {'local':>7} {'local acc':>9} {'total acc':>9} {'saved/query':>11}")
+    for threshold in THRESHOLDS:
+        local = [r for r in results if r["probability"] >= threshold]
+        local_accuracy = sum(r["classified"] == r["expected"] for r in local) / len(local) if local else 0.0
+        correct = sum(
+            (r["classified"] if r["probability"] >= threshold else r["llm"]) == r["expected"] for r in results
+        )
+        # the embedding is cached and reused by retrieval, so every route pays the classifier latency
+        saved = sum(r["llm_latency"] for r in local) / total - avg_classifier
+        total_accuracy = f"{correct / total:.1%}" if has_llm else "-"
+        print(f"{threshold:>9.2f} {len(local) / total:>7.1%} {local_accuracy:>9.1%} {total_accuracy:>9} "
+              f"{saved * 1000:>9.0f}ms")
+
+    mistakes = [r for r in results if r["classified"] != r["expected"]]
+    if mistakes:
+        print("\nMisclassified queries:")
+        for r in mistakes:
+            print(f"  {r['probability']:.2f} {r['classified']} (expected {r['expected']}): {r['query']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate intent routing accuracy against latency saved")
+    parser.add_argument("labeled", help="labeled query file")
+    parser.add_argument("--examples", default=INTENT_EXAMPLES_PATH, help="examples the classifier is built from")
+    parser.add_argument("--no-llm", action="store_true", help="do not call the LLM router")
+    parser.add_argument("--llm-latency", type=float, default=None,
+                        help="LLM routing latency in seconds assumed with --no-llm")
+    args = parser.parse_args()
+    report(evaluate(args.labeled, args.examples, use_llm=not args.no_llm, llm_latency=args.llm_latency))